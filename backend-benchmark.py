@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import common
+
+DESC_MSG = 'Compares the Perceval and git log backends of perceval-handler.py over local git repos'
+
+BACKENDS = ['perceval', 'git']
+
+
+def main(args):
+    repos = find_repos(os.path.abspath(args.repos_path))
+    if args.max_repos:
+        repos = repos[:args.max_repos]
+    logger.info("Benchmarking %s repos" % len(repos))
+
+    times = {backend: 0.0 for backend in BACKENDS}
+    commits = {backend: 0 for backend in BACKENDS}
+    disk = {backend: 0 for backend in BACKENDS}
+    mismatches = []
+    for repo_path in repos:
+        summaries = {}
+        for backend in BACKENDS:
+            elapsed, size, items = run_backend(backend, repo_path, args.partial_clone)
+            times[backend] += elapsed
+            disk[backend] += size
+            commits[backend] += len(items)
+            summaries[backend] = [summary(item) for item in items]
+            logger.debug("%s: %s commits with %s in %.3f s" %
+                         (repo_path, len(items), backend, elapsed))
+        if summaries['perceval'] != summaries['git']:
+            logger.warning("Different commits for %s" % repo_path)
+            mismatches.append(repo_path)
+
+    result = {
+        'repos': len(repos),
+        'partial_clone': args.partial_clone,
+        'mismatches': mismatches,
+    }
+    for backend in BACKENDS:
+        result[backend] = {
+            'seconds': round(times[backend], 3),
+            'commits': commits[backend],
+            'clone_bytes': disk[backend],
+            'commits_per_second': round(commits[backend] / times[backend], 1) if times[backend] else 0,
+        }
+    result['speedup'] = round(times['perceval'] / times['git'], 2) if times['git'] else 0
+    logger.info("Result: %s" % json.dumps(result, sort_keys=True))
+    if args.output_file:
+        with open(args.output_file, 'w') as ofile:
+            json.dump(result, ofile, indent=4, sort_keys=True)
+
+    if mismatches:
+        raise SystemExit(2)
+
+
+def find_repos(path):
+    """Git repos (bare or with a working tree) under path"""
+    repos = []
+    for root, dirs, files in os.walk(path):
+        if '.git' in dirs or ('HEAD' in files and 'objects' in dirs):
+            repos.append(root)
+            dirs[:] = []
+        dirs.sort()
+    return repos
+
+
+def run_backend(backend, repo_path, partial_clone=False):
+    """
+    Clone and fetch repo_path with a backend. Return the time, the size
+    of the clone and the items
+    """
+    cache_path = tempfile.mkdtemp(prefix='backend-benchmark-')
+    gitpath = os.path.join(cache_path, 'repo')
+    uri = 'file://' + repo_path
+    try:
+        start = time.perf_counter()
+        if backend == 'git':
+            import gitlog
+
+            items = list(gitlog.fetch(uri, gitpath, 'blob:none' if partial_clone else None))
+        else:
+            from perceval.backends.core.git import Git
+
+            items = list(Git(uri=uri, gitpath=gitpath).fetch())
+        return time.perf_counter() - start, path_size(gitpath), items
+    finally:
+        shutil.rmtree(cache_path, ignore_errors=True)
+
+
+def path_size(path):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def summary(item):
+    """Fields of an item read by projects2sql.py"""
+    data = item['data']
+    return (data['commit'], data['Commit'], item['updated_on'],
+            [file_data['file'] for file_data in data.get('files', [])])
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """Parse arguments from the command line"""
+
+    parser = argparse.ArgumentParser(description=DESC_MSG)
+
+    parser.add_argument('--repos-path', dest='repos_path', required=True,
+                        help='Path with the local git repos (e.g. the git directory of crawler-benchmark.py)')
+    parser.add_argument('--max-repos', dest='max_repos', type=int, default=0,
+                        help='Only benchmark the first MAX_REPOS repos')
+    parser.add_argument('--partial-clone', dest='partial_clone', action='store_true',
+                        default=False, help='Clone without file contents (blob:none) with '
+                                            'the git log backend')
+    parser.add_argument('--output-file', dest='output_file', required=False,
+                        help='Path to store the results (JSON)')
+    common.add_logging_arguments(parser, 'backend-benchmark.log')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    try:
+        args = parse_args()
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        main(args)
+    except Exception as e:
+        logger.exception("Exception message:")
+        s = "Error: %s backend-benchmark is exiting now." % str(e)
+        logger.error(s)
+        sys.exit(1)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+import argparse
+import csv
+import logging
+import sys
+import time
+
+import common
+
+DESC_MSG = 'Runs aggregate queries over the commit store written by projects2sql.py'
+
+QUERIES = ['spans', 'authors', 'months']
+
+
+def main(args):
+    import commitstore
+
+    start = time.perf_counter()
+    store = commitstore.CommitStore(args.store_file)
+    logger.info("%s commits loaded in %.3f s" % (len(store), time.perf_counter() - start))
+
+    repo_id = None
+    if args.repo:
+        repo_ids = store.repo_ids(args.repo)
+        if not len(repo_ids):
+            raise ValueError("Repo %s not found in %s" % (args.repo, args.store_file))
+        repo_id = repo_ids[0]
+
+    start = time.perf_counter()
+    writer = csv.writer(sys.stdout)
+    if args.query == 'spans':
+        repo_ids, first, last, counts = store.activity_spans()
+        if repo_id is not None:
+            selected = repo_ids == repo_id
+            repo_ids, first, last, counts = (repo_ids[selected], first[selected],
+                                             last[selected], counts[selected])
+        rows = zip(store.repos[repo_ids], counts, commitstore.format_dates(first),
+                   commitstore.format_dates(last))
+        header = ('repo', 'number_commits', 'first_commit', 'last_commit')
+    elif args.query == 'authors':
+        author_ids, counts = store.author_counts(repo_id)
+        rows = zip(store.authors[author_ids], counts)
+        header = ('email', 'commits')
+    else:
+        months, counts = store.commits_per_month(repo_id)
+        rows = zip(months.astype(str), counts)
+        header = ('month', 'commits')
+    rows = list(rows)
+    logger.info("Query %s computed in %.3f s" % (args.query, time.perf_counter() - start))
+
+    if args.top:
+        rows = rows[:args.top]
+    writer.writerow(header)
+    writer.writerows(rows)
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """Parse arguments from the command line"""
+
+    parser = argparse.ArgumentParser(description=DESC_MSG)
+
+    parser.add_argument('query', choices=QUERIES,
+                        help='spans: first/last commit and commits per repo, '
+                             'authors: commits per author, months: commits per month')
+    parser.add_argument('--store-file', dest='store_file', required=True,
+                        help='Commit store (.npz) written by projects2sql.py --commits-store')
+    parser.add_argument('--repo', dest='repo', required=False,
+                        help='Only the commits of this repo ("owner/name" or "name")')
+    parser.add_argument('--top', dest='top', type=int, default=0,
+                        help='Only the first TOP rows')
+    common.add_logging_arguments(parser, 'commits-query.log')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    try:
+        args = parse_args()
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        main(args)
+    except Exception as e:
+        logger.exception("Exception message:")
+        s = "Error: %s commits-query is exiting now." % str(e)
+        logger.error(s)
+        sys.exit(1)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+
+"""
+Columnar store of the commits written by projects2sql.py.
+
+Every commit is a row of four NumPy columns (repo id, author id, epoch
+timestamp and number of changed files) saved into a .npz file together
+with the repo names and author emails, so the usual aggregates are
+computed with vectorized operations instead of going through MySQL.
+"""
+
+import array
+
+import numpy as np
+
+COLUMNS = ['repo_id', 'author_id', 'date', 'cochanged']
+
+
+class CommitStoreWriter:
+    """Append commits while projects2sql.py runs and save them at the end"""
+
+    def __init__(self, path):
+        self.path = path
+        self.repo_id = array.array('i')
+        self.author_id = array.array('i')
+        self.date = array.array('q')
+        self.cochanged = array.array('i')
+        self.repos = []
+        self.authors = []
+
+    def add_repo(self, repo_id, name):
+        self.repos.append((repo_id, name))
+
+    def add_author(self, author_id, email):
+        self.authors.append((author_id, email))
+
+    def add_commit(self, repo_id, author_id, date, cochanged):
+        self.repo_id.append(repo_id)
+        self.author_id.append(author_id)
+        self.date.append(int(date))
+        self.cochanged.append(cochanged)
+
+    def save(self):
+        # Through a file object, so numpy does not append .npz to the path
+        with open(self.path, 'wb') as sfile:
+            np.savez(sfile,
+                     repo_id=np.frombuffer(self.repo_id, dtype=np.int32),
+                     author_id=np.frombuffer(self.author_id, dtype=np.int32),
+                     date=np.frombuffer(self.date, dtype=np.int64),
+                     cochanged=np.frombuffer(self.cochanged, dtype=np.int32),
+                     repos=names_array(self.repos),
+                     authors=names_array(self.authors))
+        return len(self.date)
+
+
+def names_array(pairs):
+    """Array with the name of every id at its position (ids start at 1)"""
+    names = np.full(max([item_id for item_id, _ in pairs], default=0) + 1, '', dtype=object)
+    for item_id, name in pairs:
+        names[item_id] = name
+    return names.astype(str)
+
+
+class CommitStore:
+    """Read only view over a commit store with the aggregate queries"""
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            for column in COLUMNS:
+                setattr(self, column, data[column])
+            self.repos = data['repos']
+            self.authors = data['authors']
+
+        # projects2sql.py writes the commits repo by repo, but keep the
+        # groups contiguous for reduceat if the store was built otherwise
+        if len(self.repo_id) and np.any(np.diff(self.repo_id) < 0):
+            order = np.argsort(self.repo_id, kind='stable')
+            for column in COLUMNS:
+                setattr(self, column, getattr(self, column)[order])
+
+    def __len__(self):
+        return len(self.date)
+
+    def repo_ids(self, name):
+        """Ids of the repos named "owner/name" or "name" """
+        return np.flatnonzero((self.repos == name) |
+                              (np.char.partition(self.repos, '/')[:, 2] == name))
+
+    def activity_spans(self):
+        """
+        First commit, last commit and number of commits per repo
+
+        :return: Tuple of arrays (repo ids, first dates, last dates, counts)
+        """
+        if not len(self):
+            empty = np.array([], dtype=np.int64)
+            return empty, empty, empty, empty
+        repo_ids, starts, counts = np.unique(self.repo_id, return_index=True,
+                                             return_counts=True)
+        first = np.minimum.reduceat(self.date, starts)
+        last = np.maximum.reduceat(self.date, starts)
+        return repo_ids, first, last, counts
+
+    def author_counts(self, repo_id=None):
+        """
+        Number of commits per author, most active first
+
+        :return: Tuple of arrays (author ids, counts)
+        """
+        author_id = self.author_id if repo_id is None else self.author_id[self.repo_id == repo_id]
+        counts = np.bincount(author_id)
+        author_ids = np.flatnonzero(counts)
+        counts = counts[author_ids]
+        order = np.argsort(-counts, kind='stable')
+        return author_ids[order], counts[order]
+
+    def commits_per_month(self, repo_id=None):
+        """
+        Number of commits per month
+
+        :return: Tuple of arrays (months as datetime64[M], counts)
+        """
+        date = self.date if repo_id is None else self.date[self.repo_id == repo_id]
+        return np.unique(date.astype('datetime64[s]').astype('datetime64[M]'),
+                         return_counts=True)
+
+
+def format_dates(epochs):
+    """Vectorized "%Y-%m-%d %H:%M:%S" formatting of epoch timestamps"""
+    return np.char.replace(np.datetime_as_string(np.asarray(epochs).astype('datetime64[s]')),
+                           'T', ' ')
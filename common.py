@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+"""
+Definitions shared by all the scripts: logging set up, common command
+line options and GHTorrent records.
+"""
+
+import logging
+
+from collections import namedtuple
+
+PROJECT_FIELDS = ['id', 'url', 'owner_id', 'name', 'descriptor',
+                  'language', 'created_at', 'forked_from', 'deleted', 'updated_at']
+
+# Row of the projects table of GHTorrent
+ProjectRecord = namedtuple('ProjectRecord', PROJECT_FIELDS)
+
+
+def configure_logging(log_file, debug_mode_on=False):
+    """Set up the logging and returns a list with the file descriptors
+
+    :param log_file: Path for the log file
+    :param debug_mode_on: If True, the level of the logger will be DEBUG
+
+    :return: List with logging file descriptors
+    """
+
+    if debug_mode_on:
+        logging_mode = logging.DEBUG
+    else:
+        logging_mode = logging.INFO
+
+    logger = logging.getLogger()
+    logger.setLevel(logging_mode)
+
+    # redirect logging to our log file
+    fh = logging.FileHandler(log_file, 'a')
+    fh.setLevel(logging_mode)
+
+    # create console handler with a higher log level
+    ch = logging.StreamHandler()
+    ch.setLevel(logging_mode)
+
+    # create formatter and add it to the handlers
+    formatter = logging.Formatter("[%(asctime)s - %(levelname)s] %(message)s")
+    fh.setFormatter(formatter)
+    ch.setFormatter(formatter)
+
+    logger.addHandler(fh)
+    logger.addHandler(ch)
+
+    keep_fds = [fh.stream.fileno()]
+    return keep_fds
+
+
+def add_logging_arguments(parser, log_file):
+    """Add the log file and debug options to the parser of a script"""
+
+    parser.add_argument('--log-file', dest='log_file', default=log_file,
+                        required=False, help='Path to log file')
+    parser.add_argument('-g', '--debug', dest='debug_mode_on', action='store_true',
+                        default=False, help='Enables debug mode')
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+import argparse
+import csv
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import common
+
+DESC_MSG = 'Load tests github-api.py or perceval-handler.py against github-mock.py and local git repos'
+
+SCRIPTS_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+def main(args):
+    work_path = os.path.abspath(args.work_path)
+    for directory in ['perceval', 'cache', 'git', 'crawl']:
+        if not os.path.exists(os.path.join(work_path, directory)):
+            os.makedirs(os.path.join(work_path, directory))
+
+    repos = [('owner%d' % (num % 97), 'repo%d' % num) for num in range(args.repos)]
+    queue_file = os.path.join(work_path, 'queue.db')
+    if os.path.exists(queue_file):
+        os.remove(queue_file)
+    port = args.port or free_port()
+    mock = start_mock(port, args, work_path)
+    api_url = 'http://127.0.0.1:%d' % port
+
+    try:
+        if args.crawler == 'github-api':
+            command = write_projects_file(repos, api_url, work_path)
+            output_path = os.path.join(work_path, 'crawl', 'trees')
+        else:
+            command = write_urls_file(repos, api_url, work_path, args)
+            output_path = os.path.join(work_path, 'perceval')
+
+        command = [sys.executable, os.path.join(SCRIPTS_PATH, args.crawler + '.py')] + command + \
+            ['--log-file', os.path.join(work_path, args.crawler + '.log')]
+        if args.workers > 1:
+            # The processes share the work queue, as if on several machines
+            command += ['--queue-file', queue_file, '--lease', '60']
+        logger.info("Running %s process(es) of %s over %s repos"
+                    % (args.workers, args.crawler, len(repos)))
+        start = time.perf_counter()
+        processes = [subprocess.Popen(command + ['--worker-id', 'worker%d' % num],
+                                      cwd=os.path.join(work_path, 'crawl'),
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                     for num in range(args.workers)]
+        status = max(process.wait() for process in processes)
+        elapsed = time.perf_counter() - start
+        stats = json.loads(urllib.request.urlopen(api_url + '/_stats').read().decode('utf-8'))
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    fetched = len(os.listdir(output_path)) if os.path.isdir(output_path) else 0
+    result = {
+        'crawler': args.crawler,
+        'exit_status': status,
+        'repos': len(repos),
+        'repos_fetched': fetched,
+        'seconds': round(elapsed, 3),
+        'api_requests': stats['requests'],
+        'api_requests_by_status': stats['by_status'],
+        'requests_per_second': round(stats['requests'] / elapsed, 2) if elapsed else 0,
+        'repos_per_hour': round(fetched / elapsed * 3600, 1) if elapsed else 0,
+        'workers': args.workers,
+    }
+    if args.workers > 1:
+        import workqueue
+
+        result['queue'] = workqueue.WorkQueue(queue_file, args.crawler).counts()
+    logger.info("Result: %s" % json.dumps(result, sort_keys=True))
+    if args.output_file:
+        with open(args.output_file, 'w') as ofile:
+            json.dump(result, ofile, indent=4, sort_keys=True)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_mock(port, args, work_path):
+    """Start github-mock.py and wait until it answers"""
+    command = [sys.executable, os.path.join(SCRIPTS_PATH, 'github-mock.py'), '--port', str(port),
+               '--latency', str(args.latency), '--rate-limit', str(args.rate_limit),
+               '--not-found-rate', str(args.not_found_rate),
+               '--truncated-rate', str(args.truncated_rate),
+               '--log-file', os.path.join(work_path, 'github-mock.log')]
+    mock = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen('http://127.0.0.1:%d/_stats' % port)
+            return mock
+        except IOError:
+            time.sleep(0.1)
+    mock.terminate()
+    raise RuntimeError("GitHub API mock did not start")
+
+
+def write_projects_file(repos, api_url, work_path):
+    """Write the projects file for github-api.py. Return its arguments"""
+    projects_file = os.path.join(work_path, 'projects.csv')
+    with open(projects_file, 'w', newline='') as pfile:
+        writer = csv.writer(pfile)
+        for num, (owner, name) in enumerate(repos):
+            writer.writerow([num + 1, '%s/repos/%s/%s' % (api_url, owner, name), owner[5:], name,
+                             '', 'Python', '2015-01-01 00:00:00', '', '0', '2016-01-01 00:00:00'])
+    return ['--github-token', 'mock', '--projects-file', projects_file]
+
+
+def write_urls_file(repos, api_url, work_path, args):
+    """
+    Write the URLs file for perceval-handler.py and create the git repos
+    it clones from. Return its arguments
+    """
+    git_path = os.path.join(work_path, 'git')
+    urls_file = os.path.join(work_path, 'urls.txt')
+    with open(urls_file, 'w') as ufile:
+        for owner, name in repos:
+            repo_path = os.path.join(git_path, owner, name)
+            if not os.path.exists(repo_path):
+                make_git_repo(repo_path, args.commits_per_repo)
+            ufile.write('https://raw.githubusercontent.com/%s/%s/master/src/file0.py\r\n' % (owner, name))
+    return ['--github-token', 'mock', '--urls-file', urls_file,
+            '--output-path', os.path.join(work_path, 'perceval'),
+            '--perceval-path', os.path.join(work_path, 'cache'),
+            '--api-url', api_url, '--git-url', 'file://' + git_path]
+
+
+def make_git_repo(repo_path, num_commits):
+    """Create a bare git repo with num_commits commits using git fast-import"""
+    os.makedirs(repo_path)
+    subprocess.check_call(['git', 'init', '-q', '--bare', repo_path])
+    # Serve partial clones, as GitHub does
+    subprocess.check_call(['git', '--git-dir', repo_path, 'config', 'uploadpack.allowFilter', 'true'])
+    stream = []
+    date = 1400000000
+    for num in range(num_commits):
+        date += 3600
+        message = 'Commit %d' % num
+        stream.append('commit refs/heads/master\n')
+        stream.append('committer Dev %d <dev%d@example.com> %d +0000\n' % (num % 5, num % 5, date))
+        stream.append('data %d\n%s\n' % (len(message), message))
+        for path in ['src/file%d.py' % (num % 10), 'docs/file%d.md' % (num % 3)]:
+            content = '%s %d\n' % (path, num)
+            stream.append('M 100644 inline %s\ndata %d\n%s\n' % (path, len(content), content))
+    subprocess.run(['git', '--git-dir', repo_path, 'fast-import', '--quiet'],
+                   input=''.join(stream).encode('utf-8'), check=True)
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """Parse arguments from the command line"""
+
+    parser = argparse.ArgumentParser(description=DESC_MSG)
+
+    parser.add_argument('--crawler', dest='crawler', required=True,
+                        choices=['github-api', 'perceval-handler'], help='Crawler to load test')
+    parser.add_argument('--work-path', dest='work_path', default='crawler-benchmark',
+                        required=False, help='Path where the crawler outputs and git repos are stored')
+    parser.add_argument('--repos', dest='repos', type=int, default=100,
+                        help='Number of repos to crawl')
+    parser.add_argument('--commits-per-repo', dest='commits_per_repo', type=int, default=50,
+                        help='Number of commits of each local git repo')
+    parser.add_argument('--port', dest='port', type=int, default=0,
+                        help='Port of the GitHub API mock (a free one by default)')
+    parser.add_argument('--latency', dest='latency', type=float, default=0.05,
+                        help='Seconds the mock waits before answering each request')
+    parser.add_argument('--rate-limit', dest='rate_limit', type=int, default=5000,
+                        help='Requests allowed by the mock per hour, 0 for no limit')
+    parser.add_argument('--not-found-rate', dest='not_found_rate', type=float, default=0.05,
+                        help='Fraction of repos answered with a 404')
+    parser.add_argument('--truncated-rate', dest='truncated_rate', type=float, default=0.01,
+                        help='Fraction of repos with a truncated tree')
+    parser.add_argument('--workers', dest='workers', type=int, default=1,
+                        help='Crawler processes sharing a work queue (--queue-file)')
+    parser.add_argument('--output-file', dest='output_file', required=False,
+                        help='Path to store the results (JSON)')
+    common.add_logging_arguments(parser, 'crawler-benchmark.log')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    try:
+        args = parse_args()
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        main(args)
+    except Exception as e:
+        logger.exception("Exception message:")
+        s = "Error: %s crawler-benchmark is exiting now." % str(e)
+        logger.error(s)
+        sys.exit(1)
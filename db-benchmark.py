@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+import argparse
+import csv
+import logging
+import os
+import re
+import shlex
+import sqlite3
+import subprocess
+import sys
+import time
+
+import common
+import sqlwriter
+
+DESC_MSG = 'Loads the SQL files into a database, builds the secondary indexes and times analysis queries'
+
+SQL_FILES = ['repos.sql', 'people.sql', 'commits.sql', 'interestingfiles.sql', 'cochanges.sql',
+             'users.sql']
+
+# MySQL string literals: single or double quoted, with backslash escapes
+# and doubled quotes
+STRING_LITERAL = re.compile(r"'[^'\\]*(?:(?:\\.|'')[^'\\]*)*'|"
+                            r'"[^"\\]*(?:(?:\\.|"")[^"\\]*)*"', re.DOTALL)
+
+# Backslash escapes and doubled quotes inside each kind of literal
+MYSQL_ESCAPE = {quote: re.compile(r'\\(.)|' + quote * 2, re.DOTALL) for quote in '\'"'}
+MYSQL_ESCAPES = {'0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a'}
+
+# (name, statement) of the representative analysis queries
+QUERIES = [
+    ('commits_per_repo',
+     'SELECT repos_id, COUNT(*) FROM commits GROUP BY repos_id'),
+    ('repo_activity',
+     'SELECT MIN(commit_date), MAX(commit_date) FROM commits WHERE repos_id = 1'),
+    ('author_commits',
+     'SELECT COUNT(*) FROM commits WHERE people_id = 1'),
+    ('files_per_repo',
+     'SELECT r.name, COUNT(*) FROM interestingfiles f JOIN repos r ON f.repo_id = r.id '
+     'GROUP BY r.name'),
+    ('repo_files',
+     'SELECT name FROM interestingfiles WHERE repo_id = 1'),
+    ('file_commits',
+     'SELECT f.name, c.commit_date FROM commits c JOIN interestingfiles f ON f.commits_id = c.id '
+     'WHERE c.repos_id = 1'),
+    ('people_users',
+     'SELECT COUNT(*) FROM people p JOIN users u ON u.email = p.email'),
+    ('repo_cochanges',
+     'SELECT file_a, file_b, cochanges FROM cochanges WHERE repo_id = 1'),
+]
+
+
+def main(args):
+
+    indexes = read_indexes(args.indexes_file)
+
+    if args.mysql_client:
+        db = MySQLClient(args.mysql_client)
+        db.drop_indexes(indexes)
+    else:
+        db = SQLiteDB(args.sqlite_file)
+        db.drop_indexes(indexes)
+        if args.sql_path:
+            db.create_schema(args.structure_file)
+            load_sql_files(db, args.sql_path)
+
+    results = []
+    logger.info("Running queries without secondary indexes")
+    results.append(('(none)', 0.0, time_queries(db, args.repeat)))
+
+    for name, statement in indexes:
+        logger.info("Building index %s" % name)
+        start = time.perf_counter()
+        db.execute(statement)
+        build_time = time.perf_counter() - start
+        results.append((name, build_time, time_queries(db, args.repeat)))
+
+    report(results, args.output_file)
+    db.close()
+
+
+def read_indexes(indexes_file):
+    """
+    Return the (name, statement) pairs of the CREATE INDEX statements
+    of the indexes file
+    """
+    with open(indexes_file, 'r') as ifile:
+        text = ifile.read()
+    return [(match.group(1), match.group(0))
+            for match in re.finditer(r'CREATE INDEX (\w+) ON [^;]+', text)]
+
+
+def index_table(statement):
+    """Table of a CREATE INDEX statement"""
+    return re.match(r'CREATE INDEX \w+ ON (\w+)', statement).group(1)
+
+
+class SQLiteDB:
+    """
+    Local SQLite stand-in of the MySQL database
+    """
+
+    def __init__(self, db_file):
+        self.conn = sqlite3.connect(db_file)
+        # Bulk load: no journal nor fsync, the database can be rebuilt
+        self.conn.execute('PRAGMA journal_mode = OFF')
+        self.conn.execute('PRAGMA synchronous = OFF')
+
+    def drop_indexes(self, indexes):
+        for name, _ in indexes:
+            self.conn.execute('DROP INDEX IF EXISTS %s' % name)
+
+    def create_schema(self, structure_file):
+        """Create the tables of db_structure.sql, MySQL-only clauses removed"""
+        with open(structure_file, 'r') as sfile:
+            text = sfile.read()
+        text = re.sub(r'CHARACTER SET \w+ COLLATE \w+', '', text)
+        for statement in text.split(';'):
+            if statement.strip().startswith('CREATE TABLE'):
+                table = statement.split()[2]
+                self.conn.execute('DROP TABLE IF EXISTS %s' % table)
+                self.conn.execute(statement)
+        self.conn.commit()
+
+    def load(self, sql_file):
+        """
+        Execute the statements of a SQL file produced by projects2sql or
+        ghtorrent-users2sql. MySQL string literals are translated for SQLite
+        """
+        lines = []
+        with sqlwriter.open_sql(sql_file) as sfile:
+            for line in sfile:
+                if not lines and line.startswith('USE '):
+                    continue
+                lines.append(line)
+                if line.rstrip().endswith(';'):
+                    statement = translate_literals(''.join(lines))
+                    # None while the ';' is inside a (multiline) literal
+                    if statement is not None:
+                        self.conn.execute(statement)
+                        lines = []
+        self.conn.commit()
+
+    def execute(self, statement):
+        self.conn.execute(statement).fetchall()
+
+    def time_queries(self, queries, repeat):
+        """Return the best time (in seconds) of each query"""
+        timings = []
+        for _, statement in queries:
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                self.execute(statement)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings.append(best)
+        return timings
+
+    def close(self):
+        self.conn.close()
+
+
+def translate_literals(statement):
+    """
+    Rewrite the MySQL string literals of a statement as SQLite ones:
+    single quoted, with doubled quotes and no backslash escapes. Return
+    None if the statement ends inside a literal
+    """
+    parts = []
+    pos = 0
+    for match in STRING_LITERAL.finditer(statement):
+        parts.append(statement[pos:match.start()])
+        literal = match.group(0)
+        quote = literal[0]
+        value = MYSQL_ESCAPE[quote].sub(lambda escape: unescape(escape.group(1), quote),
+                                        literal[1:-1])
+        parts.append("'" + value.replace("'", "''") + "'")
+        pos = match.end()
+    rest = statement[pos:]
+    if "'" in rest or '"' in rest:
+        return None
+    parts.append(rest)
+    return ''.join(parts)
+
+
+def unescape(char, quote):
+    """Character of a backslash escape (char) or of a doubled quote (None)"""
+    if char is None:
+        return quote
+    return MYSQL_ESCAPES.get(char, char)
+
+
+class MySQLClient:
+    """
+    Run the statements through the mysql command line client, e.g.
+    "mysql -u user -pPASS my_database". Data must be already loaded
+    """
+
+    def __init__(self, command):
+        self.command = shlex.split(command) + ['--batch', '--skip-column-names']
+
+    def run(self, script):
+        """Run the statements of script in a single session. Return its output lines"""
+        return subprocess.run(self.command, input=script, check=True, stdout=subprocess.PIPE,
+                              universal_newlines=True).stdout.splitlines()
+
+    def execute(self, statement):
+        self.run(statement + ';')
+
+    def drop_indexes(self, indexes):
+        """Drop the indexes left by a previous run (DROP INDEX has no IF EXISTS in MySQL)"""
+        names = ', '.join("'%s'" % name for name, _ in indexes)
+        existing = set(self.run('SELECT DISTINCT index_name FROM information_schema.statistics '
+                                'WHERE table_schema = DATABASE() AND index_name IN (%s);' % names))
+        for name, statement in indexes:
+            if name in existing:
+                self.execute('DROP INDEX %s ON %s' % (name, index_table(statement)))
+
+    def time_queries(self, queries, repeat):
+        """
+        Return the best time (in seconds) of each query, measured by the
+        server between markers of a single session, so the start of the
+        client and its connection are not counted
+        """
+        script = []
+        for num, (_, statement) in enumerate(queries):
+            for _ in range(repeat):
+                script.append('SET @t = NOW(6);')
+                script.append(statement + ';')
+                script.append("SELECT 'timing', %d, TIMESTAMPDIFF(MICROSECOND, @t, NOW(6));" % num)
+        timings = [None] * len(queries)
+        for line in self.run('\n'.join(script)):
+            fields = line.split('\t')
+            if len(fields) == 3 and fields[0] == 'timing':
+                num, elapsed = int(fields[1]), int(fields[2]) / 1e6
+                timings[num] = elapsed if timings[num] is None else min(timings[num], elapsed)
+        return timings
+
+    def close(self):
+        pass
+
+
+def load_sql_files(db, sql_path):
+    """
+    Load the SQL files listed in the manifest of sql_path (rotated or
+    compressed files), or else the SQL_FILES
+    """
+    names = SQL_FILES
+    manifest = sqlwriter.read_manifest(sql_path)
+    if manifest is not None:
+        tables = [name.split('.')[0] for name in SQL_FILES]
+        entries = sorted((entry for entry in manifest if sqlwriter.entry_name(entry) in tables),
+                         key=lambda entry: (tables.index(sqlwriter.entry_name(entry)), entry['file']))
+        names = [entry['file'] for entry in entries]
+    for name in names:
+        sql_file = os.path.join(sql_path, name)
+        if not os.path.isfile(sql_file):
+            logger.warning("Missing SQL file: %s" % sql_file)
+            continue
+        logger.info("Loading %s" % sql_file)
+        start = time.perf_counter()
+        db.load(sql_file)
+        logger.info("Loaded %s in %.2f s" % (name, time.perf_counter() - start))
+
+
+def time_queries(db, repeat):
+    """Return the best time (in seconds) of each query"""
+    timings = db.time_queries(QUERIES, repeat)
+    for (name, _), best in zip(QUERIES, timings):
+        logger.debug("Query %s: %.4f s" % (name, best))
+    return timings
+
+
+def report(results, output_file):
+    """
+    Log the query times after building each index, and the speedup of
+    each query against the run without secondary indexes
+    """
+    baseline = results[0][2]
+    for index, build_time, timings in results:
+        logger.info("Index %s (build: %.3f s)" % (index, build_time))
+        for (name, _), elapsed, base in zip(QUERIES, timings, baseline):
+            speedup = base / elapsed if elapsed else float('inf')
+            logger.info("    %-18s %10.4f s  x%.1f" % (name, elapsed, speedup))
+
+    if output_file:
+        with open(output_file, 'w') as ofile:
+            writer = csv.writer(ofile)
+            writer.writerow(['index', 'build_time'] + [name for name, _ in QUERIES])
+            for index, build_time, timings in results:
+                writer.writerow([index, '%.6f' % build_time] + ['%.6f' % t for t in timings])
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """Parse arguments from the command line"""
+
+    parser = argparse.ArgumentParser(description=DESC_MSG)
+
+    parser.add_argument('--sqlite-file', dest='sqlite_file', default='benchmark.db',
+                        required=False, help='SQLite database used as stand-in of MySQL')
+    parser.add_argument('--sql-path', dest='sql_path', required=False,
+                        help='Path to the SQL files to load into the SQLite database')
+    parser.add_argument('--mysql-client', dest='mysql_client', required=False,
+                        help='mysql client command to run against an already loaded MySQL database')
+    parser.add_argument('--structure-file', dest='structure_file', default='db_structure.sql',
+                        required=False, help='SQL script with the database structure')
+    parser.add_argument('--indexes-file', dest='indexes_file', default='db_indexes.sql',
+                        required=False, help='SQL script with the secondary indexes')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3,
+                        help='Number of runs of each query (best time is kept)')
+    parser.add_argument('--output-file', dest='output_file', required=False,
+                        help='Path to store the timings (CSV)')
+    common.add_logging_arguments(parser, 'db-benchmark.log')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    try:
+        args = parse_args()
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        main(args)
+    except Exception as e:
+        logger.exception("Exception message:")
+        s = "Error: %s db-benchmark is exiting now." % str(e)
+        logger.error(s)
+        sys.exit(1)
@@ -0,0 +1,13 @@
+USE my_database;
+
+-- Secondary indexes for the analysis joins. Build them after all SQL
+-- files have been loaded: creating them once over the whole table is much
+-- faster than maintaining them row by row during the bulk load.
+
+CREATE INDEX commits_repos_id ON commits (repos_id);
+CREATE INDEX commits_people_id ON commits (people_id);
+CREATE INDEX interestingfiles_commits_id ON interestingfiles (commits_id);
+CREATE INDEX interestingfiles_repo_id ON interestingfiles (repo_id);
+CREATE INDEX cochanges_repo_id ON cochanges (repo_id);
+CREATE INDEX people_email ON people (email);
+CREATE INDEX users_email ON users (email);
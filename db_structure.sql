@@ -32,6 +32,13 @@ CREATE TABLE commits (
     PRIMARY KEY (id)
 );
 
+CREATE TABLE cochanges (
+    repo_id int,
+    file_a varchar(512) CHARACTER SET utf8 COLLATE utf8_unicode_ci,
+    file_b varchar(512) CHARACTER SET utf8 COLLATE utf8_unicode_ci,
+    cochanges int
+);
+
 CREATE TABLE people (
     id int,
     name varchar(255) CHARACTER SET utf8 COLLATE utf8_unicode_ci,
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+import argparse
+import csv
+import email.utils
+import hashlib
+import http.client
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.parse
+
+import common
+import metrics
+import records
+
+DESC_MSG = 'Downloads the files of the URLs produced by hits2urls.py into a content-addressed store'
+
+RAW_URL = 'https://raw.githubusercontent.com'
+
+MANIFEST_FIELDS = ['url', 'status', 'sha', 'size']
+
+# Answers worth retrying: rate limited or server errors
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+CHUNK_SIZE = 64 * 1024
+
+
+def main(args):
+    output_path = os.path.abspath(args.output_path)
+    manifest_file = args.manifest_file or os.path.join(output_path, 'manifest.csv')
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    done = read_manifest(manifest_file)
+    urls = []
+    seen = set(done)
+    if records.is_records(args.urls_file):
+        lines = [url.url for url in records.read_records(args.urls_file, 'url')]
+    else:
+        with open(args.urls_file, 'r') as url_file:
+            lines = url_file.readlines()
+    for line in lines:
+        url = line.strip()
+        if url and url not in seen:
+            seen.add(url)
+            urls.append(url)
+    logger.info("%s URLs to download (%s already in the manifest)" % (len(urls), len(done)))
+
+    jobs = queue.Queue()
+    for url in urls:
+        jobs.put(url)
+
+    new_manifest = not os.path.exists(manifest_file)
+    with open(manifest_file, 'a', newline='') as mfile:
+        manifest = Manifest(mfile, new_manifest)
+        downloader = Downloader(output_path, args.raw_url, args.retries, args.timeout,
+                                RateLimiter(args.max_rate * 1024))
+        workers = [threading.Thread(target=worker, args=(jobs, downloader, manifest))
+                   for _ in range(max(1, args.jobs))]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    logger.info("Downloaded %s files into %s" % (manifest.written, output_path))
+
+
+def read_manifest(manifest_file):
+    """
+    URLs of the manifest that do not have to be downloaded again: the
+    stored ones and the ones missing in GitHub
+    """
+    done = set()
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r', newline='') as mfile:
+            for row in csv.DictReader(mfile):
+                if row['status'] in ('200', '404', '410'):
+                    done.add(row['url'])
+    return done
+
+
+def blob_sha(content):
+    """SHA-1 of the content as a git blob, the same GitHub shows in trees"""
+    sha = hashlib.sha1(b'blob %d\0' % len(content))
+    sha.update(content)
+    return sha.hexdigest()
+
+
+class Manifest:
+    """CSV rows (url, status, sha, size) written as downloads finish"""
+
+    def __init__(self, mfile, write_header):
+        self.mfile = mfile
+        self.writer = csv.writer(mfile)
+        self.lock = threading.Lock()
+        self.written = 0
+        if write_header:
+            self.writer.writerow(MANIFEST_FIELDS)
+
+    def add(self, url, status, sha='', size=0):
+        with self.lock:
+            self.writer.writerow([url, status, sha, size])
+            self.mfile.flush()
+            self.written += 1
+            if not self.written % 1000:
+                logger.info("%s URLs done" % self.written)
+
+
+class RateLimiter:
+    """Token bucket shared by all the workers (bytes per second, 0 for no limit)"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.allowance = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.rate, self.allowance + (now - self.last) * self.rate)
+            self.last = now
+            self.allowance -= amount
+            wait = -self.allowance / self.rate if self.allowance < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class Downloader:
+    """
+    Fetch files keeping a persistent connection per host in each worker
+    thread, and store them by blob SHA so identical files are stored once
+    """
+
+    def __init__(self, output_path, raw_url, retries, timeout, limiter):
+        self.output_path = output_path
+        self.raw_url = raw_url.rstrip('/')
+        self.retries = retries
+        self.timeout = timeout
+        self.limiter = limiter
+        self.local = threading.local()
+
+    def connection(self, scheme, netloc):
+        pool = self.local.__dict__.setdefault('pool', {})
+        if (scheme, netloc) not in pool:
+            if scheme == 'https':
+                pool[scheme, netloc] = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            else:
+                pool[scheme, netloc] = http.client.HTTPConnection(netloc, timeout=self.timeout)
+        return pool[scheme, netloc]
+
+    def close(self, scheme, netloc):
+        pool = self.local.__dict__.get('pool', {})
+        if (scheme, netloc) in pool:
+            pool.pop((scheme, netloc)).close()
+
+    def get(self, url):
+        """Return the HTTP status, the content and the headers of the answer to url"""
+        if url.startswith(RAW_URL):
+            url = self.raw_url + url[len(RAW_URL):]
+        scheme, netloc, path = request_target(url)
+        conn = self.connection(scheme, netloc)
+        try:
+            conn.request('GET', path, headers={'User-Agent': 'ghtools', 'Accept-Encoding': 'identity'})
+            response = conn.getresponse()
+            chunks = []
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.limiter.consume(len(chunk))
+                chunks.append(chunk)
+        except (http.client.HTTPException, OSError):
+            self.close(scheme, netloc)
+            raise
+        if response.will_close:
+            self.close(scheme, netloc)
+        return response.status, b''.join(chunks), response.headers
+
+    def download(self, url):
+        """
+        Download url with retries, after the delay asked by the server
+        (Retry-After) or else with exponential backoff. Return (status,
+        sha, size)
+        """
+        delay = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                metrics.incr('retries')
+                time.sleep(delay if delay is not None else min(2 ** (attempt - 1), 30))
+            delay = None
+            try:
+                status, content, headers = self.get(url)
+            except (http.client.HTTPException, OSError) as e:
+                logger.debug("Error downloading %s: %s" % (url, str(e)))
+                status = 'error'
+                continue
+            if status not in RETRY_STATUS:
+                break
+            delay = retry_after(headers.get('Retry-After'))
+        if status != 200:
+            return status, '', 0
+
+        metrics.incr('bytes_downloaded', len(content))
+        sha = blob_sha(content)
+        self.store(sha, content)
+        return status, sha, len(content)
+
+    def store(self, sha, content):
+        object_path = os.path.join(self.output_path, 'objects', sha[:2], sha[2:])
+        if os.path.exists(object_path):
+            metrics.incr('duplicate_files')
+            return
+        directory = os.path.dirname(object_path)
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = '%s.%s.tmp' % (object_path, threading.get_ident())
+        with open(tmp_path, 'wb') as ofile:
+            ofile.write(content)
+        os.replace(tmp_path, object_path)
+        metrics.incr('files_stored')
+
+
+def request_target(url):
+    """
+    Scheme, host and quoted path of a file URL. The path is the raw file
+    path of the repo, so '#', '?' and '%' are part of the file name
+    """
+    scheme, _, rest = url.partition('://')
+    netloc, _, path = rest.partition('/')
+    return scheme, netloc, urllib.parse.quote('/' + path, safe='/')
+
+
+def retry_after(value):
+    """Seconds to wait from a Retry-After header (seconds or date), None if unknown"""
+    if not value:
+        return None
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def worker(jobs, downloader, manifest):
+    while True:
+        try:
+            url = jobs.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            status, sha, size = downloader.download(url)
+        except Exception as e:
+            logger.error("Unexpected failure with URL %s: %s" % (url, str(e)))
+            continue
+        if status == 200:
+            metrics.incr('downloads')
+        else:
+            metrics.incr('download_errors')
+            logger.warning("Could not download %s (%s)" % (url, status))
+        manifest.add(url, status, sha, size)
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """Parse arguments from the command line"""
+
+    parser = argparse.ArgumentParser(description=DESC_MSG)
+
+    parser.add_argument('--urls-file', dest='urls_file', required=True,
+                        help='Path to URLs file (output from hits2urls.py, lines or records)')
+    parser.add_argument('--output-path', dest='output_path', required=True,
+                        help='Path where the files are stored (objects/<sha>) with the manifest')
+    parser.add_argument('--manifest-file', dest='manifest_file', required=False,
+                        help='Manifest (CSV) of the downloaded URLs, OUTPUT_PATH/manifest.csv by '
+                             'default. URLs already in it are not downloaded again')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=16,
+                        help='Number of concurrent downloads')
+    parser.add_argument('--retries', dest='retries', type=int, default=3,
+                        help='Retries of a download on network or server errors')
+    parser.add_argument('--timeout', dest='timeout', type=float, default=30,
+                        help='Seconds to wait for the server')
+    parser.add_argument('--max-rate', dest='max_rate', type=int, default=0,
+                        help='Max. bandwidth (KB/s) of all the downloads, 0 for no limit')
+    parser.add_argument('--raw-url', dest='raw_url', default=RAW_URL,
+                        help='Base URL the raw files are downloaded from')
+    common.add_logging_arguments(parser, 'download-files.log')
+    metrics.add_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    try:
+        args = parse_args()
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        metrics.run(main, args)
+    except Exception as e:
+        logger.exception("Exception message:")
+        s = "Error: %s download-files is exiting now." % str(e)
+        logger.error(s)
+        sys.exit(1)
@@ -23,20 +23,46 @@
 #
 
 import argparse
+import ast
 import csv
+import io
+import json
 import logging
+import operator
 import os
 import sys
 
-from collections import namedtuple
+import common
+import metrics
+
+from common import PROJECT_FIELDS, ProjectRecord
 
 DESC_MSG = 'Adapt projects.csv file from GHTorrent dump with preliminary filter(s)'
 
 
-def main(args):
+# Column types of the projects cache. Text columns are dictionary-encoded
+# (int32 codes + vocabulary), so equality filters become integer comparisons
+INT_FIELDS = ['id', 'owner_id', 'forked_from', 'deleted']
+DATE_FIELDS = ['created_at', 'updated_at']
+TEXT_FIELDS = ['url', 'name', 'descriptor', 'language']
 
-    formatted_file = format_projects_file(args)
-    filter_projects_file(args, formatted_file)
+
+def main(args):
+    if args.cache_path:
+        if cache_is_stale(args):
+            metrics.incr('cache_misses')
+            formatted_file = format_projects_file(args)
+            with metrics.timer('cache_build'):
+                build_cache(args.cache_path, formatted_file, args.input_file)
+        else:
+            metrics.incr('cache_hits')
+        select_from_cache(args)
+    else:
+        if args.where:
+            logger.error("--where needs a projects cache (--cache-path)")
+            raise SystemExit
+        formatted_file = format_projects_file(args)
+        filter_projects_file(args, formatted_file)
 
 
 def format_projects_file(args):
@@ -69,15 +95,14 @@ def format_projects_file(args):
 
     input_file.close()
     output_file.close()
+    metrics.incr('lines_read', linecounter)
+    metrics.incr('bytes_read', os.path.getsize(os.path.abspath(args.input_file)))
     logger.info("Number of lines: %s" % str(linecounter))
     return output_filename
 
 
 def filter_projects_file(args, formatted_file):
 
-    ProjectRecord = namedtuple('ProjectRecord', 'id, url, owner_id, name, descriptor,\
-                               language, created_at, forked_from, deleted, updated_at')
-
     count = 0
 
     with open(os.path.abspath(args.output_file), 'w') as output_file:
@@ -97,47 +122,273 @@ def filter_projects_file(args, formatted_file):
                     count += 1
                     csvout.writerow(contents)
 
+    metrics.incr('projects_written', count)
     logger.info("Number of hits: %s" % str(count))
 
 
-logger = logging.getLogger(__name__)
-
+def read_project_rows(formatted_file):
+    """
+    Given the formatted projects file, yield its rows already
+    normalized (ids as strings) as they are written in the output file
+    """
+    with open(os.path.abspath(formatted_file), 'r') as csvfile:
+        for contents in csv.reader(csvfile, quoting=csv.QUOTE_NONNUMERIC, escapechar="\\"):
+            try:
+                contents[0] = str(int(contents[0]))
+                contents[2] = str(int(contents[2]))
+            except ValueError:
+                contents[0] = str(int(float(contents[0])))
+                contents[2] = str(int(float(contents[2])))
+            yield contents
+
+
+def parse_date(value):
+    """
+    Given a GHTorrent date ("2015-01-01 10:00:00"), return it as a
+    datetime64 in seconds. Unknown or zeroed dates are returned as NaT
+    """
+    import numpy as np
 
-def configure_logging(log_file, debug_mode_on=False):
-    """Set up the logging and returns a list with the file descriptors
+    try:
+        return np.datetime64(str(value).replace(' ', 'T'), 's')
+    except ValueError:
+        return np.datetime64('NaT', 's')
 
-    :param log_file: Path for the log file
-    :param debug_mode_on: If True, the level of the logger will be DEBUG
 
-    :return: List with logging file descriptors
+def cache_is_stale(args):
+    """
+    The cache must be (re)built if it does not exist yet, if it was built
+    from another input CSV file or if the input file is newer than it
+    """
+    meta_file = os.path.join(args.cache_path, 'meta.json')
+    if not os.path.isfile(meta_file):
+        if not args.input_file:
+            logger.error("No projects cache found in %s and no --input-file given" % args.cache_path)
+            raise SystemExit
+        return True
+    if not args.input_file:
+        return False
+    with open(meta_file, 'r') as mfile:
+        meta = json.load(mfile)
+    if meta.get('input_file') != os.path.abspath(args.input_file):
+        logger.info("Projects cache was built from another input file: %s" % meta.get('input_file'))
+        return True
+    if os.path.getmtime(args.input_file) > os.path.getmtime(meta_file):
+        logger.info("Input file is newer than the projects cache")
+        return True
+    return False
+
+
+def build_cache(cache_path, formatted_file, input_file):
+    """
+    Parse the formatted projects file once and store it as a columnar
+    cache: one .npy array per ProjectRecord field plus the already
+    formatted CSV lines (rows.bin), addressed through offsets.npy.
+    The meta file records the input file the cache was built from
+    """
+    import numpy as np
+
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_path)
+
+    logger.info("Building projects cache into: %s" % cache_path)
+    columns = {field: [] for field in PROJECT_FIELDS}
+    vocabs = {field: {} for field in TEXT_FIELDS}
+    offsets = [0]
+
+    buf = io.StringIO()
+    csvout = csv.writer(buf, delimiter=',', escapechar="\\", quoting=csv.QUOTE_NONNUMERIC)
+
+    with open(os.path.join(cache_path, 'rows.bin'), 'wb') as rows_file:
+        for contents in read_project_rows(formatted_file):
+            row = ProjectRecord(*contents)
+            for field in INT_FIELDS:
+                columns[field].append(int(float(getattr(row, field) or 0)))
+            for field in DATE_FIELDS:
+                columns[field].append(parse_date(getattr(row, field)))
+            for field in TEXT_FIELDS:
+                value = str(getattr(row, field))
+                vocab = vocabs[field]
+                if value not in vocab:
+                    vocab[value] = len(vocab)
+                columns[field].append(vocab[value])
+
+            buf.seek(0)
+            buf.truncate()
+            csvout.writerow(contents)
+            line = buf.getvalue().encode('utf-8')
+            rows_file.write(line)
+            offsets.append(offsets[-1] + len(line))
+
+    for field in INT_FIELDS:
+        np.save(os.path.join(cache_path, field + '.npy'), np.array(columns[field], dtype=np.int64))
+    for field in DATE_FIELDS:
+        np.save(os.path.join(cache_path, field + '.npy'), np.array(columns[field], dtype='datetime64[s]'))
+    for field in TEXT_FIELDS:
+        np.save(os.path.join(cache_path, field + '.npy'), np.array(columns[field], dtype=np.int32))
+        with open(os.path.join(cache_path, field + '.vocab.json'), 'w') as vfile:
+            json.dump(sorted(vocabs[field], key=vocabs[field].get), vfile)
+    np.save(os.path.join(cache_path, 'offsets.npy'), np.array(offsets, dtype=np.int64))
+
+    with open(os.path.join(cache_path, 'meta.json'), 'w') as mfile:
+        json.dump({'rows': len(offsets) - 1, 'fields': PROJECT_FIELDS,
+                   'input_file': os.path.abspath(input_file)}, mfile)
+    logger.info("Number of cached projects: %s" % str(len(offsets) - 1))
+
+
+class ProjectsCache:
+    """
+    Memory-mapped access to the columns of the projects cache
     """
 
-    if debug_mode_on:
-        logging_mode = logging.DEBUG
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self._columns = {}
+        self._vocabs = {}
+
+    def column(self, field):
+        import numpy as np
+
+        if field not in PROJECT_FIELDS:
+            raise ValueError("Unknown ProjectRecord field: %s" % field)
+        if field not in self._columns:
+            self._columns[field] = np.load(os.path.join(self.cache_path, field + '.npy'),
+                                           mmap_mode='r')
+        return self._columns[field]
+
+    def vocab(self, field):
+        if field not in self._vocabs:
+            with open(os.path.join(self.cache_path, field + '.vocab.json'), 'r') as vfile:
+                self._vocabs[field] = {value: code for code, value in enumerate(json.load(vfile))}
+        return self._vocabs[field]
+
+    def encode(self, field, value):
+        """
+        Translate a literal of a filter expression into the representation
+        used by the column of the given field
+        """
+        _check_literal(field, value)
+        if field in TEXT_FIELDS:
+            # Values not present in the cache get a code no row has
+            return self.vocab(field).get(str(value), -1)
+        if field in DATE_FIELDS:
+            return parse_date(value)
+        return value
+
+
+def _check_literal(field, value):
+    """Reject literals whose type does not match the column of the field"""
+    if field in INT_FIELDS:
+        valid = isinstance(value, int) and not isinstance(value, bool)
     else:
-        logging_mode = logging.INFO
+        valid = isinstance(value, str)
+    if not valid:
+        raise ValueError("Invalid literal for field %s: %r (expected %s)" %
+                         (field, value, 'an integer' if field in INT_FIELDS else 'a string'))
 
-    logger = logging.getLogger()
-    logger.setLevel(logging_mode)
 
-    # redirect logging to our log file
-    fh = logging.FileHandler(log_file, 'a')
-    fh.setLevel(logging_mode)
+COMPARE_OPS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
 
-    # create console handler with a higher log level
-    ch = logging.StreamHandler()
-    ch.setLevel(logging_mode)
 
-    # create formatter and add it to the handlers
-    formatter = logging.Formatter("[%(asctime)s - %(levelname)s] %(message)s")
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
+def compile_filter(expression, cache):
+    """
+    Evaluate a filter expression over the ProjectRecord fields against
+    the columns of the cache, returning a boolean mask with one element
+    per project. Expressions are Python-like, e.g.:
+
+        language == "Python" and created_at >= "2015-01-01"
+        language in ("C", "C++") and not deleted
+    """
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as e:
+        raise ValueError("Invalid filter expression: %s" % str(e))
+    return _eval_node(tree.body, cache)
 
-    logger.addHandler(fh)
-    logger.addHandler(ch)
 
-    keep_fds = [fh.stream.fileno()]
-    return keep_fds
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise ValueError("Expected a literal, found: %s" % ast.dump(node))
+
+
+def _eval_node(node, cache):
+    import numpy as np
+
+    if isinstance(node, ast.BoolOp):
+        masks = [_eval_node(value, cache) for value in node.values]
+        reduce_op = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        return reduce_op.reduce(masks)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return np.logical_not(_eval_node(node.operand, cache))
+    if isinstance(node, ast.Name):
+        # A bare field is true when non-zero, i.e. "forked_from" or "deleted"
+        if node.id not in INT_FIELDS:
+            raise ValueError("Only integer fields can be used as conditions, found: %s" % node.id)
+        return cache.column(node.id) != 0
+    if isinstance(node, ast.Compare):
+        mask = None
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            if not isinstance(left, ast.Name):
+                raise ValueError("Left side of comparisons must be a ProjectRecord field")
+            column = cache.column(left.id)
+            if isinstance(op, (ast.In, ast.NotIn)):
+                values = _literal(right)
+                if not isinstance(values, (list, tuple, set)):
+                    raise ValueError("Right side of 'in' must be a list, tuple or set of literals")
+                values = [cache.encode(left.id, value) for value in values]
+                result = np.isin(column, np.array(values, dtype=column.dtype))
+                if isinstance(op, ast.NotIn):
+                    result = np.logical_not(result)
+            elif type(op) in COMPARE_OPS:
+                if left.id in TEXT_FIELDS and not isinstance(op, (ast.Eq, ast.NotEq)):
+                    raise ValueError("Field %s only supports == and != comparisons" % left.id)
+                result = COMPARE_OPS[type(op)](column, cache.encode(left.id, _literal(right)))
+            else:
+                raise ValueError("Unsupported operator: %s" % type(op).__name__)
+            mask = result if mask is None else np.logical_and(mask, result)
+            left = right
+        return mask
+    raise ValueError("Unsupported filter expression: %s" % ast.dump(node))
+
+
+def select_from_cache(args):
+    """
+    Write into the output file the cached projects which are not forked,
+    not deleted and match the --where expression (if any)
+    """
+    import numpy as np
+
+    cache = ProjectsCache(args.cache_path)
+    mask = (cache.column('forked_from') == 0) & (cache.column('deleted') == 0)
+    if args.where:
+        logger.info("Filtering projects: %s" % args.where)
+        with metrics.timer('filter'):
+            mask &= compile_filter(args.where, cache)
+
+    offsets = np.load(os.path.join(args.cache_path, 'offsets.npy'), mmap_mode='r')
+    selected = np.flatnonzero(mask)
+
+    with open(os.path.abspath(args.output_file), 'wb') as output_file:
+        if len(selected):
+            rows = np.memmap(os.path.join(args.cache_path, 'rows.bin'), dtype=np.uint8, mode='r')
+            for index in selected:
+                output_file.write(rows[offsets[index]:offsets[index + 1]].tobytes())
+
+    metrics.incr('projects_written', len(selected))
+    logger.info("Number of hits: %s" % str(len(selected)))
+
+
+logger = logging.getLogger(__name__)
 
 
 def parse_args():
@@ -145,22 +396,27 @@ def parse_args():
 
     parser = argparse.ArgumentParser(description=DESC_MSG)
 
-    parser.add_argument('--input-file', dest='input_file', required=True,
+    parser.add_argument('--input-file', dest='input_file', required=False,
                         help='Input projects CSV file')
     parser.add_argument('--output-file', dest='output_file', required=True,
                         help='Output projects CSV file')
-    parser.add_argument('--log-file', dest='log_file', default='get-project-list.log',
-                        required=False, help='Path to log file')
-    parser.add_argument('-g', '--debug', dest='debug_mode_on', action='store_true',
-                        default=False, help='Enables debug mode')
-    return parser.parse_args()
+    parser.add_argument('--cache-path', dest='cache_path', required=False,
+                        help='Path to the columnar projects cache (built from --input-file if needed)')
+    parser.add_argument('--where', dest='where', required=False,
+                        help='Filter expression over ProjectRecord fields (needs --cache-path)')
+    common.add_logging_arguments(parser, 'get-project-list.log')
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    if not args.input_file and not args.cache_path:
+        parser.error('--input-file is required unless --cache-path is given')
+    return args
 
 
 if __name__ == '__main__':
     try:
         args = parse_args()
-        keep_fds = configure_logging(args.log_file, args.debug_mode_on)
-        main(args)
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        metrics.run(main, args)
     except Exception as e:
         logger.exception("Exception message:")
         s = "Error: %s get-project-list is exiting now." % str(e)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+
+"""
+Single entry point for all the scripts: "ghtools <command> [options]".
+
+Commands are run from their script files, so only the modules the chosen
+command needs (perceval, yaml, numpy, urllib...) are imported.
+"""
+
+import os
+import runpy
+import sys
+
+# Command name and description of every script, in pipeline order
+COMMANDS = [
+    ('get-project-list', 'Adapt projects.csv file from GHTorrent dump with preliminary filter(s)'),
+    ('github-api', 'Extracts git trees (list of files) from GitHub repositories'),
+    ('work-queue', 'Shows the jobs of the work queue shared by github-api.py or perceval-handler.py processes'),
+    ('github-tree', 'Look for patterns and heuristics into Git-trees and return a list of positive results'),
+    ('tree-index', 'Builds a compact index of the paths of the Git-trees and evaluates heuristics over it'),
+    ('hits2urls', 'Converts positive results into URLs pointing to its raw files in GitHub'),
+    ('download-files', 'Downloads the files of the URLs produced by hits2urls.py into a content-addressed store'),
+    ('perceval-handler', 'Calls GrimoireLab-Perceval to extract git information from the output file of hits2urls.py'),
+    ('projects2sql', 'Generate SQL files extrating data from Perceval JSON files'),
+    ('commits-query', 'Runs aggregate queries over the commit store written by projects2sql.py'),
+    ('ghtorrent-users2sql', 'Converts the USERS table from GHTorrent (csv) into a SQL script'),
+    ('db-benchmark', 'Loads the SQL files into a database, builds the secondary indexes and times analysis queries'),
+    ('synthetic-data', 'Generates synthetic GHTorrent, tree, hits and Perceval data to benchmark the scripts'),
+    ('pipeline-benchmark', 'Times the scripts of the pipeline over the data produced by synthetic-data.py'),
+    ('github-mock', 'Local stand-in of the GitHub API (repos, branches and trees) to load test the crawlers'),
+    ('crawler-benchmark', 'Load tests github-api.py or perceval-handler.py against github-mock.py'),
+    ('backend-benchmark', 'Compares the Perceval and git log backends of perceval-handler.py over local git repos'),
+    ('json-benchmark', 'Compares the JSON codecs over the trees and commit files of the pipeline'),
+]
+
+# Where the scripts are found: next to this file (source tree) or in the
+# data directory setup.py installs them into
+SCRIPTS_PATHS = [os.path.dirname(os.path.abspath(__file__)),
+                 os.path.join(sys.prefix, 'share', 'ghtools')]
+
+
+def usage():
+    lines = ['usage: ghtools <command> [-h] [options]', '', 'commands:']
+    for name, desc in COMMANDS:
+        lines.append('  %-20s %s' % (name, desc))
+    return '\n'.join(lines)
+
+
+def find_script(name):
+    for path in SCRIPTS_PATHS:
+        script = os.path.join(path, name + '.py')
+        if os.path.isfile(script):
+            return script
+    return None
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0
+
+    name = argv[0]
+    if name.endswith('.py'):
+        name = name[:-3]
+    script = find_script(name) if name in dict(COMMANDS) else None
+    if not script:
+        print("ghtools: unknown command '%s'\n\n%s" % (argv[0], usage()), file=sys.stderr)
+        return 2
+
+    # Run the script as if it had been called directly
+    sys.argv = [script] + argv[1:]
+    script_dir = os.path.dirname(script)
+    if script_dir not in sys.path:
+        sys.path.insert(0, script_dir)
+    runpy.run_path(script, run_name='__main__')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -23,61 +23,349 @@
 #
 
 import argparse
+import array
 import csv
+import hashlib
 import logging
+import multiprocessing
 import os
+import re
 import sys
 
+import common
+import metrics
+import sqlwriter
+
 DESC_MSG = 'Converts the USERS table from GHTorrent (csv) into a SQL script'
 
 
+FIELDS = 'id, login, name, company, location, email, created_at, type, fake, deleted, longi, lat, country_code, state, city'
+
+UPSERT_SUFFIX = '\nON DUPLICATE KEY UPDATE ' + \
+    ', '.join('%s=VALUES(%s)' % (field, field) for field in FIELDS.split(', ')[1:])
+
+# Number of rows compared at once (delta export) and ids per DELETE
+BATCH_SIZE = 100000
+
+# A GHTorrent users record starts with its numeric id
+RECORD_START = re.compile(rb'^\d+,')
+
+# Line breaks that text mode (universal newlines) reads as '\n'
+NEWLINE = re.compile(rb'(\r\n|\r|\n)')
+
+# Rows of people.sql (produced by projects2sql.py): (id, "name", "email")
+PEOPLE_ROW = re.compile(r'\((\d+), "(.*)", "(.*)"\)')
+
+# GitHub no-reply addresses include the login: [id+]login@users.noreply.github.com
+NOREPLY_EMAIL = re.compile(r'^(?:\d+\+)?(.+)@users\.noreply\.github\.com$')
+
+# Logins and emails of the people seen in commits (see --people-file)
+members = None
+
+
 def main(args):
     input_file = args.input_file
-    db_name = args.db_name
-
-    fields = 'id, login, name, company, location, email, created_at, type, fake, deleted, longi, lat, country_code, state, city'
 
-    insert_query = 'INSERT INTO users (%s) VALUES\n' % fields
+    if args.people_file:
+        set_members(load_people(args.people_file))
 
-    file_name = args.out_path + '/users.sql'
-    output = open(file_name, 'w')
-    output.write('USE %s;\n' % db_name)
-    output.write(insert_query)
+    if args.previous_file or args.hash_index or args.save_index:
+        export_delta(args)
+        return
 
-    first = True
-    count = 0
+    writer = sqlwriter.SQLWriter.from_args(args, args.out_path, 'users', FIELDS)
 
     logger.info("Start to fill users.sql file")
+    if args.workers > 1:
+        ranges = split_file(input_file, args.workers * 4)
+        logger.info("Converting %s byte ranges with %s workers" % (len(ranges), args.workers))
+        tasks = [(input_file, start, end, "%s/users.sql.part%d" % (args.out_path, num))
+                 for num, (start, end) in enumerate(ranges)]
+        with multiprocessing.Pool(args.workers, set_members, (members,)) as pool:
+            parts = pool.map(convert_range, tasks)
+        # Concatenate the parts in order, so the INSERT statements are
+        # split at the same rows as in a single process run. A range is
+        # only valid if the records before it end right where it starts
+        # (not inside a quoted multiline field). Otherwise it is merged
+        # into the previous one: its records are converted again from
+        # where the previous records end
+        record_end = 0
+        for (start, end), (part, part_end) in zip(ranges, parts):
+            if start != record_end:
+                logger.warning("Byte range %s starts inside a record, converting it again from %s"
+                               % (start, record_end))
+                os.remove(part)
+                part, part_end = convert_range((input_file, record_end, end, part))
+            record_end = part_end
+            with open(part, 'r') as part_file:
+                for values in part_file:
+                    writer.write(values[:-1])
+            os.remove(part)
+    else:
+        convert_file(input_file, writer)
+    writer.close()
+    sqlwriter.write_manifest(args.out_path, [writer])
+    metrics.incr('users_written', writer.count)
+    metrics.incr('bytes_read', os.path.getsize(input_file))
+    metrics.incr('bytes_written', writer.bytes_written)
+    logger.info("Number of users: %s" % str(writer.count))
+    logger.info("Process finished")
+
+
+def convert_file(input_file, writer):
+    """Convert the records of the input file in a single process"""
     with open(input_file, 'r') as csvfile:
         for fields in csv.reader(csvfile):
-            fields = clean(fields)
-            if len(fields) != 15:
-                logger.debug("Fields length is greater than expected: " + str(fields))
+            if not is_member(fields):
                 continue
-            values = "'" + "','".join(fields) + "'"
-            values = values.replace("'\\N'", 'NULL')
-            values = values.replace("'NULL'", 'NULL')
-            if "'\\'" in values:
-                logger.debug("Fields contains undesired characters: " + str(fields))
+            values = convert(fields)
+            if values:
+                writer.write(values)
+
+
+def convert(fields):
+    """
+    Given the fields of a CSV row, return its SQL values string or None
+    if the row must be discarded. Line breaks are written as escape
+    sequences, so each row takes a single line
+    """
+    fields = clean(fields)
+    if len(fields) != 15:
+        logger.debug("Fields length is greater than expected: " + str(fields))
+        return None
+    values = "'" + "','".join(fields) + "'"
+    values = values.replace("'\\N'", 'NULL')
+    values = values.replace("'NULL'", 'NULL')
+    if "'\\'" in values:
+        logger.debug("Fields contains undesired characters: " + str(fields))
+        return None
+    if '\n' in values or '\r' in values:
+        values = values.replace('\r', '\\r').replace('\n', '\\n')
+    return values
+
+
+def split_file(input_file, num_ranges):
+    """
+    Split the input file into (start, end) byte ranges, starting at lines
+    which look like the beginning of a record. Whether they really are
+    is checked when the ranges are converted
+    """
+    size = os.path.getsize(input_file)
+    bounds = [0]
+    with open(input_file, 'rb') as f:
+        for num in range(1, num_ranges):
+            f.seek(max(size * num // num_ranges, bounds[-1]))
+            f.readline()  # Skip the partial line
+            while True:
+                pos = f.tell()
+                line = f.readline()
+                if not line or RECORD_START.match(line):
+                    break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def read_from(input_file, start, offset):
+    """
+    Yield the lines of the input file from the byte start, with their
+    line breaks read as in text mode. offset[0] is kept as the byte
+    offset where the last yielded line ends
+    """
+    offset[0] = start
+    with open(input_file, 'rb') as f:
+        f.seek(start)
+        for line in f:
+            pieces = NEWLINE.split(line)
+            for text, newline in zip(pieces[0::2], pieces[1::2] + [b'']):
+                if not text and not newline:
+                    continue
+                offset[0] += len(text) + len(newline)
+                yield text.decode('utf-8') + ('\n' if newline else '')
+
+
+def convert_range(task):
+    """
+    Convert the records starting in a byte range of the input file,
+    writing their SQL values one per line into a part file. The last
+    record is read to its end even past the range. Return the part file
+    name and the byte offset where that record ends
+    """
+    input_file, start, end, part_name = task
+    offset = [start]
+    record_end = start
+    with open(part_name, 'w') as part_file:
+        for fields in csv.reader(read_from(input_file, start, offset)):
+            if record_end >= end:
+                break
+            record_end = offset[0]
+            if not is_member(fields):
                 continue
-            if first:
-                output.write("(%s)" % values)
-                first = False
-                count += 1
-            else:
-                if not count % 100000:
-                    output.write(';\n')
-                    output.write(insert_query + '\n')
-                    output.write("(%s)" % values)
-                    count += 1
-                else:
-                    output.write(",\n(%s)" % values)
-                    count += 1
-    output.write(';')
-    output.close()
+            values = convert(fields)
+            if values:
+                part_file.write(values + '\n')
+    return part_name, record_end
+
+
+def row_hash(values):
+    """Return the 64-bit hash of the SQL values of a row"""
+    return int.from_bytes(hashlib.blake2b(values.encode('utf-8', 'surrogateescape'),
+                                          digest_size=8).digest(), 'little')
+
+
+def converted_rows(input_file):
+    """
+    Yield the (id, values) pairs of the users of the CSV file that would
+    be written into users.sql
+    """
+    with open(input_file, 'r') as csvfile:
+        for fields in csv.reader(csvfile):
+            if not is_member(fields):
+                continue
+            values = convert(fields)
+            if not values:
+                continue
+            try:
+                yield int(fields[0]), values
+            except ValueError:
+                logger.debug("Wrong user id: " + str(fields))
+
+
+def build_index(input_file):
+    """
+    Compute the row-hash index of a users CSV file: arrays of user ids
+    and hashes of their rows, sorted by id
+    """
+    import numpy as np
+
+    ids = array.array('q')
+    hashes = array.array('Q')
+    for user_id, values in converted_rows(input_file):
+        ids.append(user_id)
+        hashes.append(row_hash(values))
+    return sort_index(np.frombuffer(ids, dtype=np.int64), np.frombuffer(hashes, dtype=np.uint64))
+
+
+def sort_index(ids, hashes):
+    import numpy as np
+
+    order = np.argsort(ids, kind='stable')
+    return ids[order], hashes[order]
+
+
+def export_delta(args):
+    """
+    Write into users_delta.sql only the users inserted, updated (as
+    upserts) or deleted since the previous dump, given either as its CSV
+    file or as the row-hash index saved by a previous run
+    """
+    import numpy as np
+
+    if args.hash_index:
+        logger.info("Loading row-hash index: %s" % args.hash_index)
+        with np.load(args.hash_index) as index:
+            prev_ids, prev_hashes = index['ids'], index['hashes']
+    elif args.previous_file:
+        logger.info("Computing row-hash index of: %s" % args.previous_file)
+        prev_ids, prev_hashes = build_index(args.previous_file)
+    else:
+        prev_ids = np.zeros(0, dtype=np.int64)
+        prev_hashes = np.zeros(0, dtype=np.uint64)
+
+    writer = sqlwriter.SQLWriter.from_args(args, args.out_path, 'users', FIELDS, UPSERT_SUFFIX,
+                                          'users_delta')
+
+    new_ids = array.array('q')
+    new_hashes = array.array('Q')
+    chunk = []
+
+    def flush(chunk):
+        # Compare a chunk of rows against the previous index at once
+        ids = np.array([row[0] for row in chunk], dtype=np.int64)
+        hashes = np.array([row[1] for row in chunk], dtype=np.uint64)
+        pos = np.searchsorted(prev_ids, ids)
+        found = pos < len(prev_ids)
+        found[found] = prev_ids[pos[found]] == ids[found]
+        changed = np.ones(len(chunk), dtype=bool)
+        changed[found] = prev_hashes[pos[found]] != hashes[found]
+        for num in np.flatnonzero(changed):
+            writer.write(chunk[num][2])
+        new_ids.extend(ids)
+        new_hashes.extend(hashes)
+
+    logger.info("Start to fill users_delta.sql file")
+    for user_id, values in converted_rows(args.input_file):
+        chunk.append((user_id, row_hash(values), values))
+        if len(chunk) == BATCH_SIZE:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+
+    ids, hashes = sort_index(np.frombuffer(new_ids, dtype=np.int64),
+                             np.frombuffer(new_hashes, dtype=np.uint64))
+    # Dumps may repeat an id, so the ids are not taken as unique
+    deleted = np.setdiff1d(prev_ids, ids)
+    for start in range(0, len(deleted), BATCH_SIZE):
+        writer.statement('DELETE FROM users WHERE id IN (%s)' %
+                         ', '.join(str(user_id) for user_id in deleted[start:start + BATCH_SIZE]))
+    writer.close()
+    sqlwriter.write_manifest(args.out_path, [writer])
+
+    metrics.incr('users_written', writer.count)
+    metrics.incr('users_deleted', len(deleted))
+    logger.info("Users inserted or updated: %s, deleted: %s" % (writer.count, len(deleted)))
+    if args.save_index:
+        with open(args.save_index, 'wb') as ifile:
+            np.savez(ifile, ids=ids, hashes=hashes)
+        logger.info("Row-hash index saved into: %s" % args.save_index)
     logger.info("Process finished")
 
 
+def load_people(people_file):
+    """
+    Read the people SQL files produced by projects2sql.py (a single file,
+    or the output path or manifest of rotated or compressed ones) and
+    return the set of emails (and logins of GitHub no-reply emails) they
+    contain
+    """
+    keys = set()
+    for people_path in sqlwriter.sql_files(people_file, 'people'):
+        with sqlwriter.open_sql(people_path) as pfile:
+            for line in pfile:
+                row = PEOPLE_ROW.search(line)
+                if not row:
+                    continue
+                email = row.group(3).replace("\\'", "'").lower()
+                if email == 'unknown':
+                    continue
+                keys.add(email)
+                noreply = NOREPLY_EMAIL.match(email)
+                if noreply:
+                    keys.add(noreply.group(1))
+    logger.info("Number of people emails and logins: %s" % str(len(keys)))
+    return frozenset(keys)
+
+
+def set_members(keys):
+    global members
+    members = keys
+
+
+def is_member(fields):
+    """
+    Given the fields of a CSV row, tell if the user is one of the people
+    seen in commits, matching by login or email. Without --people-file,
+    every user matches
+    """
+    if members is None:
+        return True
+    if len(fields) < 6:
+        return False
+    return fields[1].lower() in members or fields[5].lower() in members
+
+
 def clean(fields):
     new_fields = []
     for field in fields:
@@ -98,43 +386,6 @@ def clean(fields):
 logger = logging.getLogger(__name__)
 
 
-def configure_logging(log_file, debug_mode_on=False):
-    """Set up the logging and returns a list with the file descriptors
-
-    :param log_file: Path for the log file
-    :param debug_mode_on: If True, the level of the logger will be DEBUG
-
-    :return: List with logging file descriptors
-    """
-
-    if debug_mode_on:
-        logging_mode = logging.DEBUG
-    else:
-        logging_mode = logging.INFO
-
-    logger = logging.getLogger()
-    logger.setLevel(logging_mode)
-
-    # redirect logging to our log file
-    fh = logging.FileHandler(log_file, 'a')
-    fh.setLevel(logging_mode)
-
-    # create console handler with a higher log level
-    ch = logging.StreamHandler()
-    ch.setLevel(logging_mode)
-
-    # create formatter and add it to the handlers
-    formatter = logging.Formatter("[%(asctime)s - %(levelname)s] %(message)s")
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
-
-    logger.addHandler(fh)
-    logger.addHandler(ch)
-
-    keep_fds = [fh.stream.fileno()]
-    return keep_fds
-
-
 def parse_args():
     """Parse arguments from the command line"""
 
@@ -146,18 +397,33 @@ def parse_args():
                         help='Database name')
     parser.add_argument('--output-path', dest='out_path', required=False,
                         default=os.curdir, help='Path where users.sql script will be stored')
-    parser.add_argument('--log-file', dest='log_file', default='ghtorrent-users2sql.log',
-                        required=False, help='Path to log file')
-    parser.add_argument('-g', '--debug', dest='debug_mode_on', action='store_true',
-                        default=False, help='Enables debug mode')
-    return parser.parse_args()
+    parser.add_argument('--people-file', dest='people_file', required=False,
+                        help='people.sql file from projects2sql, or its output path or manifest.json if rotated '
+                             'or compressed: only users seen in it are converted')
+    parser.add_argument('--previous-file', dest='previous_file', required=False,
+                        help='CSV file of the previous USERS dump: only the delta is exported')
+    parser.add_argument('--hash-index', dest='hash_index', required=False,
+                        help='Row-hash index of the previous dump: only the delta is exported')
+    parser.add_argument('--save-index', dest='save_index', required=False,
+                        help='Path where the row-hash index of the input file will be saved')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=1,
+                        help='Number of processes converting the CSV file in parallel')
+    sqlwriter.add_arguments(parser)
+    common.add_logging_arguments(parser, 'ghtorrent-users2sql.log')
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.workers > 1 and (args.previous_file or args.hash_index or args.save_index):
+        parser.error('--workers only applies to a full export, not with --previous-file, '
+                     '--hash-index or --save-index')
+    return args
 
 
 if __name__ == '__main__':
     try:
         args = parse_args()
-        keep_fds = configure_logging(args.log_file, args.debug_mode_on)
-        main(args)
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        metrics.run(main, args)
     except Exception as e:
         s = "Error: %s ghtorrent-users2sql is exiting now." % str(e)
         logger.error(s)
@@ -23,24 +23,41 @@
 #
 
 import argparse
+import calendar
 import csv
-import json
 import logging
 import os
 import sys
 import time
-import urllib.request
 
-from collections import namedtuple
+import common
+import jsoncodec
+import metrics
+import records
+import workqueue
 
 DESC_MSG = 'Extracts git trees (list of files) from GitHub repositories'
 
+# get_json() result of a 404: false as any other failure, but not worth a retry
+NOT_FOUND = None
+
+# Requests per hour allowed by the GitHub API with a token
+RATE_LIMIT = 5000
+
+# Pre-filter: the projects crawled before in a group of projects weigh as
+# much as PRIOR_REPOS projects of its enclosing group (e.g. the projects
+# of a language created in a year, and all the projects of the language)
+PRIOR_REPOS = 20
+
+# Missing language or dates in GHTorrent
+UNKNOWN = ('', '0', '\\N')
+
 
 def main(args):
+    jsoncodec.use(args.json_codec)
 
     logger.info('GitHub-API starts...')
     github_key = args.github_token
-    ProjectRecord = namedtuple('ProjectRecord', 'id, url, owner_id, name, descriptor, language, created_at, forked_from, deleted, updated_at')
 
     if not os.path.exists("master"):
         os.mkdir("master")
@@ -49,44 +66,322 @@ def main(args):
     if not os.path.exists("trees"):
         os.mkdir("trees")
 
+    plan = None
+    if args.plan_file or args.refresh:
+        plan = plan_crawl(args.projects_file)
+    if args.hit_history:
+        model = YieldModel(hit_history(args.hit_history, args.projects_file))
+        if plan is None:
+            plan = uncrawled_projects(args.projects_file)
+        plan = prefilter(plan, model, args.min_yield)
+    if args.plan_file:
+        with open(args.plan_file, 'w', newline='') as pfile:
+            csv.writer(pfile).writerows(plan)
+        logger.info("Plan written into %s" % args.plan_file)
+        return
+
+    if args.queue_file:
+        run_queue(args, plan)
+        logger.info("End of program")
+        return
+
+    if plan is not None:
+        for contents in plan:
+            metrics.incr('repos')
+            get_tree(common.ProjectRecord(*contents), github_key)
+        logger.info("End of program")
+        return
+
     alreadyList = os.listdir("master")
 
     with open(args.projects_file, "r") as csvfile:
         for contents in csv.reader(csvfile, delimiter=',', quoting=csv.QUOTE_MINIMAL):
             # For each line in csv file...
-            repo = ProjectRecord(*contents)
+            repo = common.ProjectRecord(*contents)
+            metrics.incr('repos')
 
             if repo.owner_id + ":" + repo.id + ".json" in alreadyList:
                 continue  # Break loop, if json is already downloaded
-            if not get_json(repo, github_key, "master", "/branches/master"):
-                continue  # Break loop, ¿?
-            sha_hash = read_json(repo, "master", ["commit", "commit", "tree", "sha"])
-
-            if not sha_hash:
-                logger.debug("Master branch not found: %s", repo.url)
-                if not get_json(repo, github_key, "default"):
-                    continue
-                default = read_json(repo, "default", ["default_branch"])
-
-                if not default:
-                    logger.debug("No default branch found: %s", repo.url)
-                    time.sleep(1.40)
-                    continue
-                if not get_json(repo, github_key, "master", "/branches/" + default):
-                    continue
-                sha_hash = read_json(repo, "master", ["commit", "commit", "tree", "sha"])
-
-                if not sha_hash:
-                    logger.debug("Default branch not found: %s", repo.url)
-                    time.sleep(2.10)
-                    continue
-            if not get_json(repo, github_key, "trees", "/git/trees/" + sha_hash + "?recursive=1"):
-                continue
-            time.sleep(1.40)
+            get_tree(repo, github_key)
 
     logger.info("End of program")
 
 
+def get_tree(repo, github_key):
+    """
+    Retrieve the tree of the master (or default) branch of the repo.
+    Return 'tree' when it was saved, 'not found' or 'no branch' when the
+    repo has no tree to read, or None when a request failed
+    """
+    def failure(status):
+        return 'not found' if status is NOT_FOUND else None
+
+    # Tree of the previous crawl, if any: not requested again if unchanged
+    previous_sha = stored_tree_sha(repo)
+
+    status = get_json(repo, github_key, "master", "/branches/master")
+    if not status:
+        return failure(status)
+    sha_hash = read_json(repo, "master", ["commit", "commit", "tree", "sha"])
+
+    if not sha_hash:
+        logger.debug("Master branch not found: %s", repo.url)
+        status = get_json(repo, github_key, "default")
+        if not status:
+            return failure(status)
+        default = read_json(repo, "default", ["default_branch"])
+
+        if not default:
+            logger.debug("No default branch found: %s", repo.url)
+            time.sleep(1.40)
+            return 'no branch'
+        status = get_json(repo, github_key, "master", "/branches/" + default)
+        if not status:
+            return failure(status)
+        sha_hash = read_json(repo, "master", ["commit", "commit", "tree", "sha"])
+
+        if not sha_hash:
+            logger.debug("Default branch not found: %s", repo.url)
+            time.sleep(2.10)
+            return 'no branch'
+    if sha_hash == previous_sha and os.path.exists(json_path(repo, "trees")):
+        logger.debug("Tree unchanged: %s", repo.url)
+        metrics.incr('trees_unchanged')
+        time.sleep(1.40)
+        return 'unchanged'
+    status = get_json(repo, github_key, "trees", "/git/trees/" + sha_hash + "?recursive=1")
+    if not status:
+        return failure(status)
+    time.sleep(1.40)
+    return 'tree'
+
+
+def json_path(repo, directory):
+    return "%s/%s:%s.json" % (directory, str(repo.owner_id), str(repo.id))
+
+
+def stored_tree_sha(repo):
+    """SHA of the tree found by the last crawl of the repo, None if unknown"""
+    try:
+        with open(json_path(repo, "master"), 'rb') as data_file:
+            return lookup(jsoncodec.load(data_file), "commit", "commit", "tree", "sha")
+    except (IOError, ValueError, AttributeError):
+        return None
+
+
+def parse_updated_at(value):
+    """Epoch of a GHTorrent date (UTC), None if unknown"""
+    try:
+        return calendar.timegm(time.strptime(value, "%Y-%m-%d %H:%M:%S"))
+    except ValueError:
+        return None
+
+
+def plan_crawl(projects_file):
+    """
+    Projects whose tree has to be (re)crawled, the ones never crawled
+    first and then the ones updated after their last crawl (the time of
+    their master/ file), the longest updated since first. Log the API
+    requests they are expected to take
+    """
+    new = []
+    stale = []
+    up_to_date = 0
+    calls = 0
+    with open(projects_file, "r") as csvfile:
+        for contents in csv.reader(csvfile, delimiter=',', quoting=csv.QUOTE_MINIMAL):
+            repo = common.ProjectRecord(*contents)
+            updated_at = parse_updated_at(repo.updated_at)
+            try:
+                fetched_at = os.path.getmtime(json_path(repo, "master"))
+            except OSError:
+                new.append((-(updated_at or 0), contents))
+                calls += 2
+                continue
+            if updated_at is None or updated_at <= fetched_at:
+                up_to_date += 1
+                continue
+            stale.append((fetched_at - updated_at, contents))
+            # Branch and tree, plus the repo and its default branch when
+            # master was not found last time. The tree request is saved if
+            # the tree did not change
+            calls += 2 if stored_tree_sha(repo) else 4
+
+    new.sort(key=lambda item: item[0])
+    stale.sort(key=lambda item: item[0])
+    plan = [contents for _, contents in new + stale]
+    metrics.incr('plan_new', len(new))
+    metrics.incr('plan_stale', len(stale))
+    metrics.incr('plan_api_calls', calls)
+    logger.info("Crawl plan: %s new, %s updated since crawled, %s up to date. "
+                "Expected API requests: %s (%.1f hours at %s requests/hour)"
+                % (len(new), len(stale), up_to_date, calls, calls / RATE_LIMIT, RATE_LIMIT))
+    return plan
+
+
+def uncrawled_projects(projects_file):
+    """Rows of the projects never crawled (without master/ file)"""
+    already = set(os.listdir("master"))
+    with open(projects_file, "r") as csvfile:
+        return [contents for contents in csv.reader(csvfile, delimiter=',', quoting=csv.QUOTE_MINIMAL)
+                if contents[2] + ":" + contents[0] + ".json" not in already]
+
+
+def read_hit_counts(hits_files):
+    """Hits per repo ((owner, name) tuples) in hits files of github-tree.py (lines or records)"""
+    counts = {}
+    for hits_file in hits_files:
+        if records.is_records(hits_file):
+            for hit in records.read_records(hits_file, 'hit'):
+                key = (hit.owner, hit.repo)
+                counts[key] = counts.get(key, 0) + 1
+            continue
+        with open(hits_file, 'r') as hfile:
+            for line in hfile:
+                # path, url[, duplicate]: the path can hold ", "
+                line = line.rstrip('\r\n')
+                if line.endswith(', duplicate'):
+                    line = line[:-len(', duplicate')]
+                # .../repos/<owner>/<repo>/git/blobs/<sha>
+                key = tuple(line.rsplit(', ', 1)[-1].split('/')[4:6])
+                counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def hit_history(hits_files, projects_file):
+    """
+    Projects crawled before (with master/ or default/ file), with their
+    hits and the API requests they took: (ProjectRecord, hits, requests)
+    """
+    counts = read_hit_counts(hits_files)
+    master = set(os.listdir("master"))
+    default = set(os.listdir("default"))
+    history = []
+    with open(projects_file, "r") as csvfile:
+        for contents in csv.reader(csvfile, delimiter=',', quoting=csv.QUOTE_MINIMAL):
+            repo = common.ProjectRecord(*contents)
+            name = repo.owner_id + ":" + repo.id + ".json"
+            if name not in master and name not in default:
+                continue
+            # As get_tree(): branch and tree, plus the repo and the master
+            # branch first when master was not found
+            requests = (2 if name in master else 1) + (2 if name in default else 0)
+            hits = counts.get(tuple(repo.url.split('/')[4:6]), 0)
+            history.append((repo, hits, requests))
+    logger.info("Hit history: %s hits in %s projects crawled before"
+                % (sum(hits for _, hits, _ in history), len(history)))
+    return history
+
+
+def yield_groups(repo):
+    """Groups of a project for the pre-filter, from the widest one"""
+    language = '' if repo.language in UNKNOWN else repo.language
+    created = '' if repo.created_at in UNKNOWN else repo.created_at[:4]
+    updated = '' if repo.updated_at in UNKNOWN else repo.updated_at[:4]
+    return [(), (language,), (language, created), (language, created, updated)]
+
+
+class YieldModel:
+    """
+    Expected hits and API requests of a project: the averages of the
+    projects crawled before with its language, year of creation and year
+    of last update, shrunk towards those of wider groups when there are
+    few of them (see PRIOR_REPOS)
+    """
+
+    def __init__(self, history):
+        self.groups = {}
+        for repo, hits, requests in history:
+            for group in yield_groups(repo):
+                totals = self.groups.setdefault(group, [0, 0, 0])
+                totals[0] += 1
+                totals[1] += hits
+                totals[2] += requests
+
+    def __len__(self):
+        return self.groups.get((), [0])[0]
+
+    def expected(self, repo):
+        """Tuple (hits, API requests) expected from a project"""
+        hits = requests = None
+        for group in yield_groups(repo):
+            repos, group_hits, group_requests = self.groups.get(group, (0, 0, 0))
+            if hits is None:
+                hits, requests = group_hits / repos, group_requests / repos
+            else:
+                hits = (group_hits + PRIOR_REPOS * hits) / (repos + PRIOR_REPOS)
+                requests = (group_requests + PRIOR_REPOS * requests) / (repos + PRIOR_REPOS)
+        return hits, requests
+
+
+def prefilter(plan, model, min_yield=0):
+    """
+    Sort the projects to crawl by their expected hits per API request,
+    the most productive first (projects as productive keep their order),
+    and drop those below min_yield. Log the hits per API request expected
+    with and without the pre-filter
+    """
+    if not len(model):
+        logger.warning("No project of the hit history was crawled before, no pre-filter")
+        return plan
+
+    ranked = []
+    total_hits = total_requests = 0
+    hits = requests = 0
+    for contents in plan:
+        repo_hits, repo_requests = model.expected(common.ProjectRecord(*contents))
+        total_hits += repo_hits
+        total_requests += repo_requests
+        if repo_hits / repo_requests < min_yield:
+            continue
+        hits += repo_hits
+        requests += repo_requests
+        ranked.append((-repo_hits / repo_requests, contents))
+    ranked.sort(key=lambda item: item[0])
+
+    metrics.incr('prefilter_kept', len(ranked))
+    metrics.incr('prefilter_skipped', len(plan) - len(ranked))
+    logger.info("Pre-filter: %s projects to crawl, %s skipped. Expected %.0f hits in %.0f API requests "
+                "(%.3f hits/request, %.3f without the pre-filter)"
+                % (len(ranked), len(plan) - len(ranked), hits, requests,
+                   hits / requests if requests else 0,
+                   total_hits / total_requests if total_requests else 0))
+    return [contents for _, contents in ranked]
+
+
+def run_queue(args, plan=None):
+    """
+    Add the projects (or those of the crawl plan) to the work queue
+    shared with other github-api processes and retrieve the trees of the
+    projects of the queue
+    """
+    queue = workqueue.WorkQueue(args.queue_file, 'github-api', args.worker_id,
+                                args.lease, args.max_attempts)
+    if plan is not None:
+        # Refreshes are new jobs for every update of a repo. Jobs are
+        # claimed in the order of the plan
+        added = queue.add((row[2] + ":" + row[0] + ("@" + row[9] if args.refresh else ""),
+                           row, len(plan) - num) for num, row in enumerate(plan))
+    else:
+        alreadyList = set(os.listdir("master"))
+        with open(args.projects_file, "r") as csvfile:
+            rows = csv.reader(csvfile, delimiter=',', quoting=csv.QUOTE_MINIMAL)
+            # Skip the projects whose json is already downloaded
+            added = queue.add((row[2] + ":" + row[0], row, 0) for row in rows
+                              if row[2] + ":" + row[0] + ".json" not in alreadyList)
+    logger.info("%s projects added to the queue %s: %s" % (added, args.queue_file, queue.counts()))
+
+    def handler(job):
+        metrics.incr('repos')
+        result = get_tree(common.ProjectRecord(*job.payload), args.github_token)
+        if result is None:
+            raise RuntimeError("GitHub API request failed")
+        return result
+
+    queue.work(handler)
+    logger.info("Queue %s drained: %s" % (args.queue_file, queue.counts()))
+
+
 def lookup(dic, key, *keys):
     """
     Given the dictionary dic, it provides the value with the given key(s)
@@ -109,6 +404,8 @@ def get_json(repo, github_key, directory, url_append=""):
 
     url_append offers the possibility to append something to the call
     """
+    import urllib.request
+
     url = repo.url + url_append
     if "?" in url_append:
         url = url + "&access_token=" + github_key
@@ -122,9 +419,15 @@ def get_json(repo, github_key, directory, url_append=""):
         return 0
     try:
         json_name = "%s/%s:%s.json" % (directory, str(repo.owner_id), str(repo.id))
-        urllib.request.urlretrieve(url, json_name)
+        metrics.incr('api_calls')
+        with metrics.timer('api_wait'):
+            _, headers = urllib.request.urlretrieve(url, json_name)
+        metrics.incr('bytes_written', int(headers.get('Content-Length') or 0))
     except IOError as e:
+        metrics.incr('api_errors')
         logger.debug("%s, url: %s", str(e), url)
+        if getattr(e, 'code', None) == 404:
+            return NOT_FOUND
         return 0
     return 1
 
@@ -137,9 +440,10 @@ def read_json(repo, directory, lookup_list):
     and returns its value
     """
     json_name = "%s/%s:%s.json" % (directory, str(repo.owner_id), str(repo.id))
-    with open(json_name) as data_file:
+    with open(json_name, 'rb') as data_file:
         try:
-            data = json.load(data_file)
+            with metrics.timer('json_decode'):
+                data = jsoncodec.load(data_file)
         except ValueError as e:
             logger.error(str(e))
             logger.debug("Error with file: %s", json_name)
@@ -152,43 +456,6 @@ def read_json(repo, directory, lookup_list):
 logger = logging.getLogger(__name__)
 
 
-def configure_logging(log_file, debug_mode_on=False):
-    """Set up the logging and returns a list with the file descriptors
-
-    :param log_file: Path for the log file
-    :param debug_mode_on: If True, the level of the logger will be DEBUG
-
-    :return: List with logging file descriptors
-    """
-
-    if debug_mode_on:
-        logging_mode = logging.DEBUG
-    else:
-        logging_mode = logging.INFO
-
-    logger = logging.getLogger()
-    logger.setLevel(logging_mode)
-
-    # redirect logging to our log file
-    fh = logging.FileHandler(log_file, 'a')
-    fh.setLevel(logging_mode)
-
-    # create console handler with a higher log level
-    ch = logging.StreamHandler()
-    ch.setLevel(logging_mode)
-
-    # create formatter and add it to the handlers
-    formatter = logging.Formatter("[%(asctime)s - %(levelname)s] %(message)s")
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
-
-    logger.addHandler(fh)
-    logger.addHandler(ch)
-
-    keep_fds = [fh.stream.fileno()]
-    return keep_fds
-
-
 def parse_args():
     """Parse arguments from the command line"""
 
@@ -198,11 +465,27 @@ def parse_args():
                         help='GitHub token')
     parser.add_argument('--projects-file', dest='projects_file', required=True,
                         help='Projects file')
-    parser.add_argument('--log-file', dest='log_file', default='github-api.log',
-                        required=False, help='Path to log file')
-    parser.add_argument('-g', '--debug', dest='debug_mode_on', action='store_true',
-                        default=False, help='Enables debug mode')
-    return parser.parse_args()
+    parser.add_argument('--refresh', dest='refresh', action='store_true', default=False,
+                        help='Crawl again the projects updated (updated_at) since their last crawl')
+    parser.add_argument('--plan-file', dest='plan_file', required=False,
+                        help='Only write the projects to crawl (new or updated since their '
+                             'last crawl) into this projects file, in crawl order')
+    parser.add_argument('--hit-history', dest='hit_history', action='append', required=False,
+                        help='Hits file of github-tree.py (lines or records) over the trees crawled '
+                             'before: crawl first the projects expected to give more hits per API '
+                             'request, by language and years of creation and update (repeatable)')
+    parser.add_argument('--min-yield', dest='min_yield', type=float, default=0,
+                        help='Skip the projects expected to give less hits per API request '
+                             '(with --hit-history)')
+    workqueue.add_arguments(parser)
+    jsoncodec.add_arguments(parser)
+    common.add_logging_arguments(parser, 'github-api.log')
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.min_yield and not args.hit_history:
+        parser.error('--min-yield needs --hit-history')
+    return args
 
 
 if __name__ == '__main__':
@@ -211,8 +494,8 @@ if __name__ == '__main__':
     # TODO: Check if response is truncated
     try:
         args = parse_args()
-        keep_fds = configure_logging(args.log_file, args.debug_mode_on)
-        main(args)
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        metrics.run(main, args)
     except Exception as e:
         logger.exception("Exception message:")
         s = "Error: %s github-api is exiting now." % str(e)
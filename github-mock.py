@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+import argparse
+import hashlib
+import json
+import logging
+import re
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import common
+
+DESC_MSG = 'Local stand-in of the GitHub API (repos, branches, trees and raw files) to load test the crawlers'
+
+REPO_RE = re.compile(r'^/repos/([^/]+)/([^/]+)$')
+BRANCH_RE = re.compile(r'^/repos/([^/]+)/([^/]+)/branches/([^/]+)$')
+TREE_RE = re.compile(r'^/repos/([^/]+)/([^/]+)/git/trees/([0-9a-f]+)$')
+RAW_RE = re.compile(r'^/raw/([^/]+)/([^/]+)/([^/]+)/(.+)$')
+
+EXTS = ['py', 'js', 'png', 'jpg', 'svg', 'txt', 'html', 'json', 'md', 'css', 'c', 'java']
+
+
+def main(args):
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    server.daemon_threads = True
+    server.config = args
+    server.stats = Stats(args.rate_limit, args.rate_window)
+    logger.info("GitHub API mock listening on http://%s:%s" % (args.host, server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+def digest(*values):
+    return hashlib.sha1(':'.join(values).encode('utf-8')).hexdigest()
+
+
+def fraction(*values):
+    """Deterministic number in [0, 1) for the given values"""
+    return int(digest(*values)[:8], 16) / 2 ** 32
+
+
+class Stats:
+    """
+    Requests served (by status) and the rate limit shared by all clients
+    """
+
+    def __init__(self, rate_limit, rate_window):
+        self.lock = threading.Lock()
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.reset_at = time.time() + rate_window
+        self.remaining = rate_limit
+        self.requests = 0
+        self.by_status = {}
+        self.started = time.time()
+
+    def take(self):
+        """Consume one request of the quota. Return (remaining, reset epoch)"""
+        with self.lock:
+            if time.time() >= self.reset_at:
+                self.reset_at = time.time() + self.rate_window
+                self.remaining = self.rate_limit
+            if self.rate_limit and self.remaining > 0:
+                self.remaining -= 1
+            elif self.rate_limit:
+                return -1, self.reset_at
+            return self.remaining, self.reset_at
+
+    def count(self, status):
+        with self.lock:
+            self.requests += 1
+            self.by_status[status] = self.by_status.get(status, 0) + 1
+
+    def as_dict(self):
+        with self.lock:
+            elapsed = time.time() - self.started
+            return {'requests': self.requests,
+                    'by_status': {str(k): v for k, v in sorted(self.by_status.items())},
+                    'elapsed': elapsed,
+                    'requests_per_second': self.requests / elapsed if elapsed else 0}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    # Keep-alive, every answer has a Content-Length
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s" % (self.address_string(), format % args))
+
+    def do_GET(self):
+        config = self.server.config
+        stats = self.server.stats
+        path = self.path.split('?')[0]
+
+        if path == '/_stats':
+            self.send_json(200, stats.as_dict(), count=False)
+            return
+
+        if config.latency:
+            time.sleep(config.latency)
+
+        # Raw files (raw.githubusercontent.com) are not rate limited
+        match = RAW_RE.match(path)
+        if match:
+            owner, repo, branch, file_path = match.groups()
+            if fraction(owner, repo, '404') < config.not_found_rate:
+                self.send_body(404, b'404: Not Found', 'text/plain')
+            else:
+                self.send_body(200, self.raw_file(file_path), 'text/plain; charset=utf-8')
+            return
+
+        remaining, reset_at = stats.take()
+        headers = {'X-RateLimit-Limit': str(config.rate_limit),
+                   'X-RateLimit-Remaining': str(max(remaining, 0)),
+                   'X-RateLimit-Reset': str(int(reset_at))}
+        if remaining < 0:
+            self.send_json(403, {'message': 'API rate limit exceeded'}, headers)
+            return
+
+        match = REPO_RE.match(path)
+        if match:
+            owner, repo = match.groups()
+            if self.not_found(owner, repo, headers):
+                return
+            self.send_json(200, {'name': repo, 'full_name': '%s/%s' % (owner, repo),
+                                 'private': False, 'default_branch': self.default_branch(owner, repo),
+                                 'size': int(fraction(owner, repo, 'size') * config.max_size)},
+                           headers)
+            return
+
+        match = BRANCH_RE.match(path)
+        if match:
+            owner, repo, branch = match.groups()
+            if self.not_found(owner, repo, headers):
+                return
+            if branch != self.default_branch(owner, repo):
+                self.send_json(404, {'message': 'Branch not found'}, headers)
+                return
+            self.send_json(200, {'name': branch,
+                                 'commit': {'commit': {'tree': {'sha': digest(owner, repo, 'tree')}}}},
+                           headers)
+            return
+
+        match = TREE_RE.match(path)
+        if match:
+            owner, repo, sha = match.groups()
+            if self.not_found(owner, repo, headers):
+                return
+            self.send_json(200, self.tree(owner, repo, sha), headers)
+            return
+
+        self.send_json(404, {'message': 'Not Found'}, headers)
+
+    def not_found(self, owner, repo, headers):
+        """Answer with a 404 (and return True) for the repos set as missing"""
+        if fraction(owner, repo, '404') < self.server.config.not_found_rate:
+            self.send_json(404, {'message': 'Not Found'}, headers)
+            return True
+        return False
+
+    def default_branch(self, owner, repo):
+        if fraction(owner, repo, 'branch') < self.server.config.non_master_rate:
+            return 'develop'
+        return 'master'
+
+    def tree(self, owner, repo, sha):
+        config = self.server.config
+        api_url = 'http://%s:%s/repos/%s/%s' % (self.server.server_name, self.server.server_port,
+                                                 owner, repo)
+        truncated = fraction(owner, repo, 'truncated') < config.truncated_rate
+        num_files = config.files_per_tree // 2 if truncated else config.files_per_tree
+        tree = []
+        for num in range(num_files):
+            path = 'dir%d/file%d.%s' % (num % 10, num, EXTS[num % len(EXTS)])
+            blob = digest(owner, repo, path)
+            tree.append({'path': path, 'mode': '100644', 'type': 'blob', 'sha': blob,
+                         'size': num * 100, 'url': '%s/git/blobs/%s' % (api_url, blob)})
+        return {'sha': sha, 'url': '%s/git/trees/%s' % (api_url, sha), 'tree': tree,
+                'truncated': truncated}
+
+    def raw_file(self, path):
+        """
+        Content of a file, which only depends on its name so the same
+        file shows up in many repos
+        """
+        name = path.split('/')[-1]
+        size = int(fraction(name, 'size') * self.server.config.max_file_size * 1024)
+        line = ('%s %s\n' % (name, digest(name))).encode('utf-8')
+        return (line * (size // len(line) + 1))[:size]
+
+    def send_json(self, status, data, headers=None, count=True):
+        body = json.dumps(data).encode('utf-8')
+        self.send_body(status, body, 'application/json; charset=utf-8', headers, count)
+
+    def send_body(self, status, body, content_type, headers=None, count=True):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        if count:
+            self.server.stats.count(status)
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """Parse arguments from the command line"""
+
+    parser = argparse.ArgumentParser(description=DESC_MSG)
+
+    parser.add_argument('--host', dest='host', default='127.0.0.1',
+                        help='Address to listen on')
+    parser.add_argument('--port', dest='port', type=int, default=8000,
+                        help='Port to listen on')
+    parser.add_argument('--latency', dest='latency', type=float, default=0.0,
+                        help='Seconds to wait before answering each request')
+    parser.add_argument('--rate-limit', dest='rate_limit', type=int, default=5000,
+                        help='Requests allowed per rate window, 0 for no limit')
+    parser.add_argument('--rate-window', dest='rate_window', type=int, default=3600,
+                        help='Seconds of the rate limit window')
+    parser.add_argument('--not-found-rate', dest='not_found_rate', type=float, default=0.05,
+                        help='Fraction of repos answered with a 404')
+    parser.add_argument('--non-master-rate', dest='non_master_rate', type=float, default=0.1,
+                        help='Fraction of repos whose default branch is not master')
+    parser.add_argument('--truncated-rate', dest='truncated_rate', type=float, default=0.01,
+                        help='Fraction of repos with a truncated tree')
+    parser.add_argument('--files-per-tree', dest='files_per_tree', type=int, default=200,
+                        help='Number of files of each tree')
+    parser.add_argument('--max-size', dest='max_size', type=int, default=100000,
+                        help='Max. size (KB) reported for a repo')
+    parser.add_argument('--max-file-size', dest='max_file_size', type=int, default=64,
+                        help='Max. size (KB) of the raw files')
+    common.add_logging_arguments(parser, 'github-mock.log')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    try:
+        args = parse_args()
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        main(args)
+    except Exception as e:
+        logger.exception("Exception message:")
+        s = "Error: %s github-mock is exiting now." % str(e)
+        logger.error(s)
+        sys.exit(1)
@@ -23,37 +23,57 @@
 #
 
 import argparse
-import json
 import logging
 import os
+import sqlite3
 import sys
-import yaml
+
+import common
+import jsoncodec
+import metrics
 
 DESC_MSG = 'Look for patterns and heuristics into Git-trees and return a list of positive results'
 
 
 def main(args):
+    jsoncodec.use(args.json_codec)
+
+    import yaml
 
     logger.info('GitHub-Tree starts...')
 
     with open(os.path.abspath(args.heuristics_file), 'r') as hfile:
         try:
-            heuristics = yaml.load(hfile)
+            heuristics = yaml.safe_load(hfile)
         except yaml.YAMLError as e:
             logger.error(e)
             raise SystemExit
 
+    blob_index = None
+    if args.blob_index or args.duplicates != 'keep':
+        blob_index = BlobIndex(args.blob_index or ':memory:')
+    duplicates = 0
+
     logger.info("Looking for JSON files into: %s" % args.trees_path)
-    repo_jsons = os.listdir(args.trees_path)
-    with open(args.out_file, 'w') as ofile:
+    # Sorted, so the first occurrence of a blob does not depend on the listing order
+    repo_jsons = sorted(os.listdir(args.trees_path))
+    if args.output_format == 'records':
+        import records
+        ofile = records.RecordWriter(args.out_file, 'hit')
+    else:
+        ofile = open(args.out_file, 'w')
+    with ofile:
         for jsonfile_path in repo_jsons:
             jsonfile = "%s/%s" % (os.path.abspath(args.trees_path), jsonfile_path)
             (owner_id, repo_id) = jsonfile_path.split(":")
             repo_id = repo_id[:-5]
 
             logger.debug("Opening %s" % jsonfile)
-            with open(jsonfile, 'r') as data_file:
-                data = json.load(data_file)
+            with open(jsonfile, 'rb') as data_file:
+                with metrics.timer('json_decode'):
+                    data = jsoncodec.load(data_file)
+            metrics.incr('trees')
+            metrics.incr('bytes_read', os.path.getsize(jsonfile))
 
             try:
                 tree = data["tree"]
@@ -61,16 +81,105 @@ def main(args):
                 logger.warning("KeyError in file: %s" % jsonfile)
                 continue
 
-            for file_dict in tree:
-                if file_dict["type"] != "tree":
-                    try:
-                        if ("path" in file_dict) and ("url" in file_dict):
-                            if interesting(file_dict["path"], heuristics):
-                                ofile.write("%s, %s\r\n" %(file_dict["path"], file_dict["url"]))
-                            else:
-                                pass
-                    except UnicodeEncodeError:
-                        logger.error("UnicodeEncodeError in file: %s" % jsonfile)
+            metrics.incr('tree_entries', len(tree))
+            hits = [file_dict for file_dict in tree
+                    if file_dict["type"] != "tree" and ("path" in file_dict) and ("url" in file_dict)
+                    and interesting(file_dict["path"], heuristics)]
+            firsts = [True] * len(hits)
+            if blob_index is not None:
+                # Blobs of a tree indexed by a previous run are not counted again
+                count = blob_index.add_tree(jsonfile_path)
+                firsts = blob_index.add_hits(jsonfile_path,
+                                             [(file_dict.get("sha"), file_dict["path"], file_dict["url"])
+                                              for file_dict in hits], count)
+            for file_dict, first in zip(hits, firsts):
+                try:
+                    tag = ""
+                    if not first:
+                        metrics.incr('duplicate_hits')
+                        duplicates += 1
+                        if args.duplicates == 'skip':
+                            continue
+                        elif args.duplicates == 'tag':
+                            tag = ", duplicate"
+                    if args.output_format == 'records':
+                        # .../repos/<owner>/<repo>/git/blobs/<sha>
+                        owner, repo = file_dict["url"].split('/')[4:6]
+                        ofile.write(file_dict["path"], file_dict["url"], owner, repo,
+                                    owner_id, repo_id, file_dict.get("sha", ""), bool(tag))
+                    else:
+                        ofile.write("%s, %s%s\r\n" %(file_dict["path"], file_dict["url"], tag))
+                    metrics.incr('hits')
+                except UnicodeEncodeError:
+                    logger.error("UnicodeEncodeError in file: %s" % jsonfile)
+
+    if blob_index is not None:
+        logger.info("Blob index: %s blobs, %s duplicate hits" % (len(blob_index), duplicates))
+        blob_index.close()
+
+
+class BlobIndex:
+    """
+    Persistent index (SQLite) of the blobs of the hits: tree, path and
+    URL where each blob was first seen and number of occurrences. The
+    URL of a blob is the same for all its paths in a repo, so the first
+    occurrence is the (tree, path) pair. Trees indexed by a
+    previous run are remembered so they are not counted twice. Blobs are
+    looked up and inserted in batches, one per tree, and never loaded
+    into memory as a whole
+    """
+
+    # Max. number of SQL variables of a query (SQLite default limit)
+    MAX_VARIABLES = 999
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS blobs (sha TEXT PRIMARY KEY, first_url TEXT, '
+                        'occurrences INTEGER, first_tree TEXT, first_path TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS trees (name TEXT PRIMARY KEY)')
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(blobs)')]
+        for column in ['first_tree', 'first_path']:
+            if column not in columns:
+                # Index of an older version
+                self.db.execute('ALTER TABLE blobs ADD COLUMN %s TEXT' % column)
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM blobs').fetchone()[0]
+
+    def add_tree(self, name):
+        """Return True if the tree was not indexed yet"""
+        return self.db.execute('INSERT OR IGNORE INTO trees VALUES (?)', (name,)).rowcount == 1
+
+    def add_hits(self, tree, hits, count=True):
+        """
+        Record an occurrence of the blob of each (sha, path, url) hit of
+        the tree. Return, for each one, True if its blob was first seen
+        at its path of the tree (or it has no sha)
+        """
+        known = [(sha, path, url) for sha, path, url in hits if sha]
+        self.db.executemany('INSERT OR IGNORE INTO blobs VALUES (?, ?, 0, ?, ?)',
+                            ((sha, url, tree, path) for sha, path, url in known))
+        if count:
+            self.db.executemany('UPDATE blobs SET occurrences = occurrences + 1 WHERE sha = ?',
+                                ((sha,) for sha, _, _ in known))
+        shas = sorted(set(sha for sha, _, _ in known))
+        firsts = {}
+        for start in range(0, len(shas), self.MAX_VARIABLES):
+            batch = shas[start:start + self.MAX_VARIABLES]
+            for sha, first_url, first_tree, first_path in self.db.execute(
+                    'SELECT sha, first_url, first_tree, first_path FROM blobs WHERE sha IN (%s)'
+                    % ', '.join('?' * len(batch)), batch):
+                if first_path is None:
+                    # Blob indexed by an older version, only its first URL is known
+                    firsts[sha] = first_url
+                else:
+                    firsts[sha] = (first_tree, first_path)
+        return [not sha or firsts[sha] in (url, (tree, path)) for sha, path, url in hits]
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
 
 def interesting(path, heuristics):
     ext = extension(path)
@@ -120,43 +229,6 @@ def tree(path):
 logger = logging.getLogger(__name__)
 
 
-def configure_logging(log_file, debug_mode_on=False):
-    """Set up the logging and returns a list with the file descriptors
-
-    :param log_file: Path for the log file
-    :param debug_mode_on: If True, the level of the logger will be DEBUG
-
-    :return: List with logging file descriptors
-    """
-
-    if debug_mode_on:
-        logging_mode = logging.DEBUG
-    else:
-        logging_mode = logging.INFO
-
-    logger = logging.getLogger()
-    logger.setLevel(logging_mode)
-
-    # redirect logging to our log file
-    fh = logging.FileHandler(log_file, 'a')
-    fh.setLevel(logging_mode)
-
-    # create console handler
-    ch = logging.StreamHandler()
-    ch.setLevel(logging_mode)
-
-    # create formatter and add it to the handlers
-    formatter = logging.Formatter("[%(asctime)s - %(levelname)s] %(message)s")
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
-
-    logger.addHandler(fh)
-    logger.addHandler(ch)
-
-    keep_fds = [fh.stream.fileno()]
-    return keep_fds
-
-
 def parse_args():
     """Parse arguments from the command line"""
 
@@ -166,20 +238,28 @@ def parse_args():
                         help='File with patterns and other heuristics')
     parser.add_argument('--trees-path', dest='trees_path', required=True,
                         help='Path to folder containing trees information')
-    parser.add_argument('--log-file', dest='log_file', default='github-tree.log',
-                        required=False, help='Log file')
     parser.add_argument('--output-file', dest='out_file', default='hits.txt',
                         required=False, help='Path to output hits file')
-    parser.add_argument('-g', '--debug', dest='debug_mode_on', action='store_true',
-                        default=False, help='Enables debug mode')
+    parser.add_argument('--output-format', dest='output_format', default='text',
+                        choices=['text', 'records'],
+                        help='Hits as "path, url" lines or as typed records (records.py)')
+    parser.add_argument('--blob-index', dest='blob_index', required=False,
+                        help='SQLite file where the blobs of the hits are indexed across runs')
+    parser.add_argument('--duplicates', dest='duplicates', default='keep',
+                        choices=['keep', 'skip', 'tag'],
+                        help='Hits whose blob was already seen in another path or repo: '
+                             'keep them, skip them or tag them as duplicates')
+    common.add_logging_arguments(parser, 'github-tree.log')
+    jsoncodec.add_arguments(parser)
+    metrics.add_arguments(parser)
     return parser.parse_args()
 
 
 if __name__ == '__main__':
     try:
         args = parse_args()
-        keep_fds = configure_logging(args.log_file, args.debug_mode_on)
-        main(args)
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        metrics.run(main, args)
     except Exception as e:
         logger.exception("Exception message:")
         s = "Error: %s github-tree is exiting now." % str(e)
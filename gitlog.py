@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+
+"""
+Native git log backend for perceval-handler.py.
+
+It gets what projects2sql.py reads (commit hash, committer, commit date
+and changed files) from a single "git log --name-status" run with a
+minimal format, parsed line by line as git writes it. Items follow the
+schema of the Perceval Git backend for those fields and are listed in
+the same order (oldest first).
+
+As file contents are never read, repos can be cloned without blobs
+(partial clone, "blob:none"). Git only downloads the few blobs it needs
+to detect renames of modified files.
+
+History can also be limited to the commits changing some paths (the hits
+of a repo): git only walks those, and the items keep their full file
+lists.
+"""
+
+import os
+import subprocess
+
+BACKEND_NAME = 'GitLog'
+
+# Commit header line: NUL, hash, committer date (epoch), committer
+LOG_FORMAT = '--format=%x00%H%x00%ct%x00%cn <%ce>'
+
+# Same revisions, order and rename detection as Perceval's Git backend.
+# Perceval lists for a merge the files changed against its first parent
+# (its numstat). Needs git >= 2.31
+LOG_OPTIONS = ['--reverse', '--topo-order', '--name-status', '-M', '-C',
+               '--diff-merges=first-parent', '--branches', '--tags', '--remotes=origin']
+
+# Characters git escapes with a backslash in quoted paths
+QUOTE_ESCAPES = {0x07: 'a', 0x08: 'b', 0x09: 't', 0x0a: 'n', 0x0b: 'v', 0x0c: 'f',
+                 0x0d: 'r', 0x22: '"', 0x5c: '\\'}
+
+GIT_ENV = {
+    'LANG': 'C',
+    'PAGER': '',
+    'HOME': os.getenv('HOME', ''),
+    'PATH': os.getenv('PATH', ''),
+}
+
+
+def clone(uri, gitpath, clone_filter=None):
+    """
+    Bare clone of uri into gitpath, or fetch it if already cloned.
+    With clone_filter (e.g. "blob:none") the clone is partial; later
+    fetches keep the same filter
+    """
+    if os.path.exists(gitpath):
+        subprocess.run(['git', 'fetch', '-q', 'origin', '+refs/heads/*:refs/heads/*',
+                        '+refs/tags/*:refs/tags/*'],
+                       cwd=gitpath, env=GIT_ENV, check=True, stdout=subprocess.DEVNULL)
+    else:
+        cmd = ['git', 'clone', '-q', '--bare', uri, gitpath]
+        if clone_filter:
+            cmd.insert(3, '--filter=' + clone_filter)
+        subprocess.run(cmd, env=GIT_ENV, check=True, stdout=subprocess.DEVNULL)
+
+
+def fetch(uri, gitpath, clone_filter=None, paths=None):
+    """
+    Clone or update the repo and yield its commits, oldest first. With
+    paths, only the commits changing any of them
+    """
+    clone(uri, gitpath, clone_filter)
+    yield from log_items(uri, gitpath, paths)
+
+
+def log_items(uri, gitpath, paths=None):
+    """Yield the commits of the repo in gitpath parsed from git log"""
+    if is_empty(gitpath):
+        return
+    cmd = ['git', '--literal-pathspecs', 'log', LOG_FORMAT] + LOG_OPTIONS
+    if paths:
+        # Every commit changing the paths, listing all its files
+        cmd += ['--full-history', '--full-diff', '--'] + sorted(paths)
+    proc = subprocess.Popen(cmd, cwd=gitpath, env=GIT_ENV, stdout=subprocess.PIPE)
+    try:
+        items = parse_log(proc.stdout, uri)
+        if paths:
+            # A merge is walked when it changes the paths against any
+            # parent, but it only lists the files of its first parent
+            items = filter_paths(items, paths)
+        yield from items
+    finally:
+        proc.stdout.close()
+        status = proc.wait()
+    if status:
+        raise subprocess.CalledProcessError(status, 'git log')
+
+
+def is_empty(gitpath):
+    """True if the repo in gitpath has no refs to log (an empty repo)"""
+    refs = subprocess.run(['git', 'for-each-ref', '--count=1'], cwd=gitpath,
+                          env=GIT_ENV, check=True, stdout=subprocess.PIPE).stdout
+    return not refs.strip()
+
+
+def parse_log(lines, uri):
+    """Build Perceval-like items from the binary lines of git log"""
+    item = None
+    for line in lines:
+        line = line.decode('utf-8', errors='surrogateescape').rstrip('\n')
+        if line.startswith('\x00'):
+            if item:
+                yield sort_files(item)
+            _, commit, date, committer = line.split('\x00', 3)
+            item = {
+                'backend_name': BACKEND_NAME,
+                'category': 'commit',
+                'origin': uri,
+                'updated_on': float(date),
+                'data': {'commit': commit, 'Commit': committer, 'files': []},
+            }
+        elif line and item:
+            action, paths = line.split('\t', 1)
+            file_data = {'action': action}
+            if action[0] in 'RC' and '\t' in paths:
+                file_data['file'], file_data['newfile'] = paths.split('\t', 1)
+            else:
+                file_data['file'] = paths
+            item['data']['files'].append(file_data)
+    if item:
+        yield sort_files(item)
+
+
+def filter_paths(items, paths):
+    """Items (from any backend) whose files include any of paths"""
+    quoted = set(quote_path(path) for path in paths)
+    for item in items:
+        for file_data in item['data'].get('files', []):
+            if file_data['file'] in quoted or file_data.get('newfile') in quoted:
+                yield item
+                break
+
+
+def quote_path(path):
+    """Path as git prints it (core.quotePath, on by default)"""
+    raw = path.encode('utf-8', errors='surrogateescape')
+    if not any(byte < 0x20 or byte >= 0x7f or byte in QUOTE_ESCAPES for byte in raw):
+        return path
+    quoted = []
+    for byte in raw:
+        if byte in QUOTE_ESCAPES:
+            quoted.append('\\' + QUOTE_ESCAPES[byte])
+        elif byte < 0x20 or byte >= 0x7f:
+            quoted.append('\\%03o' % byte)
+        else:
+            quoted.append(chr(byte))
+    return '"' + ''.join(quoted) + '"'
+
+
+def sort_files(item):
+    """Files sorted by their (new) name, as Perceval does"""
+    item['data']['files'].sort(key=lambda file_data: file_data.get('newfile', file_data['file']))
+    return item
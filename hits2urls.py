@@ -24,24 +24,62 @@
 
 import argparse
 import csv
-import json
 import logging
 import os
 import os.path
 import sys
 
-from collections import namedtuple
+import common
+import jsoncodec
+import metrics
 
 DESC_MSG = 'Converts positive results into URLs pointing to its raw files in GitHub'
 
 
 def main(args):
+    jsoncodec.use(args.json_codec)
 
     start = "https://raw.githubusercontent.com/"
     json_path = os.path.abspath(args.json_path)
-    ProjectRecord = namedtuple('ProjectRecord', 'id, url, owner_id, name,\
-                               descriptor, language, created_at, forked_from,\
-                               deleted, updated_at')
+
+    if args.output_format == 'records':
+        import records
+        ofile = records.RecordWriter(args.output_file, 'url')
+    else:
+        ofile = open(args.output_file, 'w')
+
+    with ofile:
+        for path, username, repo, username_id, repo_id in read_hits(args):
+            branch = obtain_branch(username_id, repo_id, json_path)
+            if not branch:
+                continue
+            total = start + username + "/" + repo + "/" + branch + "/" + path
+            if args.output_format == 'records':
+                ofile.write(total, username, repo, branch, path)
+            else:
+                ofile.write(total + "\r\n")
+            metrics.incr('urls_written')
+
+
+def read_hits(args):
+    """
+    Yield (path, owner, repo, owner id, repo id) of the hits of the hits
+    file, either "path, url" lines or records (github-tree.py --output-format)
+    """
+    import records
+
+    if records.is_records(args.hits_file):
+        count = 0
+        for hit in records.read_records(args.hits_file, 'hit'):
+            count += 1
+            if args.skip_duplicates and hit.duplicate:
+                metrics.incr('duplicates_skipped')
+                continue
+            # Ids come from the name of the tree file
+            yield hit.path, hit.owner, hit.repo, hit.owner_id, hit.repo_id
+        metrics.incr('hits', count)
+        return
+
     owners_dict = {}
     projects_dict = {}
     projects_file = args.projects_file
@@ -50,38 +88,38 @@ def main(args):
         for contents in csv.reader(csvfile, quoting=csv.QUOTE_NONNUMERIC):
             contents[0] = int(contents[0])
             contents[2] = int(contents[2])
-            row = ProjectRecord(*contents)
+            row = common.ProjectRecord(*contents)
             owner_name = row.url.split('/')[4]
             projects_dict[row.name] = row.id
             owners_dict[owner_name] = row.owner_id
 
     with open(args.hits_file, 'r') as hfile:
         linelist = hfile.readlines()
-
-    with open(args.output_file, 'w') as ofile:
-        for line in linelist:
-            if "KeyError" in line:
-                continue
-            try:
-                path, blob = line.split(" https://api.github.com/")
-            except ValueError:
-                continue
-            blobList = blob.split('/')
-            username = blobList[1]
-            repo = blobList[2]
-            if (username in owners_dict) and (repo in projects_dict):
-                username_id = str(owners_dict[username])
-                repo_id = str(projects_dict[repo])
-            else:
-                username_id = username
-                repo_id = repo
-            branch = obtain_branch(username_id, repo_id, json_path)
-            if not branch:
-                continue
-            if path[-1] == ",":
-                path = path[:-1]
-            total = start + username + "/" + repo + "/" + branch + "/" + path
-            ofile.write(total + "\r\n")
+    metrics.incr('hits', len(linelist))
+
+    for line in linelist:
+        if "KeyError" in line:
+            continue
+        # Tagged by github-tree.py --duplicates tag
+        if args.skip_duplicates and line.rstrip().endswith(", duplicate"):
+            metrics.incr('duplicates_skipped')
+            continue
+        try:
+            path, blob = line.split(" https://api.github.com/")
+        except ValueError:
+            continue
+        blobList = blob.split('/')
+        username = blobList[1]
+        repo = blobList[2]
+        if (username in owners_dict) and (repo in projects_dict):
+            username_id = str(owners_dict[username])
+            repo_id = str(projects_dict[repo])
+        else:
+            username_id = username
+            repo_id = repo
+        if path[-1] == ",":
+            path = path[:-1]
+        yield path, username, repo, username_id, repo_id
 
 
 def obtain_branch(username, repo, init_path):
@@ -89,8 +127,10 @@ def obtain_branch(username, repo, init_path):
     """
     filepath = init_path + "/default/" + username + ":" + repo + ".json"
     if os.path.isfile(filepath):
-        with open(filepath) as data_file:
-            data = json.load(data_file)
+        metrics.incr('branch_files')
+        with open(filepath, 'rb') as data_file:
+            with metrics.timer('json_decode'):
+                data = jsoncodec.load(data_file)
             try:
                 return data["default_branch"]
             except KeyError:
@@ -103,43 +143,6 @@ def obtain_branch(username, repo, init_path):
 logger = logging.getLogger(__name__)
 
 
-def configure_logging(log_file, debug_mode_on=False):
-    """Set up the logging and returns a list with the file descriptors
-
-    :param log_file: Path for the log file
-    :param debug_mode_on: If True, the level of the logger will be DEBUG
-
-    :return: List with logging file descriptors
-    """
-
-    if debug_mode_on:
-        logging_mode = logging.DEBUG
-    else:
-        logging_mode = logging.INFO
-
-    logger = logging.getLogger()
-    logger.setLevel(logging_mode)
-
-    # redirect logging to our log file
-    fh = logging.FileHandler(log_file, 'a')
-    fh.setLevel(logging_mode)
-
-    # create console handler with a higher log level
-    ch = logging.StreamHandler()
-    ch.setLevel(logging_mode)
-
-    # create formatter and add it to the handlers
-    formatter = logging.Formatter("[%(asctime)s - %(levelname)s] %(message)s")
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
-
-    logger.addHandler(fh)
-    logger.addHandler(ch)
-
-    keep_fds = [fh.stream.fileno()]
-    return keep_fds
-
-
 def parse_args():
     """Parse arguments from the command line"""
 
@@ -150,21 +153,25 @@ def parse_args():
     parser.add_argument('--projects-file', dest='projects_file', required=True,
                         help='Projects file which was used with github-api')
     parser.add_argument('--hits-file', dest='hits_file', required=True,
-                        help='Path to the output file of github-tree')
+                        help='Path to the output file of github-tree (lines or records)')
     parser.add_argument('--output-file', dest='output_file', required=False,
                         help='Path to store the URLs output file', default="urls.txt")
-    parser.add_argument('--log-file', dest='log_file', default='hits2urls.log',
-                        required=False, help='Path to log file')
-    parser.add_argument('-g', '--debug', dest='debug_mode_on', action='store_true',
-                        default=False, help='Enables debug mode')
+    parser.add_argument('--output-format', dest='output_format', default='text',
+                        choices=['text', 'records'],
+                        help='URLs as lines or as typed records (records.py)')
+    parser.add_argument('--skip-duplicates', dest='skip_duplicates', action='store_true',
+                        default=False, help='Skip hits tagged as duplicates by github-tree')
+    common.add_logging_arguments(parser, 'hits2urls.log')
+    jsoncodec.add_arguments(parser)
+    metrics.add_arguments(parser)
     return parser.parse_args()
 
 
 if __name__ == '__main__':
     try:
         args = parse_args()
-        keep_fds = configure_logging(args.log_file, args.debug_mode_on)
-        main(args)
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        metrics.run(main, args)
     except Exception as e:
         logger.exception("Exception message:")
         s = "Error: %s hits2urls is exiting now." % str(e)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import common
+import jsoncodec
+
+DESC_MSG = 'Compares the JSON codecs over the trees and commit files of the pipeline'
+
+# Stage: what the pipeline does with the JSON files
+STAGES = [
+    ('trees', 'github-tree.py, tree-index.py: decode the trees'),
+    ('branches', 'github-api.py, hits2urls.py: decode the branch files'),
+    ('commits', 'projects2sql.py: decode the Perceval JSON files'),
+    ('commits_encode', 'perceval-handler.py: encode the commits'),
+    ('projection_encode', 'perceval-handler.py --projection: encode the commits (compact)'),
+]
+
+
+def main(args):
+    names = jsoncodec.available()
+    codecs = [jsoncodec.get_codec(name) for name in names]
+    if names == ['json']:
+        logger.warning("No fast JSON codec installed, only the standard library is measured")
+    stdlib = jsoncodec.StdlibCodec()
+
+    inputs = {'trees': args.trees_path, 'branches': args.branches_path, 'commits': args.json_path}
+    files = {stage: 0 for stage, _ in STAGES}
+    sizes = {stage: 0 for stage, _ in STAGES}
+    times = {name: {stage: 0.0 for stage, _ in STAGES} for name in names}
+    mismatches = []
+    for stage, path in inputs.items():
+        if not path:
+            continue
+        for file_path in find_files(path, args.max_files):
+            with open(file_path, 'rb') as jfile:
+                data = jfile.read()
+            expected = stdlib.loads(data)
+            files[stage] += 1
+            sizes[stage] += len(data)
+            for codec in codecs:
+                elapsed, obj = best_of(args.repeat, codec.loads, data)
+                times[codec.name][stage] += elapsed
+                if obj != expected:
+                    logger.warning("%s decodes %s differently" % (codec.name, file_path))
+                    mismatches.append((codec.name, file_path))
+            if stage != 'commits':
+                continue
+
+            for encode_stage, indent in (('commits_encode', 4), ('projection_encode', None)):
+                files[encode_stage] += 1
+                sizes[encode_stage] += len(stdlib.dumps(expected, indent, True))
+                for codec in codecs:
+                    elapsed, encoded = best_of(args.repeat, codec.dumps, expected, indent, True)
+                    times[codec.name][encode_stage] += elapsed
+                    if stdlib.loads(encoded) != expected:
+                        logger.warning("%s encodes %s differently" % (codec.name, file_path))
+                        mismatches.append((codec.name, file_path))
+
+    result = {'codecs': names, 'repeat': args.repeat, 'mismatches': mismatches}
+    for stage, desc in STAGES:
+        if not files[stage]:
+            continue
+        result[stage] = {'files': files[stage], 'bytes': sizes[stage]}
+        for name in names:
+            seconds = times[name][stage]
+            result[stage][name] = {
+                'seconds': round(seconds, 3),
+                'mb_per_second': round(sizes[stage] / seconds / 2 ** 20, 1) if seconds else 0,
+            }
+        line = "%s (%s files, %.1f MB):" % (desc, files[stage], sizes[stage] / 2 ** 20)
+        for name in names:
+            line += " %s %.3f s," % (name, times[name][stage])
+        if names[0] != 'json' and times[names[0]][stage]:
+            result[stage]['speedup'] = round(times['json'][stage] / times[names[0]][stage], 2)
+            line += " %.1fx" % result[stage]['speedup']
+        logger.info(line.rstrip(','))
+
+    logger.info("Result: %s" % json.dumps(result, sort_keys=True))
+    if args.output_file:
+        with open(args.output_file, 'w') as ofile:
+            json.dump(result, ofile, indent=4, sort_keys=True)
+
+    if mismatches:
+        raise SystemExit(2)
+
+
+def find_files(path, max_files=0):
+    """JSON files of a folder, in name order"""
+    names = sorted(name for name in os.listdir(path) if name.endswith('.json'))
+    if max_files:
+        names = names[:max_files]
+    return [os.path.join(path, name) for name in names]
+
+
+def best_of(repeat, function, *args):
+    """Shortest time of repeat calls to function(*args), and its result"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """Parse arguments from the command line"""
+
+    parser = argparse.ArgumentParser(description=DESC_MSG)
+
+    parser.add_argument('--trees-path', dest='trees_path', required=False,
+                        help='Folder of trees (trees folder of github-api.py)')
+    parser.add_argument('--branches-path', dest='branches_path', required=False,
+                        help='Folder of branch files (master or default folder of github-api.py)')
+    parser.add_argument('--json-path', dest='json_path', required=False,
+                        help='Folder of Perceval JSON files (output path of perceval-handler.py)')
+    parser.add_argument('--max-files', dest='max_files', type=int, default=0,
+                        help='Only the first MAX_FILES files of every folder')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3,
+                        help='Times every file is decoded or encoded (the best one counts)')
+    parser.add_argument('--output-file', dest='output_file', required=False,
+                        help='Path to store the results (JSON)')
+    common.add_logging_arguments(parser, 'json-benchmark.log')
+    args = parser.parse_args()
+
+    if not (args.trees_path or args.branches_path or args.json_path):
+        parser.error('at least one of --trees-path, --branches-path or --json-path is needed')
+    return args
+
+
+if __name__ == '__main__':
+    try:
+        args = parse_args()
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        main(args)
+    except Exception as e:
+        logger.exception("Exception message:")
+        s = "Error: %s json-benchmark is exiting now." % str(e)
+        logger.error(s)
+        sys.exit(1)
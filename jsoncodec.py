@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+
+
+"""
+JSON codec shared by the scripts: orjson when it is installed, the json
+module of the standard library otherwise.
+
+Documents are decoded from text or UTF-8 bytes and encoded to UTF-8
+bytes. Whatever orjson rejects (lone surrogates, NaN, integers beyond 64
+bits) goes through the standard library, and so do documents with NaN or
+infinite floats, which orjson would write as null. The data read and
+written does not depend on the codec. Encoded documents are equivalent
+but not the same bytes: orjson indents with two spaces and does not
+escape non-ASCII characters.
+"""
+
+import json
+import math
+
+AUTO = 'auto'
+
+
+class StdlibCodec:
+    """json module of the standard library"""
+
+    name = 'json'
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj, indent=None, sort_keys=False):
+        return json.dumps(obj, indent=indent, sort_keys=sort_keys).encode('utf-8')
+
+
+class OrjsonCodec:
+    """orjson, falling back to the standard library for what it rejects"""
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+
+        self.orjson = orjson
+        self.fallback = StdlibCodec()
+
+    def loads(self, data):
+        try:
+            return self.orjson.loads(data)
+        except self.orjson.JSONDecodeError:
+            return self.fallback.loads(data)
+
+    def dumps(self, obj, indent=None, sort_keys=False):
+        option = 0
+        if indent:
+            option |= self.orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= self.orjson.OPT_SORT_KEYS
+        try:
+            data = self.orjson.dumps(obj, option=option)
+        except TypeError:
+            return self.fallback.dumps(obj, indent, sort_keys)
+        # Non-finite floats are written as null, only look for them then
+        if b'null' in data and has_non_finite(obj):
+            return self.fallback.dumps(obj, indent, sort_keys)
+        return data
+
+
+def has_non_finite(obj):
+    """True if obj holds any NaN or infinite float"""
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(has_non_finite(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(has_non_finite(value) for value in obj)
+    return False
+
+
+# Fastest first
+CODECS = {'orjson': OrjsonCodec, 'json': StdlibCodec}
+
+_codec = None
+
+
+def add_arguments(parser):
+    """Add the JSON codec option to an argparse parser"""
+    parser.add_argument('--json-codec', dest='json_codec', default=AUTO,
+                        choices=[AUTO] + list(CODECS),
+                        help='JSON codec (auto: the fastest one installed)')
+
+
+def get_codec(name=AUTO):
+    """Codec by name, or the fastest one installed with auto"""
+    if name != AUTO:
+        return CODECS[name]()
+    for codec_class in CODECS.values():
+        try:
+            return codec_class()
+        except ImportError:
+            continue
+
+
+def available():
+    """Names of the codecs installed"""
+    names = []
+    for name, codec_class in CODECS.items():
+        try:
+            codec_class()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def use(name=AUTO):
+    """Select the codec of the functions below. Return it"""
+    global _codec
+    _codec = get_codec(name)
+    return _codec
+
+
+def codec():
+    return _codec or use()
+
+
+def loads(data):
+    """Decode a document from text or UTF-8 bytes"""
+    return codec().loads(data)
+
+
+def load(fp):
+    """Decode a file (better opened in binary mode)"""
+    return codec().loads(fp.read())
+
+
+def dumps(obj, indent=None, sort_keys=False):
+    """Encode obj as UTF-8 bytes"""
+    return codec().dumps(obj, indent, sort_keys)
+
+
+def dump(obj, fp, indent=None, sort_keys=False):
+    """Encode obj into a file opened in binary mode"""
+    fp.write(codec().dumps(obj, indent, sort_keys))
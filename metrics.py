@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+"""
+Counters, timers and peak memory shared by all the scripts.
+
+Scripts count what they process with incr() and time their stages with
+timer(). The values are dumped periodically (and at exit) as JSON or as
+a Prometheus textfile when --metrics-file is given, and --profile runs
+main() under cProfile.
+"""
+
+import collections
+import contextlib
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_counters = collections.Counter()
+_timers = collections.Counter()
+_started = time.time()
+
+
+def incr(name, value=1):
+    """Add value to the counter name (items, bytes, API calls...)"""
+    with _lock:
+        _counters[name] += value
+
+
+def add_time(name, seconds):
+    """Add seconds to the timer name"""
+    with _lock:
+        _timers[name] += seconds
+
+
+@contextlib.contextmanager
+def timer(name):
+    """Add the time spent in the block to the timer name"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+
+
+def peak_rss():
+    """Peak resident memory of the process (and its finished children) in bytes"""
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux reports KB, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def snapshot():
+    with _lock:
+        return {'script': script_name(),
+                'uptime_seconds': round(time.time() - _started, 3),
+                'peak_rss_bytes': peak_rss(),
+                'counters': dict(_counters),
+                'timers_seconds': {name: round(value, 6) for name, value in _timers.items()}}
+
+
+def script_name():
+    return os.path.splitext(os.path.basename(sys.argv[0]))[0]
+
+
+def prometheus(data):
+    """Format a snapshot for the node_exporter textfile collector"""
+    label = '{script="%s"}' % data['script']
+    lines = ['ghtools_uptime_seconds%s %s' % (label, data['uptime_seconds']),
+             'ghtools_peak_rss_bytes%s %s' % (label, data['peak_rss_bytes'])]
+    for name, value in sorted(data['counters'].items()):
+        lines.append('ghtools_%s_total%s %s' % (name, label, value))
+    for name, value in sorted(data['timers_seconds'].items()):
+        lines.append('ghtools_%s_seconds_total%s %s' % (name, label, value))
+    return '\n'.join(lines) + '\n'
+
+
+def dump(metrics_file, metrics_format='json'):
+    """Write the current values, atomically replacing the previous ones"""
+    data = snapshot()
+    tmp_file = metrics_file + '.tmp'
+    with open(tmp_file, 'w') as mfile:
+        if metrics_format == 'prometheus':
+            mfile.write(prometheus(data))
+        else:
+            json.dump(data, mfile, indent=4, sort_keys=True)
+    os.replace(tmp_file, metrics_file)
+
+
+class Reporter(threading.Thread):
+    """Dump the metrics every interval seconds"""
+
+    def __init__(self, metrics_file, metrics_format, interval):
+        super().__init__(daemon=True)
+        self.metrics_file = metrics_file
+        self.metrics_format = metrics_format
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                dump(self.metrics_file, self.metrics_format)
+            except IOError as e:
+                logger.warning("Metrics could not be dumped: %s" % str(e))
+
+    def stop(self):
+        self.stopped.set()
+        dump(self.metrics_file, self.metrics_format)
+
+
+def add_arguments(parser):
+    """Add the metrics and profiling options to the parser of a script"""
+
+    parser.add_argument('--metrics-file', dest='metrics_file', required=False,
+                        help='Path where metrics are dumped periodically')
+    parser.add_argument('--metrics-format', dest='metrics_format', default='json',
+                        choices=['json', 'prometheus'], help='Format of the metrics file')
+    parser.add_argument('--metrics-interval', dest='metrics_interval', type=float, default=60,
+                        help='Seconds between metrics dumps')
+    parser.add_argument('--profile', dest='profile_file', nargs='?', const='', default=None,
+                        help='Run under cProfile, saving the stats into PROFILE_FILE '
+                             '(<script>.prof by default)')
+
+
+def run(main, args):
+    """
+    Run main(args) with the metrics reporter and, if asked, under cProfile
+    """
+    reporter = None
+    if getattr(args, 'metrics_file', None):
+        reporter = Reporter(args.metrics_file, args.metrics_format, args.metrics_interval)
+        reporter.start()
+
+    try:
+        if getattr(args, 'profile_file', None) is None:
+            return main(args)
+        import cProfile
+        import pstats
+
+        profile_file = args.profile_file or script_name() + '.prof'
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(main, args)
+        finally:
+            profiler.dump_stats(profile_file)
+            logger.info("Profile saved into %s" % profile_file)
+            stats = pstats.Stats(profiler, stream=sys.stderr)
+            stats.sort_stats('cumulative').print_stats(25)
+    finally:
+        if reporter:
+            reporter.stop()
+        logger.info("Metrics: %s" % json.dumps(snapshot(), sort_keys=True))
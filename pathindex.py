@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+
+"""
+Compact index of the paths of the trees fetched by github-api.py.
+
+Every file of every tree is a row of NumPy columns (tree, directory,
+basename, extension, URL prefix, size and blob SHA). Directories,
+basenames, extensions and URL prefixes are interned into string tables,
+so the heuristics of github-tree.py are evaluated once per distinct
+extension and basename and then applied to all the rows with vectorized
+operations. The index is a folder of .npy files opened memory-mapped.
+"""
+
+import array
+import json
+import os
+
+import numpy as np
+
+VERSION = 1
+META_FILE = 'meta.json'
+COLUMNS = ['tree_id', 'dir_id', 'base_id', 'ext_id', 'prefix_id', 'size', 'sha']
+TABLES = ['trees', 'dirs', 'bases', 'exts', 'prefixes']
+
+# Paths can hold lone surrogates (invalid UTF-8 in the tree JSON)
+ENCODING = 'utf-8'
+ERRORS = 'surrogatepass'
+
+
+def extension(path):
+    """Extension of a path, as github-tree.py computes it"""
+    tmp_list = path.split('.')
+    if len(tmp_list) > 1:
+        return tmp_list[-1].lower()
+    return ""
+
+
+def stem(basename):
+    """Basename without its extension, in lower case"""
+    if '.' in basename:
+        basename = basename.rsplit('.', 1)[0]
+    return basename.lower()
+
+
+class Interner:
+    """Ids of the distinct strings, in order of appearance"""
+
+    def __init__(self, *strings):
+        self.ids = {}
+        self.strings = []
+        for string in strings:
+            self.id(string)
+
+    def id(self, string):
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+
+def save_table(path, name, strings):
+    """Save a string table as its concatenated UTF-8 bytes and their offsets"""
+    encoded = [string.encode(ENCODING, ERRORS) for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    np.save(os.path.join(path, name + '.data.npy'), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    np.save(os.path.join(path, name + '.offsets.npy'), offsets)
+
+
+class StringTable:
+    """Read only string table, decoded on demand"""
+
+    def __init__(self, path, name):
+        self.data = np.load(os.path.join(path, name + '.data.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, name + '.offsets.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, string_id):
+        start, end = self.offsets[string_id], self.offsets[string_id + 1]
+        return self.data[start:end].tobytes().decode(ENCODING, ERRORS)
+
+    def strings(self):
+        data = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        return [data[start:end].decode(ENCODING, ERRORS)
+                for start, end in zip(offsets, offsets[1:])]
+
+
+class PathIndexWriter:
+    """Add the files of the trees one by one and save the index at the end"""
+
+    def __init__(self, path):
+        self.path = path
+        self.trees = []
+        self.owner_ids = []
+        self.repo_ids = []
+        # The root directory is always id 0: github-tree.py only looks for
+        # keywords in files inside a directory
+        self.dirs = Interner('')
+        self.bases = Interner()
+        self.exts = Interner()
+        self.prefixes = Interner()
+        self.tree_id = array.array('i')
+        self.dir_id = array.array('i')
+        self.base_id = array.array('i')
+        self.ext_id = array.array('i')
+        self.prefix_id = array.array('i')
+        self.size = array.array('q')
+        self.sha = bytearray()
+
+    def __len__(self):
+        return len(self.tree_id)
+
+    def add_tree(self, name):
+        """Add a tree file ("owner_id:repo_id.json") and return its id"""
+        owner_id, repo_id = name[:-5].split(':')
+        self.trees.append(name)
+        self.owner_ids.append(int(owner_id))
+        self.repo_ids.append(int(repo_id))
+        return len(self.trees) - 1
+
+    def add_file(self, tree_id, path, url, sha='', size=-1):
+        directory, _, basename = path.rpartition('/')
+        # URLs are "<prefix><sha>", so only the prefixes are interned (SHA-1
+        # blobs: the SHA column holds 40 characters)
+        if len(sha) == 40 and url.endswith(sha):
+            url = url[:-len(sha)]
+        else:
+            sha = ''
+        self.tree_id.append(tree_id)
+        self.dir_id.append(self.dirs.id(directory))
+        self.base_id.append(self.bases.id(basename))
+        self.ext_id.append(self.exts.id(extension(path)))
+        self.prefix_id.append(self.prefixes.id(url))
+        self.size.append(size)
+        self.sha += sha.encode('ascii').ljust(40, b'\0')
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        dtypes = {'size': np.int64, 'sha': 'S40'}
+        for column in COLUMNS:
+            values = np.frombuffer(getattr(self, column), dtype=dtypes.get(column, np.int32))
+            np.save(os.path.join(self.path, column + '.npy'), values)
+        np.save(os.path.join(self.path, 'owner_ids.npy'), np.array(self.owner_ids, dtype=np.int64))
+        np.save(os.path.join(self.path, 'repo_ids.npy'), np.array(self.repo_ids, dtype=np.int64))
+        tables = {'trees': self.trees, 'dirs': self.dirs.strings, 'bases': self.bases.strings,
+                  'exts': self.exts.strings, 'prefixes': self.prefixes.strings}
+        for name, strings in tables.items():
+            save_table(self.path, name, strings)
+        meta = {'version': VERSION, 'files': len(self)}
+        meta.update({name: len(strings) for name, strings in tables.items()})
+        with open(os.path.join(self.path, META_FILE), 'w') as mfile:
+            json.dump(meta, mfile, indent=2, sort_keys=True)
+        return meta
+
+
+class PathIndex:
+    """Read only, memory-mapped view over a path index"""
+
+    def __init__(self, path):
+        with open(os.path.join(path, META_FILE), 'r') as mfile:
+            self.meta = json.load(mfile)
+        if self.meta['version'] != VERSION:
+            raise ValueError("Unsupported path index version %s in %s"
+                             % (self.meta['version'], path))
+        for column in COLUMNS + ['owner_ids', 'repo_ids']:
+            setattr(self, column, np.load(os.path.join(path, column + '.npy'), mmap_mode='r'))
+        for name in TABLES:
+            setattr(self, name, StringTable(path, name))
+
+    def __len__(self):
+        return len(self.tree_id)
+
+    def ext_mask(self, exts):
+        """Rows whose extension is in exts"""
+        exts = set(exts)
+        selected = np.array([ext in exts for ext in self.exts.strings()], dtype=bool)
+        return selected[self.ext_id]
+
+    def keyword_bases(self, keywords):
+        """Boolean matrix (keywords x basenames) of the basenames containing each keyword"""
+        stems = [stem(basename) for basename in self.bases.strings()]
+        matches = np.zeros((len(keywords), len(stems)), dtype=bool)
+        for k, keyword in enumerate(keywords):
+            matches[k] = [keyword in name for name in stems]
+        return matches
+
+    def in_dir(self):
+        """Rows of files inside a directory: github-tree.py only looks for keywords there"""
+        return np.asarray(self.dir_id) != 0
+
+    def hits(self, heuristics):
+        """Rows that github-tree.py would return with these heuristics"""
+        level_one = self.ext_mask(heuristics['level-one_exts'] or [])
+        keywords = heuristics['keywords'] or []
+        if not keywords:
+            return level_one
+        level_two = self.ext_mask(heuristics['level-two_exts'] or [])
+        with_keyword = self.keyword_bases(keywords).any(axis=0)[self.base_id]
+        return level_one | (level_two & with_keyword & self.in_dir())
+
+    def keyword_histogram(self, heuristics):
+        """
+        Number of files with a level-two extension matched by each keyword
+        (a file can be matched by several of them)
+
+        :return: Tuple of lists (keywords, files)
+        """
+        keywords = heuristics['keywords'] or []
+        candidates = self.ext_mask(heuristics['level-two_exts'] or []) & self.in_dir()
+        matches = self.keyword_bases(keywords)
+        counts = [int(np.count_nonzero(candidates & matches[k][self.base_id]))
+                  for k in range(len(keywords))]
+        return keywords, counts
+
+    def ext_histogram(self, mask=None):
+        """
+        Number of files and bytes per extension, most frequent first
+
+        :return: Tuple of arrays (extension ids, files, bytes)
+        """
+        ext_id = np.asarray(self.ext_id)
+        size = np.maximum(np.asarray(self.size), 0)
+        if mask is not None:
+            ext_id, size = ext_id[mask], size[mask]
+        counts = np.bincount(ext_id, minlength=len(self.exts))
+        sizes = np.bincount(ext_id, weights=size, minlength=len(self.exts)).astype(np.int64)
+        ext_ids = np.flatnonzero(counts)
+        order = np.argsort(-counts[ext_ids], kind='stable')
+        ext_ids = ext_ids[order]
+        return ext_ids, counts[ext_ids], sizes[ext_ids]
+
+    def path(self, row):
+        directory = self.dirs[self.dir_id[row]]
+        basename = self.bases[self.base_id[row]]
+        return directory + '/' + basename if directory else basename
+
+    def url(self, row):
+        return self.prefixes[self.prefix_id[row]] + self.sha[row].decode('ascii')
+
+    def iter_hits(self, mask):
+        """(path, url, tree id, sha) of the selected rows, in index order"""
+        dirs = self.dirs.strings()
+        bases = self.bases.strings()
+        prefixes = self.prefixes.strings()
+        rows = np.flatnonzero(mask)
+        for tree_id, dir_id, base_id, prefix_id, sha in zip(self.tree_id[rows].tolist(),
+                                                            self.dir_id[rows].tolist(),
+                                                            self.base_id[rows].tolist(),
+                                                            self.prefix_id[rows].tolist(),
+                                                            self.sha[rows].tolist()):
+            directory = dirs[dir_id]
+            path = directory + '/' + bases[base_id] if directory else bases[base_id]
+            sha = sha.decode('ascii')
+            yield path, prefixes[prefix_id] + sha, tree_id, sha
@@ -23,17 +23,33 @@
 #
 
 import argparse
-import json
 import logging
 import os
+import queue
 import shutil
 import sys
-import urllib.request
+import threading
 
-from perceval.backends.core.git import Git
+import common
+import jsoncodec
+import metrics
+import records
+import workqueue
 
 DESC_MSG = 'Calls GrimoireLab-Perceval to extract git information from the output file of hits2urls.py script'
 
+# Fields (dotted paths into the Perceval items) each consumer reads
+PROJECTIONS = {
+    'projects2sql': 'data.commit,data.Commit,data.files.file,updated_on',
+}
+
+
+def output_name(repo, output_format='json'):
+    """Name of the output file of an "owner/name" repo"""
+    repo_split = repo.split('/')
+    extension = 'rec' if output_format == 'records' else 'json'
+    return "%s_%s.%s" % (repo_split[0], repo_split[1], extension)
+
 
 def remove_dir(directory):
     if os.path.exists(directory):
@@ -42,26 +58,38 @@ def remove_dir(directory):
 
 
 def main(args):
-    github_key = args.github_token
+    jsoncodec.use(args.json_codec)
     list_jsons = os.listdir(os.path.abspath(args.output_path))
     repo_set = set()
-    with open(args.urls_file, 'r') as url_file:
-        os.chdir(os.path.abspath(args.output_path))
-        for line in url_file:
-            try:
-                url = line.split('/')
-                repo = "%s/%s" % (url[3], url[4])
-            except IndexError:
-                logger.error("Error in repo (line) " + line + "\r\n")
-                continue
-
+    repo_paths = {}
+    if records.is_records(args.urls_file):
+        for url in records.read_records(args.urls_file, 'url'):
+            repo = "%s/%s" % (url.owner, url.repo)
             repo_set.add(repo)
-
+            repo_paths.setdefault(repo, set()).add(url.path)
+        os.chdir(os.path.abspath(args.output_path))
+    else:
+        with open(args.urls_file, 'r') as url_file:
+            os.chdir(os.path.abspath(args.output_path))
+            for line in url_file:
+                try:
+                    url = line.split('/')
+                    repo = "%s/%s" % (url[3], url[4])
+                except IndexError:
+                    logger.error("Error in repo (line) " + line + "\r\n")
+                    continue
+
+                repo_set.add(repo)
+                # Path of the hit, after owner, repo and branch
+                repo_paths.setdefault(repo, set()).add("/".join(url[6:]).rstrip('\r\n'))
+
+    if not args.only_hits:
+        repo_paths = {}
+
+    repos = []
     for repo in sorted(repo_set):
 
-        repo_split = repo.split('/')
-        outfile_name = "%s_%s.json" % (repo_split[0], repo_split[1])
-        outfile_path = "%s/%s" % (args.output_path, outfile_name)
+        outfile_name = output_name(repo, args.output_format)
 
         if outfile_name in list_jsons:
             logger.info("Already downloaded: %s " % outfile_name)
@@ -69,93 +97,273 @@ def main(args):
         if "framework" in outfile_name:
             logger.info("Skipping <framework> repository")
             continue
+        repos.append(repo)
 
-        api_url = "https://api.github.com/repos/" + str(repo) + "?access_token=" + github_key
-        logger.info("Checking metadata for repo %s" % repo)
-        try:
-            response = urllib.request.urlopen(api_url)
-        except urllib.error.HTTPError:
-            logger.error("HTTP 404: Not found: %s" % repo)
-            continue
+    if args.queue_file:
+        run_queue(repos, args, repo_paths)
+        return
 
-        try:
-            json_data = response.read().decode('utf-8')
-            dicc_out = json.loads(json_data)
-        except ValueError:
-            logger.warning("Error in response (ValueError)")
-            continue
+    jobs = check_repos(repos, args)
+    logger.info("Scheduling %s repos (%s KB) with %s worker(s)" %
+                (len(jobs), sum(size for _, size in jobs), args.jobs))
+    scheduler = CloneScheduler(jobs, args.disk_budget * 1024)
+    workers = [threading.Thread(target=worker, args=(scheduler, args, repo_paths))
+               for _ in range(max(1, args.jobs))]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
 
 
-        if 'message' in dicc_out:
-            result = dicc_out['message']
-        elif dicc_out == {}:
-            result = 'False'
-        else:
-            result = dicc_out['private']
-
-        if result == 'Not Found':
-            logger.error("Not found: %s" % repo)
-        elif result == 'True':
-            logger.error("Private: %s" % repo)
-        else:
-            repo_url = "https://github.com/%s" % repo
-
-            logger.info('Executing Perceval with repo: %s' % repo)
-            logger.debug('Repo stats. Size: %s KB' % dicc_out["size"])
-            gitpath = '%s/%s' % (os.path.abspath(args.perceval_path), repo)
-            git = Git(uri=repo_url, gitpath=gitpath)
+def check_repos(repos, args):
+    """
+    Check the metadata of the repos with args.jobs threads. Return the
+    (repo, size) jobs of the repos which can be fetched
+    """
+    pending = queue.Queue()
+    for repo in repos:
+        pending.put(repo)
+    jobs = []
+
+    def checker():
+        while True:
+            try:
+                repo = pending.get_nowait()
+            except queue.Empty:
+                break
             try:
-                commits = [commit for commit in git.fetch()]
-            except Exception as e:
-                logger.warning("Failure while fetching commits. Repo: %s" % repo)
-                logger.error(e)
+                size = check_metadata(repo, args.github_token, args.api_url)
+            except (OSError, ValueError) as e:
+                logger.error("Metadata of %s not available: %s" % (repo, str(e)))
                 continue
-            logger.info('Exporting results to JSON...')
-            with open(outfile_path, "w", encoding='utf-8') as jfile:
-                json.dump(commits, jfile, indent=4, sort_keys=True)
-            logger.info('Exported to %s' % outfile_path)
-            if not args.cache_mode_on:
-                remove_dir(gitpath)
+            if size is not None:
+                jobs.append((repo, size))
 
+    checkers = [threading.Thread(target=checker) for _ in range(max(1, args.jobs))]
+    for thread in checkers:
+        thread.start()
+    for thread in checkers:
+        thread.join()
+    return jobs
 
-logger = logging.getLogger(__name__)
 
+def run_queue(repos, args, repo_paths):
+    """
+    Add the repos to the work queue shared with other perceval-handler
+    processes and fetch the repos of the queue with args.jobs threads
+    """
+    work_queue = workqueue.WorkQueue(args.queue_file, 'perceval-handler', args.worker_id,
+                                     args.lease, args.max_attempts)
+    added = work_queue.add((repo, {'paths': sorted(repo_paths[repo]) if repo in repo_paths else None}, 0)
+                           for repo in repos)
+    logger.info("%s repos added to the queue %s: %s" % (added, args.queue_file, work_queue.counts()))
+
+    def handler(job):
+        if check_metadata(job.key, args.github_token, args.api_url) is None:
+            return 'skipped'
+        if not fetch_repo(job.key, args, job.payload['paths']):
+            raise RuntimeError("Fetch of %s failed" % job.key)
+        return 'fetched'
+
+    workers = [threading.Thread(target=work_queue.work, args=(handler,))
+               for _ in range(max(1, args.jobs))]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    logger.info("Queue %s drained: %s" % (args.queue_file, work_queue.counts()))
+
+
+def projection_fields(projection):
+    """
+    Nested dict with the fields to keep, from the name of a consumer in
+    PROJECTIONS or a comma separated list of dotted paths
+    """
+    fields = {}
+    for path in PROJECTIONS.get(projection, projection).split(','):
+        node = fields
+        for key in path.strip().split('.'):
+            node = node.setdefault(key, {})
+    return fields
+
+
+def project(item, fields):
+    """Copy of item with only the given fields (lists are projected item by item)"""
+    if not fields:
+        return item
+    if isinstance(item, list):
+        return [project(element, fields) for element in item]
+    if isinstance(item, dict):
+        return {key: project(item[key], subfields)
+                for key, subfields in fields.items() if key in item}
+    return item
+
+
+def check_metadata(repo, github_key, api_url="https://api.github.com"):
+    """
+    Query the GitHub API for the metadata of the repo. Return its size
+    (in KB) or None when the repo is not found or private. Other HTTP
+    errors (rate limit, server errors) and invalid responses are raised
+    """
+    import urllib.error
+    import urllib.request
+
+    api_url = api_url + "/repos/" + str(repo) + "?access_token=" + github_key
+    logger.info("Checking metadata for repo %s" % repo)
+    metrics.incr('api_calls')
+    try:
+        response = urllib.request.urlopen(api_url)
+    except urllib.error.HTTPError as e:
+        metrics.incr('api_errors')
+        if e.code == 404:
+            logger.error("HTTP 404: Not found: %s" % repo)
+            return None
+        logger.error("HTTP %s: %s: %s" % (e.code, e.reason, repo))
+        raise
+
+    try:
+        json_data = response.read()
+        with metrics.timer('json_decode'):
+            dicc_out = jsoncodec.loads(json_data)
+    except ValueError:
+        logger.warning("Error in response (ValueError)")
+        raise
+
+    if 'message' in dicc_out:
+        result = dicc_out['message']
+    elif dicc_out == {}:
+        result = 'False'
+    else:
+        result = dicc_out['private']
+
+    if result == 'Not Found':
+        logger.error("Not found: %s" % repo)
+        return None
+    elif result == 'True':
+        logger.error("Private: %s" % repo)
+        return None
 
-def configure_logging(log_file, debug_mode_on=False):
-    """Set up the logging and returns a list with the file descriptors
+    logger.debug('Repo stats. Size: %s KB' % dicc_out.get("size", 0))
+    return int(dicc_out.get("size") or 0)
 
-    :param log_file: Path for the log file
-    :param debug_mode_on: If True, the level of the logger will be DEBUG
 
-    :return: List with logging file descriptors
+class CloneScheduler:
+    """
+    Hand out clone jobs, the biggest ones first so they do not end up as
+    a long serial tail. A job is only admitted while the size of the
+    clones in progress fits into the disk budget (in KB, 0 for no limit).
+    A job bigger than the whole budget runs alone: once it is the next
+    one to start, no other job is admitted until it does.
     """
 
-    if debug_mode_on:
-        logging_mode = logging.DEBUG
-    else:
-        logging_mode = logging.INFO
+    def __init__(self, jobs, disk_budget=0):
+        self.pending = sorted(jobs, key=lambda job: job[1], reverse=True)
+        self.disk_budget = disk_budget
+        self.in_use = 0
+        self.running = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        """Block until a job fits into the budget. Return None when done"""
+        with self.cond:
+            while self.pending:
+                for index, (repo, size) in enumerate(self.pending):
+                    if not self.disk_budget or not self.running or \
+                            self.in_use + size <= self.disk_budget:
+                        del self.pending[index]
+                        self.in_use += size
+                        self.running += 1
+                        return repo, size
+                    if size > self.disk_budget:
+                        # Smaller jobs would keep an oversize one waiting
+                        break
+                self.cond.wait()
+        return None
+
+    def release(self, job):
+        with self.cond:
+            self.in_use -= job[1]
+            self.running -= 1
+            self.cond.notify_all()
+
+
+def worker(scheduler, args, repo_paths):
+    while True:
+        job = scheduler.acquire()
+        if job is None:
+            break
+        try:
+            fetch_repo(job[0], args, repo_paths.get(job[0]))
+        except Exception as e:
+            logger.error("Unexpected failure with repo %s: %s" % (job[0], str(e)))
+        finally:
+            scheduler.release(job)
 
-    logger = logging.getLogger()
-    logger.setLevel(logging_mode)
 
-    # redirect logging to our log file
-    fh = logging.FileHandler(log_file, 'a')
-    fh.setLevel(logging_mode)
+def fetch_repo(repo, args, paths=None):
+    """
+    Fetch the commits of repo and export them to JSON. With paths, only
+    the commits changing any of them are kept. Return False if the fetch
+    failed
+    """
+    import gitlog
 
-    # create console handler with a higher log level
-    ch = logging.StreamHandler()
-    ch.setLevel(logging_mode)
+    outfile_name = output_name(repo, args.output_format)
+    outfile_path = "%s/%s" % (args.output_path, outfile_name)
+    repo_url = "%s/%s" % (args.git_url, repo)
 
-    # create formatter and add it to the handlers
-    formatter = logging.Formatter("[%(asctime)s - %(levelname)s] %(message)s")
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
+    gitpath = '%s/%s' % (os.path.abspath(args.perceval_path), repo)
+    if args.backend == 'git':
+        logger.info('Executing git log with repo: %s' % repo)
+    else:
+        from perceval.backends.core.git import Git
 
-    logger.addHandler(fh)
-    logger.addHandler(ch)
+        logger.info('Executing Perceval with repo: %s' % repo)
+    try:
+        with metrics.timer('perceval_fetch'):
+            if args.backend == 'git':
+                commits = list(gitlog.fetch(repo_url, gitpath,
+                                            'blob:none' if args.partial_clone else None, paths))
+            else:
+                commits = Git(uri=repo_url, gitpath=gitpath).fetch()
+                if paths:
+                    # Perceval reads the whole history, it is filtered afterwards
+                    commits = gitlog.filter_paths(commits, paths)
+                commits = list(commits)
+    except Exception as e:
+        logger.warning("Failure while fetching commits. Repo: %s" % repo)
+        logger.error(e)
+        if not args.cache_mode_on:
+            remove_dir(gitpath)
+        return False
+    if args.output_format == 'records':
+        logger.info('Exporting results to records...')
+        with metrics.timer('records_encode'):
+            with records.RecordWriter(outfile_path, 'commit') as rfile:
+                for commit in commits:
+                    rfile.write(commit['data']['commit'], commit['data']['Commit'],
+                                float(commit['updated_on']),
+                                [changed['file'] for changed in commit['data']['files']])
+    else:
+        logger.info('Exporting results to JSON...')
+        with open(outfile_path, "wb") as jfile:
+            with metrics.timer('json_encode'):
+                if args.projection:
+                    fields = projection_fields(args.projection)
+                    commits = [project(commit, fields) for commit in commits]
+                    jsoncodec.dump(commits, jfile, sort_keys=True)
+                else:
+                    jsoncodec.dump(commits, jfile, indent=4, sort_keys=True)
+    metrics.incr('repos')
+    metrics.incr('commits', len(commits))
+    metrics.incr('bytes_written', os.path.getsize(outfile_path))
+    logger.info('Exported to %s' % outfile_path)
+    if not args.cache_mode_on:
+        remove_dir(gitpath)
+    return True
 
-    keep_fds = [fh.stream.fileno()]
-    return keep_fds
+
+logger = logging.getLogger(__name__)
 
 
 def parse_args():
@@ -166,25 +374,61 @@ def parse_args():
     parser.add_argument('--github-token', dest='github_token', required=True,
                         help='GitHub token')
     parser.add_argument('--urls-file', dest='urls_file', required=True,
-                        help='Path to URLs file (output from hits2urls.py)')
+                        help='Path to URLs file (output from hits2urls.py, lines or records)')
     parser.add_argument('--output-path', dest='output_path', required=True,
                         help='Path where Perceval JSONs will be saved into')
     parser.add_argument('--perceval-path', dest='perceval_path', required=True,
                         help='Path where Perceval store its cache information')
-    parser.add_argument('--log-file', dest='log_file', default='perceval-handler.log',
-                        required=False, help='Path to log file')
+    parser.add_argument('--api-url', dest='api_url', default='https://api.github.com',
+                        help='Base URL of the GitHub API')
+    parser.add_argument('--git-url', dest='git_url', default='https://github.com',
+                        help='Base URL the repos are cloned from')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        help='Number of repos cloned and fetched concurrently')
+    parser.add_argument('--disk-budget', dest='disk_budget', type=int, default=0,
+                        help='Max. size (MB) of the clones in progress, 0 for no limit')
+    parser.add_argument('--backend', dest='backend', default='perceval',
+                        choices=['perceval', 'git'],
+                        help='Perceval Git backend or the native git log one (gitlog.py)')
+    parser.add_argument('--partial-clone', dest='partial_clone', action='store_true',
+                        default=False, help='Clone without file contents (blob:none), '
+                                            'only with --backend git')
+    parser.add_argument('--only-hits', dest='only_hits', action='store_true',
+                        default=False, help='Only keep the commits changing the files of the URLs '
+                                            'file (the git backend only reads those)')
+    parser.add_argument('--projection', dest='projection', required=False,
+                        help='Only keep the fields a consumer reads: its name (%s) or a comma '
+                             'separated list of dotted fields (e.g. data.commit,updated_on)'
+                             % ', '.join(sorted(PROJECTIONS)))
+    parser.add_argument('--output-format', dest='output_format', default='json',
+                        choices=['json', 'records'],
+                        help='Commits as Perceval JSON items or as typed records (records.py) '
+                             'with the fields projects2sql.py reads')
+    workqueue.add_arguments(parser)
     parser.add_argument('-c', '--keep-cache', dest='cache_mode_on', action='store_true',
                         default=False, help='Keep Perceval cache')
-    parser.add_argument('-g', '--debug', dest='debug_mode_on', action='store_true',
-                        default=False, help='Enables debug mode')
-    return parser.parse_args()
+    common.add_logging_arguments(parser, 'perceval-handler.log')
+    jsoncodec.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    if args.partial_clone and args.backend != 'git':
+        parser.error("--partial-clone needs --backend git: Perceval reads every blob")
+    if args.projection and args.output_format == 'records':
+        parser.error("--projection only applies to JSON output: records only hold "
+                     "the fields projects2sql reads")
+    if args.queue_file and args.disk_budget:
+        parser.error("--disk-budget only applies to the clones of a process, not with --queue-file")
+    if args.queue_file:
+        # main() changes into the output path
+        args.queue_file = os.path.abspath(args.queue_file)
+    return args
 
 
 if __name__ == '__main__':
     try:
         args = parse_args()
-        keep_fds = configure_logging(args.log_file, args.debug_mode_on)
-        main(args)
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        metrics.run(main, args)
     except Exception as e:
         logger.exception("Exception message:")
         s = "Error: %s perceval-handler is exiting now." % str(e)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import common
+
+DESC_MSG = 'Times the scripts of the pipeline over the data produced by synthetic-data.py'
+
+SCRIPTS_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+def stages(data_path, work_path, heuristics_file):
+    """
+    Return the (name, command, input files, stats key) of every
+    benchmarked stage. All of them read the synthetic data, so each
+    stage can be timed on its own
+    """
+    def data(name):
+        return os.path.join(data_path, name)
+
+    def work(name):
+        return os.path.join(work_path, name)
+
+    return [
+        ('get-project-list',
+         ['get-project-list.py', '--input-file', work('projects.csv'),
+          '--output-file', work('projects_filtered.csv')],
+         [data('projects.csv')], 'projects'),
+        ('github-tree',
+         ['github-tree.py', '--heuristics-file', heuristics_file, '--trees-path', data('trees'),
+          '--output-file', work('hits.txt')],
+         [data('trees')], 'tree_entries'),
+        ('hits2urls',
+         ['hits2urls.py', '--json-path', data_path, '--projects-file', work('projects_filtered.csv'),
+          '--hits-file', data('hits.txt'), '--output-file', work('urls.txt')],
+         [data('hits.txt')], 'hits'),
+        ('projects2sql',
+         ['projects2sql.py', '--db-name', 'benchmark', '--json-path', data('perceval'),
+          '--urls-file', data('urls.txt'), '--output-path', work_path],
+         [data('perceval')], 'commits'),
+        ('ghtorrent-users2sql',
+         ['ghtorrent-users2sql.py', '--input-file', data('users.csv'), '--db-name', 'benchmark',
+          '--output-path', work_path],
+         [data('users.csv')], 'users'),
+    ]
+
+
+def main(args):
+    data_path = os.path.abspath(args.data_path)
+    work_path = os.path.abspath(args.work_path)
+    if not os.path.exists(work_path):
+        os.makedirs(work_path)
+
+    with open(os.path.join(data_path, 'stats.json'), 'r') as sfile:
+        stats = json.load(sfile)
+
+    # get-project-list writes its formatted file next to the input one
+    with open(os.path.join(data_path, 'projects.csv'), 'rb') as ifile, \
+            open(os.path.join(work_path, 'projects.csv'), 'wb') as ofile:
+        ofile.write(ifile.read())
+
+    results = {}
+    for name, command, inputs, stats_key in stages(data_path, work_path, args.heuristics_file):
+        if args.stages and name not in args.stages:
+            continue
+        input_bytes = sum(path_size(path) for path in inputs)
+        command = [sys.executable, os.path.join(SCRIPTS_PATH, command[0])] + command[1:] + \
+            ['--log-file', os.path.join(work_path, name + '.log')]
+        best = None
+        for _ in range(args.repeat):
+            elapsed, max_rss, status = run(command, work_path)
+            if status:
+                logger.error("Stage %s failed (exit status %s), see %s.log" % (name, status, name))
+                break
+            if best is None or elapsed < best[0]:
+                best = (elapsed, max_rss)
+        if best is None:
+            continue
+        elapsed, max_rss = best
+        results[name] = {
+            'seconds': round(elapsed, 4),
+            'peak_rss_mb': round(max_rss / 1024, 1),
+            'input_mb': round(input_bytes / 2 ** 20, 2),
+            'mb_per_second': round(input_bytes / 2 ** 20 / elapsed, 2) if elapsed else 0,
+            'items': stats[stats_key],
+            'items_per_second': round(stats[stats_key] / elapsed, 1) if elapsed else 0,
+        }
+        logger.info("%-20s %8.3f s %8.1f MB RSS %10.2f MB/s %12.1f %s/s" %
+                    (name, elapsed, max_rss / 1024, results[name]['mb_per_second'],
+                     results[name]['items_per_second'], stats_key))
+
+    if args.output_file:
+        with open(args.output_file, 'w') as ofile:
+            json.dump(results, ofile, indent=4, sort_keys=True)
+
+    if args.baseline_file and check_regressions(results, args.baseline_file, args.threshold):
+        raise SystemExit(2)
+
+
+def path_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def run(command, cwd):
+    """
+    Run a command, returning its wall-clock time, its peak resident
+    memory (KB) and its exit status
+    """
+    logger.debug("Running: %s" % ' '.join(command))
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    return elapsed, rusage.ru_maxrss, process.returncode
+
+
+def check_regressions(results, baseline_file, threshold):
+    """
+    Compare the results with a previous run. Return True if any stage is
+    slower or needs more memory than the baseline times the threshold
+    """
+    with open(baseline_file, 'r') as bfile:
+        baseline = json.load(bfile)
+    regression = False
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        for key in ['seconds', 'peak_rss_mb']:
+            if result[key] > baseline[name][key] * threshold:
+                logger.warning("Regression in %s: %s %s (baseline %s)" %
+                               (name, key, result[key], baseline[name][key]))
+                regression = True
+    return regression
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """Parse arguments from the command line"""
+
+    parser = argparse.ArgumentParser(description=DESC_MSG)
+
+    parser.add_argument('--data-path', dest='data_path', required=True,
+                        help='Path to the data generated with synthetic-data.py')
+    parser.add_argument('--work-path', dest='work_path', default='benchmark',
+                        required=False, help='Path where the outputs of the stages are stored')
+    parser.add_argument('--heuristics-file', dest='heuristics_file',
+                        default=os.path.join(SCRIPTS_PATH, 'config', 'github-tree.yml'),
+                        required=False, help='Heuristics file for github-tree')
+    parser.add_argument('--stages', dest='stages', nargs='+', required=False,
+                        help='Stages to benchmark (all of them by default)')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=1,
+                        help='Number of runs of each stage (best time is kept)')
+    parser.add_argument('--output-file', dest='output_file', required=False,
+                        help='Path to store the results (JSON)')
+    parser.add_argument('--baseline-file', dest='baseline_file', required=False,
+                        help='Results of a previous run to check for regressions')
+    parser.add_argument('--threshold', dest='threshold', type=float, default=1.2,
+                        help='Max. ratio against the baseline before reporting a regression')
+    common.add_logging_arguments(parser, 'pipeline-benchmark.log')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    try:
+        args = parse_args()
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        main(args)
+    except Exception as e:
+        logger.exception("Exception message:")
+        s = "Error: %s pipeline-benchmark is exiting now." % str(e)
+        logger.error(s)
+        sys.exit(1)
@@ -23,8 +23,9 @@
 #
 
 import argparse
+import array
 import csv
-import json
+import itertools
 import logging
 import os
 import sys
@@ -32,11 +33,17 @@ import time
 
 from collections import OrderedDict
 
+import common
+import jsoncodec
+import metrics
+import records
+import sqlwriter
+
 DESC_MSG = 'Generate SQL files extrating data from Perceval JSON files'
 
 
 def main(args):
-    db_name = args.db_name
+    jsoncodec.use(args.json_codec)
     abs_path = os.path.abspath(args.json_path)
     input_file = os.path.abspath(args.input_file)
 
@@ -49,46 +56,46 @@ def main(args):
     writer_miss = csv.writer(missing)
     writer_miss.writerow(("Project", "Issue", "Num_pos_files"))
 
-    # Open SQL output files, one file per table to gain efficiency
-
-    output_repos = open(out_path + "/repos.sql", "w")
-    output_commits = open(out_path + "/commits.sql", "w")
-    output_people = open(out_path + "/people.sql", "w")
-    output_intfiles = open(out_path + "/interestingfiles.sql", "w")
-
-    output_repos.write("USE %s;\n" % db_name)
-    output_commits.write("USE %s;\n" % db_name)
-    output_people.write("USE %s;\n" % db_name)
-    output_intfiles.write("USE %s;\n" % db_name)
+    # SQL output files, one file (or set of rotated files) per table
 
     repo_fields = 'id, name, founder, url, number_commits, first_commit, last_commit'
     commits_fields = 'id, gh_id, people_id, commit_date, cochanged, repos_id'
     people_fields = 'id, name, email'
     intfiles_fields = 'id, name, url, commits_id, repo_id'
-
-    output_repos.write("INSERT INTO repos (%s) VALUES\n" % repo_fields)
-    output_commits.write("INSERT INTO commits (%s) VALUES\n" % commits_fields)
-    output_people.write("INSERT INTO people (%s) VALUES\n" % people_fields)
-    output_intfiles.write("INSERT INTO interestingfiles (%s) VALUES\n" % intfiles_fields)
-
-    first_repos = True
-    first_commits = True
-    first_people = True
-    first_interestingfiles = True
+    cochanges_fields = 'repo_id, file_a, file_b, cochanges'
+
+    output_repos = sqlwriter.SQLWriter.from_args(args, out_path, 'repos', repo_fields)
+    output_commits = sqlwriter.SQLWriter.from_args(args, out_path, 'commits', commits_fields)
+    output_people = sqlwriter.SQLWriter.from_args(args, out_path, 'people', people_fields)
+    output_intfiles = sqlwriter.SQLWriter.from_args(args, out_path, 'interestingfiles', intfiles_fields)
+    writers = [output_repos, output_commits, output_people, output_intfiles]
+    if args.cochange:
+        output_cochanges = sqlwriter.SQLWriter.from_args(args, out_path, 'cochanges', cochanges_fields)
+        writers.append(output_cochanges)
+
+    store = None
+    if args.store_file:
+        import commitstore
+        store = commitstore.CommitStoreWriter(args.store_file)
 
     # Open input file, load projects and the positive file into a dictionary
-    with open(input_file, 'r') as urlsfile:
-        for line in urlsfile:
-            if line != "":
-                url_split = line.split(common_url)
-                file_url = url_split[1][:-1]  # Remove "\r\n"
-                project = "/".join(file_url.split("/")[0:2])
-                if project in dicc_positives:
-                    list_tmp = dicc_positives[project]
-                    list_tmp.append(file_url)
-                    dicc_positives[project] = list_tmp
-                else:
-                    dicc_positives[project] = [file_url]
+    if records.is_records(input_file):
+        for url in records.read_records(input_file, 'url'):
+            file_url = "/".join((url.owner, url.repo, url.branch, url.path))
+            dicc_positives.setdefault(url.owner + "/" + url.repo, []).append(file_url)
+    else:
+        with open(input_file, 'r') as urlsfile:
+            for line in urlsfile:
+                if line != "":
+                    url_split = line.split(common_url)
+                    file_url = url_split[1][:-1]  # Remove "\r\n"
+                    project = "/".join(file_url.split("/")[0:2])
+                    if project in dicc_positives:
+                        list_tmp = dicc_positives[project]
+                        list_tmp.append(file_url)
+                        dicc_positives[project] = list_tmp
+                    else:
+                        dicc_positives[project] = [file_url]
     p_id = 0
     auth_id = 0
     commits_num = 0
@@ -106,6 +113,10 @@ def main(args):
         gh_pname = project.split("/")[1]
         json_name = gh_user + "_" + gh_pname + ".json"
         file_path = abs_path + "/" + json_name
+        # Commits written by perceval-handler.py --output-format records
+        records_path = abs_path + "/" + gh_user + "_" + gh_pname + ".rec"
+        if os.path.exists(records_path):
+            file_path = records_path
         commit_amount = 0
         dicc_commit_num = {}
         if not os.path.exists(file_path):
@@ -117,8 +128,20 @@ def main(args):
             writer_miss.writerow((project, issue, len(dicc_positives[project])))
         else:
             logger.debug("Checking %s" % file_path)
-            with open(file_path, 'r') as jfile:
-                jdata = json.load(jfile)
+            if file_path == records_path:
+                with metrics.timer('records_decode'):
+                    commit_records = list(records.read_records(file_path, 'commit'))
+                # Items with the fields read below, as Perceval's
+                jdata = [{'data': {'commit': commit.commit, 'Commit': commit.committer},
+                          'updated_on': commit.updated_on} for commit in commit_records]
+            else:
+                with open(file_path, 'rb') as jfile:
+                    jdata_bytes = jfile.read()
+                with metrics.timer('json_decode'):
+                    jdata = jsoncodec.loads(jdata_bytes)
+            metrics.incr('projects')
+            metrics.incr('commits', len(jdata))
+            metrics.incr('bytes_read', os.path.getsize(file_path))
 
             p_id += 1
 
@@ -159,20 +182,18 @@ def main(args):
                     auth_id += 1
                     my_authid = auth_id
                     dicc_authors[author] = [my_authid]
-                    query = '(' + str(auth_id) + ', "'
-                    query += person.replace("'", "\\'") + '", "' + email.replace("'", "\\'") + '")'
-                    if first_people:
-                        output_people.write(query)
-                        first_people = False
-                    else:
+                    if store:
+                        store.add_author(my_authid, email)
+                    query = str(auth_id) + ', "'
+                    query += person.replace("'", "\\'") + '", "' + email.replace("'", "\\'") + '"'
+                    if output_people.count:
                         try:
-                            line = ',\n' + query
-                            line = line.encode('utf-8', 'surrogateescape').decode('ISO-8859-1')
-                            output_people.write(line)
+                            query = query.encode('utf-8', 'surrogateescape').decode('ISO-8859-1')
                         except UnicodeEncodeError as e:
                             logger.debug(file_path)
                             logger.error("%s. Query: %s. Continue..." % (e, query))
                             continue
+                    output_people.write(query)
 
                 list_authors.append(my_authid)
 
@@ -180,132 +201,125 @@ def main(args):
                 commit_date = element['updated_on']
                 list_dates.append(float(commit_date))
 
-            jfile = open(file_path, 'r')
-            jdata_str = jfile.read()
-            jfile.close()
-            # jjson contains a list with the commits!
-            jjson = json.loads(json.dumps(jdata_str.split('{')))
-
-            json_str = '{'.join(list(jjson))
-            tmp_files = json_str.split('"files":')[1:]
+            if file_path == records_path:
+                commit_files = [commit.files for commit in commit_records]
+            else:
+                commit_files = [[changed['file'] for changed in element['data']['files']]
+                                for element in jdata]
 
             # For each commit
 
-            for element_comm in tmp_files:
-                num_list = tmp_files.index(element_comm)
+            matrix = CochangeMatrix()
+            sql_start = time.perf_counter()
+            for num_list, changed_files in enumerate(commit_files):
                 comm_id = dicc_commit_num[num_list]
                 commits_num += 1
                 author_id = list_authors[num_list]
                 date = list_dates[num_list]
-                changed_files = element_comm.split('"file": ')
-                changed_files = changed_files[1:]
+                commit_intfiles = []
 
                 # Files changed in the commmit
-                for ch_file in changed_files:
-                    file_name = ch_file.split(',')[0][1:-1]
+                for file_name in changed_files:
                     for pos_file in dicc_positives[project]:
                         pos_file_name = pos_file.split('/')[3:]
                         pos_file_name = "/".join(pos_file_name)
                         if file_name == pos_file_name:
                             file_url = common_url + pos_file
                             file_id += 1
+                            commit_intfiles.append(file_name)
 
                             # File id, File name, File url, commit id, project id
-                            query = '(' + str(file_id) + ', "'
+                            query = str(file_id) + ', "'
                             query += file_name.replace("'", "\\'") + '","' + file_url.replace("'", "\\'")
-                            query += '", ' + str(commits_num) + ', ' + str(p_id) + ')'
-                            if first_interestingfiles:
-                                output_intfiles.write(query)
-                                first_interestingfiles = False
-                            else:
-                                output_intfiles.write(',\n' + query)
+                            query += '", ' + str(commits_num) + ', ' + str(p_id)
+                            output_intfiles.write(query)
+
+                if args.cochange and len(commit_intfiles) > 1:
+                    matrix.add_commit(commit_intfiles)
 
                 # See if it is the first commit
                 if not first_date:
                     first_date = date
 
                 # id, commit gh-id, author id, datetime, cochanged files, project id
-                query = '(' + str(commits_num) + ', "' + comm_id + '", '
+                query = str(commits_num) + ', "' + comm_id + '", '
                 query += str(author_id) + ', "' + beauty_date(date) + '", '
-                query += str(len(changed_files)) + ', ' + str(p_id) + ')'
-                if first_commits:
-                    output_commits.write(query)
-                    first_commits = False
-                else:   # To avoid having too many commits in one query, split it!
-                    if not commits_num % 100000:
-                        output_commits.write(";\n\nINSERT INTO commits (%s) VALUES\n" % commits_fields)
-                        output_commits.write(query)
-                    else:
-                        output_commits.write(',\n' + query)
+                query += str(len(changed_files)) + ', ' + str(p_id)
+                if store:
+                    store.add_commit(p_id, author_id, date, len(changed_files))
+                output_commits.write(query)
 
             # Write Project/repo data
             p_url = "https://www.github.com/" + gh_user + "/" + gh_pname
 
             # Repo_id, repo_name, repo_founder, repo_url, number_commits, first_commit, last_commit
-            query = '(' + str(p_id) + ', "' + gh_pname.replace("'", "\\'") + '", "' + gh_user.replace("'", "\\'") + '", "' + p_url.replace("'", "\\'") + '", '
-            query += str(len(tmp_files)) + ', "' + beauty_date(first_date) + '", "' + beauty_date(date) + '")'
+            query = str(p_id) + ', "' + gh_pname.replace("'", "\\'") + '", "' + gh_user.replace("'", "\\'") + '", "' + p_url.replace("'", "\\'") + '", '
+            query += str(len(commit_files)) + ', "' + beauty_date(first_date) + '", "' + beauty_date(date) + '"'
             first_date = ""
-            if first_repos:
-                output_repos.write(query)
-                first_repos = False
-            else:
-                output_repos.write(',\n' + query)
+            if store:
+                store.add_repo(p_id, project)
+            output_repos.write(query)
 
+            # Repo_id, file a, file b, number of commits changing both
+            for file_a, file_b, count in matrix.counts():
+                query = str(p_id) + ', "' + file_a.replace("'", "\\'") + '", "'
+                query += file_b.replace("'", "\\'") + '", ' + str(count)
+                output_cochanges.write(query)
+
+            metrics.add_time('sql_emission', time.perf_counter() - sql_start)
             logger.info("Project %s: correct." % project)
 
     missing.close()
-    output_repos.write(';')
-    output_repos.close()
-    output_commits.write(';')
-    output_commits.close()
-    output_people.write(';')
-    output_people.close()
-    output_intfiles.write(';')
-    output_intfiles.close()
-
-
-def beauty_date(epoch_time):
-    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(epoch_time))
-
-
-logger = logging.getLogger(__name__)
-
-
-def configure_logging(log_file, debug_mode_on=False):
-    """Set up the logging and returns a list with the file descriptors
-
-    :param log_file: Path for the log file
-    :param debug_mode_on: If True, the level of the logger will be DEBUG
-
-    :return: List with logging file descriptors
+    for writer in writers:
+        writer.close()
+        metrics.incr('bytes_written', writer.bytes_written)
+    sqlwriter.write_manifest(out_path, writers)
+    if args.cochange:
+        metrics.incr('cochanges', output_cochanges.count)
+    if store:
+        with metrics.timer('store_save'):
+            store.save()
+        logger.info("Commit store saved into %s" % args.store_file)
+
+
+class CochangeMatrix:
+    """
+    Sparse file x file matrix with the number of commits of a repo
+    changing each pair of interesting files. Pairs are appended as
+    coordinates and aggregated once the repo is finished
     """
 
-    if debug_mode_on:
-        logging_mode = logging.DEBUG
-    else:
-        logging_mode = logging.INFO
+    def __init__(self):
+        self.files = {}
+        self.rows = array.array('q')
+        self.cols = array.array('q')
 
-    logger = logging.getLogger()
-    logger.setLevel(logging_mode)
+    def add_commit(self, file_names):
+        ids = sorted(set(self.files.setdefault(name, len(self.files)) for name in file_names))
+        for file_a, file_b in itertools.combinations(ids, 2):
+            self.rows.append(file_a)
+            self.cols.append(file_b)
 
-    # redirect logging to our log file
-    fh = logging.FileHandler(log_file, 'a')
-    fh.setLevel(logging_mode)
+    def counts(self):
+        """Yield (file a, file b, count) for every pair changed together"""
+        if not self.rows:
+            return
+        import numpy as np
 
-    # create console handler with a higher log level
-    ch = logging.StreamHandler()
-    ch.setLevel(logging_mode)
+        num_files = len(self.files)
+        keys = np.frombuffer(self.rows, dtype=np.int64) * num_files + \
+            np.frombuffer(self.cols, dtype=np.int64)
+        keys, counts = np.unique(keys, return_counts=True)
+        names = sorted(self.files, key=self.files.get)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            yield names[key // num_files], names[key % num_files], count
 
-    # create formatter and add it to the handlers
-    formatter = logging.Formatter("[%(asctime)s - %(levelname)s] %(message)s")
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
 
-    logger.addHandler(fh)
-    logger.addHandler(ch)
+def beauty_date(epoch_time):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(epoch_time))
 
-    keep_fds = [fh.stream.fileno()]
-    return keep_fds
+
+logger = logging.getLogger(__name__)
 
 
 def parse_args():
@@ -318,23 +332,27 @@ def parse_args():
     parser.add_argument('--json-path', dest='json_path', required=True,
                         help='Path where Perceval JSONs are stored into')
     parser.add_argument('--urls-file', dest='input_file', required=True,
-                        help='Path to input URLs file produced with hits2urls script')
+                        help='Path to input URLs file produced with hits2urls script (lines or records)')
     parser.add_argument('--output-path', dest='output_path', required=False,
                         default=os.curdir, help='Path where SQL files are stored into')
-    parser.add_argument('--log-file', dest='log_file', default='projects2sql.log',
-                        required=False, help='Path to log file')
     parser.add_argument('--avoid-fw', dest='avoid_fw', action='store_true',
                         default=False, help='Avoid `Framework`-type projects')
-    parser.add_argument('-g', '--debug', dest='debug_mode_on', action='store_true',
-                        default=False, help='Enables debug mode')
+    parser.add_argument('--cochange', dest='cochange', action='store_true',
+                        default=False, help='Write co-change counts of interesting files (cochanges.sql)')
+    parser.add_argument('--commits-store', dest='store_file', required=False,
+                        help='Also write the commits as columns into this .npz file (see commits-query.py)')
+    sqlwriter.add_arguments(parser)
+    common.add_logging_arguments(parser, 'projects2sql.log')
+    jsoncodec.add_arguments(parser)
+    metrics.add_arguments(parser)
     return parser.parse_args()
 
 
 if __name__ == '__main__':
     try:
         args = parse_args()
-        keep_fds = configure_logging(args.log_file, args.debug_mode_on)
-        main(args)
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        metrics.run(main, args)
     except Exception as e:
         logger.exception("Exception message:")
         s = "Error: %s projects2sql is exiting now." % str(e)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+
+"""
+Typed binary records passed between the stages of the pipeline.
+
+A records file starts with a magic string and its schema (name and typed
+fields, as JSON) and then holds length-prefixed records, so it can be
+written and read as a stream. Fields are encoded in schema order:
+strings as their UTF-8 length and bytes, integers as int64, floats as
+doubles, booleans as a byte and string lists as their length and
+strings. Readers get named tuples and never split text.
+"""
+
+import json
+import struct
+
+from collections import namedtuple
+
+MAGIC = b'GHREC\x00\x01\n'
+
+SCHEMAS = {
+    # github-tree.py: a file flagged by the heuristics
+    'hit': [('path', 'str'), ('url', 'str'), ('owner', 'str'), ('repo', 'str'),
+            ('owner_id', 'str'), ('repo_id', 'str'), ('sha', 'str'), ('duplicate', 'bool')],
+    # hits2urls.py: raw URL of a hit
+    'url': [('url', 'str'), ('owner', 'str'), ('repo', 'str'), ('branch', 'str'),
+            ('path', 'str')],
+    # perceval-handler.py: a commit of a repo, with the fields projects2sql.py reads
+    'commit': [('commit', 'str'), ('committer', 'str'), ('updated_on', 'float'),
+               ('files', 'str_list')],
+}
+
+RECORDS = {name: namedtuple(name.capitalize(), [field for field, _ in fields])
+           for name, fields in SCHEMAS.items()}
+
+Hit = RECORDS['hit']
+Url = RECORDS['url']
+Commit = RECORDS['commit']
+
+LENGTH = struct.Struct('<I')
+INT = struct.Struct('<q')
+FLOAT = struct.Struct('<d')
+
+# Strings can hold lone surrogates (paths and names that are not UTF-8)
+ENCODING = 'utf-8'
+ERRORS = 'surrogatepass'
+
+
+def _encode_str(value, parts):
+    data = value.encode(ENCODING, ERRORS)
+    parts.append(LENGTH.pack(len(data)))
+    parts.append(data)
+
+
+def _encode_str_list(values, parts):
+    parts.append(LENGTH.pack(len(values)))
+    for value in values:
+        _encode_str(value, parts)
+
+
+ENCODERS = {
+    'str': _encode_str,
+    'int': lambda value, parts: parts.append(INT.pack(value)),
+    'float': lambda value, parts: parts.append(FLOAT.pack(value)),
+    'bool': lambda value, parts: parts.append(b'\x01' if value else b'\x00'),
+    'str_list': _encode_str_list,
+}
+
+
+def _decode_str(data, pos):
+    size, = LENGTH.unpack_from(data, pos)
+    pos += LENGTH.size
+    return str(data[pos:pos + size], ENCODING, ERRORS), pos + size
+
+
+def _decode_str_list(data, pos):
+    count, = LENGTH.unpack_from(data, pos)
+    pos += LENGTH.size
+    values = []
+    for _ in range(count):
+        value, pos = _decode_str(data, pos)
+        values.append(value)
+    return values, pos
+
+
+DECODERS = {
+    'str': _decode_str,
+    'int': lambda data, pos: (INT.unpack_from(data, pos)[0], pos + INT.size),
+    'float': lambda data, pos: (FLOAT.unpack_from(data, pos)[0], pos + FLOAT.size),
+    'bool': lambda data, pos: (data[pos] != 0, pos + 1),
+    'str_list': _decode_str_list,
+}
+
+
+def is_records(path):
+    """True if the file is a records file (and not a text one)"""
+    with open(path, 'rb') as rfile:
+        return rfile.read(len(MAGIC)) == MAGIC
+
+
+class RecordWriter:
+    """Write records of a schema into a file, as a stream"""
+
+    def __init__(self, path, schema):
+        self.schema = schema
+        self.record = RECORDS[schema]
+        self.encoders = [ENCODERS[ftype] for _, ftype in SCHEMAS[schema]]
+        self.count = 0
+        self.file = open(path, 'wb')
+        header = json.dumps({'schema': schema, 'fields': SCHEMAS[schema]}).encode('utf-8')
+        self.file.write(MAGIC + LENGTH.pack(len(header)) + header)
+
+    def write(self, *values, **fields):
+        """Write a record, given as its values in schema order or as keywords"""
+        record = self.record(*values, **fields)
+        parts = []
+        for encoder, value in zip(self.encoders, record):
+            encoder(value, parts)
+        payload = b''.join(parts)
+        self.file.write(LENGTH.pack(len(payload)))
+        self.file.write(payload)
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def read_records(path, schema=None):
+    """
+    Yield the records of a file as named tuples. With schema, the file
+    must hold records of that schema. Files are decoded with their own
+    fields, so older files keep being readable
+    """
+    with open(path, 'rb') as rfile:
+        if rfile.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a records file" % path)
+        size, = LENGTH.unpack(rfile.read(LENGTH.size))
+        header = json.loads(rfile.read(size).decode('utf-8'))
+        if schema is not None and header['schema'] != schema:
+            raise ValueError("%s holds %s records, not %s" % (path, header['schema'], schema))
+        fields = [tuple(field) for field in header['fields']]
+        if fields == SCHEMAS.get(header['schema']):
+            record = RECORDS[header['schema']]
+        else:
+            record = namedtuple(header['schema'].capitalize(), [field for field, _ in fields])
+        decoders = [DECODERS[ftype] for _, ftype in fields]
+
+        while True:
+            prefix = rfile.read(LENGTH.size)
+            if not prefix:
+                break
+            if len(prefix) < LENGTH.size:
+                raise ValueError("Truncated record in %s" % path)
+            size, = LENGTH.unpack(prefix)
+            data = rfile.read(size)
+            if len(data) < size:
+                raise ValueError("Truncated record in %s" % path)
+            values = []
+            pos = 0
+            for decoder in decoders:
+                value, pos = decoder(data, pos)
+                values.append(value)
+            yield record(*values)
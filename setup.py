@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+
+import glob
+import os
+
+from setuptools import setup
+
+here = os.path.abspath(os.path.dirname(__file__))
+
+with open(os.path.join(here, 'requirements.txt')) as rfile:
+    requirements = [line.strip() for line in rfile if line.strip()]
+
+# Scripts have dashes in their names, so they are installed as data and
+# run by the ghtools entry point
+scripts = [os.path.basename(path) for path in glob.glob(os.path.join(here, '*-*.py'))] + \
+    ['hits2urls.py', 'projects2sql.py']
+
+setup(name='ghtools',
+      version='0.1.0',
+      description='Tool for massively extract and analyze GitHub artifacts',
+      license='GPLv3',
+      py_modules=['ghtools', 'common', 'metrics', 'commitstore', 'gitlog', 'sqlwriter', 'pathindex', 'workqueue', 'records', 'jsoncodec'],
+      data_files=[('share/ghtools', sorted(scripts)),
+                  ('share/ghtools/config', ['config/github-tree.yml'])],
+      install_requires=requirements,
+      entry_points={'console_scripts': ['ghtools=ghtools:main']})
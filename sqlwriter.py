@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+
+"""
+Writer of the SQL files of projects2sql.py and ghtorrent-users2sql.py.
+
+Rows are written as multi-row INSERT statements, closed before they get
+bigger than a number of bytes (MySQL rejects statements bigger than its
+max_allowed_packet) or rows. The output can be rotated into numbered
+files and gzip-compressed, and the files are listed in a manifest so
+they can be loaded in parallel by several mysql clients.
+"""
+
+import gzip
+import json
+import os
+
+# Default max. size of a statement, below the 4 MB max_allowed_packet
+# of MySQL 5.6
+MAX_STATEMENT_KB = 4000
+
+# Max. rows of a statement
+MAX_ROWS = 100000
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def add_arguments(parser):
+    """Add the SQL output options to the parser of a script"""
+
+    parser.add_argument('--max-statement-size', dest='max_statement_size', type=int,
+                        default=MAX_STATEMENT_KB,
+                        help='Max. size (KB) of an INSERT statement (see max_allowed_packet)')
+    parser.add_argument('--max-file-size', dest='max_file_size', type=int, default=0,
+                        help='Rotate the SQL files into numbered files of this size (MB), '
+                             '0 for a single file per table')
+    parser.add_argument('--compress', dest='compress', action='store_true', default=False,
+                        help='Write gzip-compressed SQL files')
+
+
+def byte_size(text):
+    return len(text) if text.isascii() else len(text.encode('utf-8', 'surrogateescape'))
+
+
+class SQLWriter:
+    """
+    Write the rows of a table into <name>.sql or, when rotated, into
+    <name>.0001.sql, <name>.0002.sql... (.gz when compressed). Every file
+    starts with "USE <db_name>;" and only holds complete statements. The
+    suffix (if any) closes every INSERT statement
+    """
+
+    def __init__(self, out_path, db_name, table, fields, suffix='', name=None,
+                 max_statement_bytes=MAX_STATEMENT_KB * 1024, max_rows=MAX_ROWS,
+                 max_file_bytes=0, compress=False):
+        self.out_path = out_path
+        self.db_name = db_name
+        self.table = table
+        self.name = name or table
+        self.query = 'INSERT INTO %s (%s) VALUES\n' % (table, fields)
+        self.suffix = suffix
+        self.max_statement_bytes = max_statement_bytes
+        self.max_rows = max_rows
+        self.max_file_bytes = max_file_bytes
+        self.compress = compress
+        self.output = None
+        self.files = []
+        self.count = 0
+        self.file_bytes = 0
+        self.statement_rows = 0
+        self.statement_bytes = 0
+
+    @classmethod
+    def from_args(cls, args, out_path, table, fields, suffix='', name=None):
+        """Writer with the options of add_arguments()"""
+        return cls(out_path, args.db_name, table, fields, suffix, name,
+                   max_statement_bytes=args.max_statement_size * 1024,
+                   max_file_bytes=args.max_file_size * 1024 * 1024, compress=args.compress)
+
+    def file_name(self, num):
+        if self.max_file_bytes:
+            name = '%s.%04d.sql' % (self.name, num)
+        else:
+            name = '%s.sql' % self.name
+        return name + '.gz' if self.compress else name
+
+    def next_file(self):
+        if self.output:
+            self.output.close()
+        name = self.file_name(len(self.files) + 1)
+        path = os.path.join(self.out_path, name)
+        if self.compress:
+            self.output = gzip.open(path, 'wt', compresslevel=6, encoding='utf-8',
+                                    errors='surrogateescape')
+        else:
+            self.output = open(path, 'w', encoding='utf-8', errors='surrogateescape')
+        self.output.write('USE %s;\n' % self.db_name)
+        self.files.append({'file': name, 'name': self.name, 'table': self.table,
+                           'rows': 0, 'statements': 0})
+        self.file_bytes = 0
+
+    def start_statement(self):
+        if not self.output or (self.max_file_bytes and self.file_bytes >= self.max_file_bytes):
+            self.next_file()
+
+    def write(self, values):
+        """Write the row with the given SQL values"""
+        row = '(%s)' % values
+        size = byte_size(row) + 2
+        if self.statement_rows and (self.statement_rows >= self.max_rows or
+                                    self.statement_bytes + size > self.max_statement_bytes):
+            self.end_statement()
+        if not self.statement_rows:
+            self.start_statement()
+            self.output.write(self.query + row)
+            self.statement_bytes = len(self.query) + len(self.suffix) + 2
+        else:
+            self.output.write(',\n' + row)
+        self.statement_rows += 1
+        self.statement_bytes += size
+        self.files[-1]['rows'] += 1
+        self.count += 1
+
+    def end_statement(self):
+        if self.statement_rows:
+            self.output.write(self.suffix + ';\n')
+            self.files[-1]['statements'] += 1
+            self.file_bytes += self.statement_bytes
+            self.statement_rows = 0
+
+    def statement(self, sql):
+        """Write a statement of its own (e.g. a DELETE)"""
+        self.end_statement()
+        self.start_statement()
+        self.output.write(sql + ';\n')
+        self.files[-1]['statements'] += 1
+        self.file_bytes += byte_size(sql) + 2
+
+    def close(self):
+        """Close the last file. Return the manifest entries of the files"""
+        self.end_statement()
+        if not self.output:
+            self.next_file()
+        self.output.close()
+        for entry in self.files:
+            entry['bytes'] = os.path.getsize(os.path.join(self.out_path, entry['file']))
+        return self.files
+
+    @property
+    def bytes_written(self):
+        return sum(entry.get('bytes', 0) for entry in self.files)
+
+
+def write_manifest(out_path, writers):
+    """
+    Add the files of the writers to the manifest of out_path, replacing
+    the ones of previous runs with the same names
+    """
+    manifest_file = os.path.join(out_path, MANIFEST_FILE)
+    files = []
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r') as mfile:
+            files = json.load(mfile)['files']
+    names = set(writer.name for writer in writers)
+    files = [entry for entry in files if entry_name(entry) not in names]
+    for writer in writers:
+        files.extend(writer.files)
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w') as mfile:
+        json.dump({'files': files}, mfile, indent=4, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
+
+def entry_name(entry):
+    """Name of the writer of a manifest entry (older manifests lack it)"""
+    return entry.get('name', entry['file'].split('.')[0])
+
+
+def read_manifest(out_path):
+    """Entries of the files of the manifest of out_path, None if there is none"""
+    manifest_file = os.path.join(out_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, 'r') as mfile:
+        return json.load(mfile)['files']
+
+
+def sql_files(path, name):
+    """
+    Paths of the files written with the given name, from an output path
+    or its manifest. A single SQL file is returned as is, unless the
+    manifest next to it lists more files with its name
+    """
+    if os.path.isdir(path) or os.path.basename(path) == MANIFEST_FILE:
+        out_path = path if os.path.isdir(path) else os.path.dirname(path)
+        manifest = read_manifest(out_path)
+        if manifest is None:
+            raise ValueError("No %s found in %s" % (MANIFEST_FILE, out_path))
+        files = [os.path.join(out_path, entry['file']) for entry in manifest
+                 if entry_name(entry) == name]
+        if not files:
+            raise ValueError("No %s files in the manifest of %s" % (name, out_path))
+        return files
+    manifest = read_manifest(os.path.dirname(path) or '.') or []
+    for entry in manifest:
+        if entry['file'] == os.path.basename(path):
+            parts = [other for other in manifest if entry_name(other) == entry_name(entry)]
+            if len(parts) > 1:
+                raise ValueError("%s is one of %s rotated files, give their output path or %s"
+                                 % (path, len(parts), MANIFEST_FILE))
+    return [path]
+
+
+def open_sql(path):
+    """Open a SQL file written by SQLWriter, compressed or not"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='surrogateescape')
+    return open(path, 'r', encoding='utf-8', errors='surrogateescape')
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+import common
+
+DESC_MSG = 'Generates synthetic GHTorrent, tree, hits and Perceval data to benchmark the scripts'
+
+LANGUAGES = ['JavaScript', 'Python', 'Java', 'Ruby', 'PHP', 'C', 'C++', 'Go', 'Shell', '\\N']
+
+DIRS = ['src', 'lib', 'app', 'static', 'img', 'views', 'models', 'test', 'docs', 'server',
+        'client', 'vendor', 'assets', 'public', 'css', 'js', 'templates', 'config']
+
+NAMES = ['index', 'main', 'utils', 'server', 'client', 'views', 'models', 'urls', 'logo',
+         'README', 'setup', 'app', 'style', 'jquery', 'config', 'test', 'data', 'helpers']
+
+EXTS = ['py', 'js', 'png', 'jpg', 'gif', 'svg', 'txt', 'html', 'json', 'yml', 'md', 'css',
+        'c', 'h', 'java', 'rb', 'php', 'xml', 'sh', '']
+
+
+def main(args):
+    rnd = random.Random(args.seed)
+    out_path = os.path.abspath(args.output_path)
+    for directory in ['trees', 'default', 'perceval']:
+        if not os.path.exists(os.path.join(out_path, directory)):
+            os.makedirs(os.path.join(out_path, directory))
+
+    logger.info("Generating synthetic data into: %s" % out_path)
+    projects = write_projects(rnd, out_path, args.projects)
+    write_users(rnd, out_path, args.users)
+    hits, tree_entries = write_trees(rnd, out_path, projects, args.files_per_tree)
+    commits = write_perceval(rnd, out_path, hits, args.commits_per_repo)
+
+    stats = {
+        'projects': args.projects,
+        'active_projects': len(projects),
+        'users': args.users,
+        'trees': len(projects),
+        'tree_entries': tree_entries,
+        'hits': sum(len(paths) for paths in hits.values()),
+        'repos_with_hits': len(hits),
+        'commits': commits,
+    }
+    with open(os.path.join(out_path, 'stats.json'), 'w') as sfile:
+        json.dump(stats, sfile, indent=4, sort_keys=True)
+    logger.info("Generated: %s" % stats)
+
+
+def sha1(*values):
+    return hashlib.sha1(':'.join(str(value) for value in values).encode('utf-8')).hexdigest()
+
+
+def random_date(rnd, start=2008, end=2018):
+    epoch = rnd.randint(int(time.mktime((start, 1, 1, 0, 0, 0, 0, 0, 0))),
+                        int(time.mktime((end, 1, 1, 0, 0, 0, 0, 0, 0))))
+    return epoch
+
+
+def sql_date(epoch):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(epoch))
+
+
+def write_projects(rnd, out_path, num_projects):
+    """
+    Write projects.csv as in the GHTorrent dump. Return the list of
+    (id, owner_id, owner, name) of the projects not forked nor deleted
+    """
+    projects = []
+    with open(os.path.join(out_path, 'projects.csv'), 'w') as pfile:
+        for project_id in range(1, num_projects + 1):
+            owner_id = rnd.randint(1, max(1, num_projects // 3))
+            owner = 'user%d' % owner_id
+            name = 'repo%d' % project_id
+            forked_from = str(rnd.randint(1, project_id)) if rnd.random() < 0.3 else '\\N'
+            deleted = '1' if rnd.random() < 0.02 else '0'
+            created_at = random_date(rnd)
+            updated_at = min(created_at + rnd.randint(0, 10 ** 8), int(time.time()))
+            language = rnd.choice(LANGUAGES)
+            pfile.write('%d,"https://api.github.com/repos/%s/%s",%d,"%s","Synthetic project, number %d",'
+                        '%s,"%s",%s,%s,"%s"\n' %
+                        (project_id, owner, name, owner_id, name, project_id,
+                         language if language == '\\N' else '"%s"' % language,
+                         sql_date(created_at), forked_from, deleted, sql_date(updated_at)))
+            if forked_from == '\\N' and deleted == '0':
+                projects.append((project_id, owner_id, owner, name))
+    return projects
+
+
+def write_users(rnd, out_path, num_users):
+    """Write users.csv as in the GHTorrent dump"""
+    with open(os.path.join(out_path, 'users.csv'), 'w', newline='') as ufile:
+        writer = csv.writer(ufile)
+        for user_id in range(1, num_users + 1):
+            email = 'dev%d@example.com' % user_id if rnd.random() < 0.5 else '\\N'
+            writer.writerow([user_id, 'user%d' % user_id, 'Developer %d' % user_id,
+                             rnd.choice(['', 'ACME', "O'Reilly", 'URJC']),
+                             rnd.choice(['', 'Madrid', 'Berlin, DE', 'Tokyo']), email,
+                             sql_date(random_date(rnd)), 'USR', 0, 0,
+                             '%.8f' % rnd.uniform(-180, 180), '%.8f' % rnd.uniform(-90, 90),
+                             rnd.choice(['es', 'de', 'jp', '']), '', ''])
+
+
+def random_path(rnd):
+    depth = rnd.randint(0, 4)
+    parts = [rnd.choice(DIRS) for _ in range(depth)]
+    ext = rnd.choice(EXTS)
+    name = rnd.choice(NAMES) + (str(rnd.randint(1, 50)) if rnd.random() < 0.5 else '')
+    parts.append(name + ('.' + ext if ext else ''))
+    return '/'.join(parts)
+
+
+def write_trees(rnd, out_path, projects, files_per_tree):
+    """
+    Write the recursive trees (as returned by the GitHub API) of the
+    projects into trees/, the hits file and the raw URLs file. Return
+    a dictionary with the hit paths of every "owner/name" repo and the
+    number of tree entries
+    """
+    hits = {}
+    tree_entries = 0
+    with open(os.path.join(out_path, 'hits.txt'), 'w') as hfile, \
+            open(os.path.join(out_path, 'urls.txt'), 'w') as ufile:
+        for project_id, owner_id, owner, name in projects:
+            api_url = 'https://api.github.com/repos/%s/%s' % (owner, name)
+            paths = set(random_path(rnd) for _ in range(files_per_tree))
+            tree = []
+            for path in sorted(paths):
+                blob_sha = sha1(project_id, path) if rnd.random() < 0.8 else sha1('vendored', path)
+                tree.append({'path': path, 'mode': '100644', 'type': 'blob', 'sha': blob_sha,
+                             'size': rnd.randint(10, 200000),
+                             'url': '%s/git/blobs/%s' % (api_url, blob_sha)})
+                if '/' in path and rnd.random() < 0.1:
+                    directory = path.rsplit('/', 1)[0]
+                    tree.append({'path': directory, 'mode': '040000', 'type': 'tree',
+                                 'sha': sha1(project_id, directory),
+                                 'url': '%s/git/trees/%s' % (api_url, sha1(project_id, directory))})
+            tree_entries += len(tree)
+            data = {'sha': sha1(project_id, 'tree'), 'url': '%s/git/trees/%s' % (api_url, sha1(project_id)),
+                    'tree': tree, 'truncated': False}
+            json_name = os.path.join(out_path, 'trees', '%s:%s.json' % (owner_id, project_id))
+            with open(json_name, 'w') as tfile:
+                json.dump(data, tfile, indent=2)
+
+            repo_hits = [entry for entry in tree
+                         if entry['type'] == 'blob' and entry['path'].rsplit('.', 1)[-1] in
+                         ('py', 'js', 'png', 'jpg', 'gif', 'jpeg')]
+            if repo_hits:
+                hits['%s/%s' % (owner, name)] = [entry['path'] for entry in repo_hits]
+            for entry in repo_hits:
+                hfile.write("%s, %s\r\n" % (entry['path'], entry['url']))
+                ufile.write("https://raw.githubusercontent.com/%s/%s/master/%s\r\n" %
+                            (owner, name, entry['path']))
+    return hits, tree_entries
+
+
+def write_perceval(rnd, out_path, hits, commits_per_repo):
+    """
+    Write the Perceval JSON file of every repo with hits, formatted as
+    perceval-handler.py does. Return the number of commits
+    """
+    total = 0
+    for repo, paths in sorted(hits.items()):
+        owner, name = repo.split('/')
+        authors = ['Developer %d <dev%d@example.com>' % (num, num)
+                   for num in rnd.sample(range(1, 100000), rnd.randint(1, 10))]
+        date = random_date(rnd, 2010, 2012)
+        items = []
+        for num in range(rnd.randint(1, commits_per_repo)):
+            date += rnd.randint(60, 10 ** 6)
+            commit = sha1(repo, num)
+            author = rnd.choice(authors)
+            changed = rnd.sample(paths, min(len(paths), rnd.randint(1, 5)))
+            files = [{'action': 'M', 'added': str(rnd.randint(0, 100)), 'file': path,
+                      'indexes': [sha1(path, num, 'a')[:7], sha1(path, num, 'b')[:7]],
+                      'modes': ['100644', '100644'], 'removed': str(rnd.randint(0, 100))}
+                     for path in changed]
+            data = {'Author': author, 'AuthorDate': time.strftime('%a %b %d %H:%M:%S %Y +0000', time.gmtime(date)),
+                    'Commit': author, 'CommitDate': time.strftime('%a %b %d %H:%M:%S %Y +0000', time.gmtime(date)),
+                    'commit': commit, 'files': files, 'message': 'Synthetic commit %d' % num,
+                    'parents': [sha1(repo, num - 1)] if num else [], 'refs': []}
+            items.append({'backend_name': 'Git', 'backend_version': '0.8.8', 'category': 'commit',
+                          'data': data, 'origin': 'https://github.com/%s' % repo,
+                          'perceval_version': '0.9.8', 'tag': 'https://github.com/%s' % repo,
+                          'timestamp': time.time(), 'updated_on': float(date), 'uuid': sha1(repo, commit)})
+        total += len(items)
+        json_name = os.path.join(out_path, 'perceval', '%s_%s.json' % (owner, name))
+        with open(json_name, 'w', encoding='utf-8') as jfile:
+            json.dump(items, jfile, indent=4, sort_keys=True)
+    return total
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """Parse arguments from the command line"""
+
+    parser = argparse.ArgumentParser(description=DESC_MSG)
+
+    parser.add_argument('--output-path', dest='output_path', required=True,
+                        help='Path where the synthetic data will be stored')
+    parser.add_argument('--projects', dest='projects', type=int, default=1000,
+                        help='Number of projects')
+    parser.add_argument('--users', dest='users', type=int, default=100000,
+                        help='Number of users')
+    parser.add_argument('--files-per-tree', dest='files_per_tree', type=int, default=200,
+                        help='Number of files of each tree')
+    parser.add_argument('--commits-per-repo', dest='commits_per_repo', type=int, default=100,
+                        help='Max. number of commits of each repo with hits')
+    parser.add_argument('--seed', dest='seed', type=int, default=0,
+                        help='Seed of the random generator')
+    common.add_logging_arguments(parser, 'synthetic-data.log')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    try:
+        args = parse_args()
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        main(args)
+    except Exception as e:
+        logger.exception("Exception message:")
+        s = "Error: %s synthetic-data is exiting now." % str(e)
+        logger.error(s)
+        sys.exit(1)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+import importlib.util
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import urllib.parse
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCRIPTS_PATH = os.path.dirname(os.path.abspath(__file__))
+
+spec = importlib.util.spec_from_file_location('download_files',
+                                              os.path.join(SCRIPTS_PATH, 'download-files.py'))
+download_files = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(download_files)
+
+
+class RawHandler(BaseHTTPRequestHandler):
+    """Serve the file paths asked for as their content. The first request is rate limited"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        if len(self.server.paths) == 1 and self.server.retry_after is not None:
+            self.send_response(429)
+            self.send_header('Retry-After', self.server.retry_after)
+            body = b''
+        else:
+            self.send_response(200)
+            body = urllib.parse.unquote(self.path).encode('utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestDownloadFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.output_path = tempfile.mkdtemp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RawHandler)
+        self.server.paths = []
+        self.server.retry_after = None
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        raw_url = 'http://127.0.0.1:%s' % self.server.server_port
+        self.downloader = download_files.Downloader(self.output_path, raw_url, 2, 10,
+                                                    download_files.RateLimiter(0))
+
+    def tearDown(self):
+        self.downloader.close('http', '127.0.0.1:%s' % self.server.server_port)
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.output_path)
+
+    def test_request_target(self):
+        """'#', '?' and '%' are part of the file path"""
+        self.assertEqual(download_files.request_target(
+            'https://raw.githubusercontent.com/owner/repo/master/C#/what?.md'),
+            ('https', 'raw.githubusercontent.com', '/owner/repo/master/C%23/what%3F.md'))
+        self.assertEqual(download_files.request_target(
+            'https://raw.githubusercontent.com/owner/repo/master/100%.txt'),
+            ('https', 'raw.githubusercontent.com', '/owner/repo/master/100%25.txt'))
+
+    def test_download_special_names(self):
+        for name in ['C#/Program.cs', 'docs/what?.md', '100%.txt', 'a b/ñ.py']:
+            url = download_files.RAW_URL + '/owner/repo/master/' + name
+            status, sha, size = self.downloader.download(url)
+            self.assertEqual(status, 200)
+            expected = ('/owner/repo/master/' + name).encode('utf-8')
+            self.assertEqual(size, len(expected))
+            self.assertEqual(sha, download_files.blob_sha(expected))
+
+    def test_retry_after(self):
+        self.server.retry_after = '2'
+        start = time.time()
+        status, _, _ = self.downloader.download(download_files.RAW_URL + '/owner/repo/master/a.py')
+        self.assertEqual(status, 200)
+        self.assertEqual(len(self.server.paths), 2)
+        # Exponential backoff would have waited 1 s
+        self.assertGreaterEqual(time.time() - start, 2)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(download_files.retry_after('7'), 7)
+        self.assertIsNone(download_files.retry_after(None))
+        self.assertIsNone(download_files.retry_after('soon'))
+        self.assertEqual(download_files.retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+
+import common
+import jsoncodec
+import metrics
+
+DESC_MSG = 'Builds a compact index of the paths of the Git-trees and evaluates heuristics over it'
+
+COMMANDS = ['build', 'hits', 'extensions', 'keywords']
+
+
+def main(args):
+    jsoncodec.use(args.json_codec)
+    import pathindex
+
+    if args.command == 'build':
+        build(args, pathindex)
+        return
+
+    import yaml
+
+    heuristics = None
+    if args.heuristics_file:
+        with open(os.path.abspath(args.heuristics_file), 'r') as hfile:
+            heuristics = yaml.safe_load(hfile)
+
+    start = time.perf_counter()
+    index = pathindex.PathIndex(args.index_path)
+    logger.info("Index of %s files (%s trees) opened in %.3f s"
+                % (len(index), len(index.trees), time.perf_counter() - start))
+
+    start = time.perf_counter()
+    hits = index.hits(heuristics) if heuristics else None
+    if hits is not None:
+        metrics.incr('hits', int(hits.sum()))
+        logger.info("Heuristics evaluated in %.3f s: %s hits"
+                    % (time.perf_counter() - start, int(hits.sum())))
+
+    if args.command == 'hits':
+        if args.output_format == 'records':
+            write_hit_records(index, hits, args.out_file)
+            return
+        with open(args.out_file, 'w') as ofile:
+            for path, url, _, _ in index.iter_hits(hits):
+                try:
+                    ofile.write("%s, %s\r\n" % (path, url))
+                except UnicodeEncodeError:
+                    logger.error("UnicodeEncodeError in path: %r" % path)
+        return
+
+    writer = csv.writer(sys.stdout)
+    if args.command == 'extensions':
+        ext_ids, counts, sizes = index.ext_histogram()
+        header = ['extension', 'files', 'bytes']
+        rows = [[ext, count, size] for ext, count, size
+                in zip((index.exts[ext_id] for ext_id in ext_ids), counts, sizes)]
+        if hits is not None:
+            # Hits per extension, aligned with the rows of all the files
+            hit_counts = dict.fromkeys(ext_ids.tolist(), 0)
+            hit_ext_ids, hit_files, _ = index.ext_histogram(hits)
+            hit_counts.update(zip(hit_ext_ids.tolist(), hit_files.tolist()))
+            header.append('hits')
+            for row, ext_id in zip(rows, ext_ids.tolist()):
+                row.append(hit_counts[ext_id])
+    else:
+        keywords, counts = index.keyword_histogram(heuristics)
+        header = ['keyword', 'files']
+        rows = sorted(zip(keywords, counts), key=lambda row: -row[1])
+
+    if args.top:
+        rows = rows[:args.top]
+    writer.writerow(header)
+    writer.writerows(rows)
+
+
+def write_hit_records(index, hits, out_file):
+    """Write the hits as records (records.py), as github-tree.py --output-format records"""
+    import records
+
+    trees = index.trees.strings()
+    with records.RecordWriter(out_file, 'hit') as ofile:
+        for path, url, tree_id, sha in index.iter_hits(hits):
+            owner_id, repo_id = trees[tree_id][:-5].split(':')
+            # .../repos/<owner>/<repo>/git/blobs/<sha>
+            owner, repo = url.split('/')[4:6]
+            ofile.write(path, url, owner, repo, owner_id, repo_id, sha, False)
+
+
+def build(args, pathindex):
+    """Index the files of every tree of the trees path"""
+
+    logger.info("Looking for JSON files into: %s" % args.trees_path)
+    writer = pathindex.PathIndexWriter(args.index_path)
+    for jsonfile_path in sorted(os.listdir(args.trees_path)):
+        jsonfile = os.path.join(os.path.abspath(args.trees_path), jsonfile_path)
+        logger.debug("Opening %s" % jsonfile)
+        with open(jsonfile, 'rb') as data_file:
+            with metrics.timer('json_decode'):
+                data = jsoncodec.load(data_file)
+        metrics.incr('trees')
+        metrics.incr('bytes_read', os.path.getsize(jsonfile))
+
+        try:
+            tree = data["tree"]
+        except KeyError:
+            logger.warning("KeyError in file: %s" % jsonfile)
+            continue
+
+        metrics.incr('tree_entries', len(tree))
+        tree_id = writer.add_tree(jsonfile_path)
+        for file_dict in tree:
+            # Same files github-tree.py looks at
+            if file_dict["type"] != "tree" and "path" in file_dict and "url" in file_dict:
+                writer.add_file(tree_id, file_dict["path"], file_dict["url"],
+                                file_dict.get("sha", ""), file_dict.get("size", -1))
+
+    with metrics.timer('save'):
+        meta = writer.save()
+    metrics.incr('files', meta['files'])
+    logger.info("Index saved into %s: %s files, %s directories, %s basenames, %s extensions"
+                % (args.index_path, meta['files'], meta['dirs'], meta['bases'], meta['exts']))
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """Parse arguments from the command line"""
+
+    parser = argparse.ArgumentParser(description=DESC_MSG)
+
+    parser.add_argument('command', choices=COMMANDS,
+                        help='build: index the trees, hits: write the hits file of github-tree.py, '
+                             'extensions: files, bytes (and hits) per extension, '
+                             'keywords: files matched by each keyword')
+    parser.add_argument('--index-path', dest='index_path', required=True,
+                        help='Folder of the path index')
+    parser.add_argument('--trees-path', dest='trees_path', required=False,
+                        help='Path to folder containing trees information (build)')
+    parser.add_argument('--heuristics-file', dest='heuristics_file', required=False,
+                        help='File with patterns and other heuristics (hits, extensions, keywords)')
+    parser.add_argument('--output-file', dest='out_file', default='hits.txt',
+                        required=False, help='Path to output hits file (hits)')
+    parser.add_argument('--output-format', dest='output_format', default='text',
+                        choices=['text', 'records'],
+                        help='Hits as "path, url" lines or as typed records (hits)')
+    parser.add_argument('--top', dest='top', type=int, default=0,
+                        help='Only the first TOP rows (extensions, keywords)')
+    common.add_logging_arguments(parser, 'tree-index.log')
+    jsoncodec.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.command == 'build' and not args.trees_path:
+        parser.error('build needs --trees-path')
+    if args.command in ('hits', 'keywords') and not args.heuristics_file:
+        parser.error('%s needs --heuristics-file' % args.command)
+    return args
+
+
+if __name__ == '__main__':
+    try:
+        args = parse_args()
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        metrics.run(main, args)
+    except Exception as e:
+        logger.exception("Exception message:")
+        s = "Error: %s tree-index is exiting now." % str(e)
+        logger.error(s)
+        sys.exit(1)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+import argparse
+import csv
+import logging
+import sys
+
+import common
+import workqueue
+
+DESC_MSG = 'Shows the jobs of the work queue shared by github-api.py or perceval-handler.py processes'
+
+STAGES = ['github-api', 'perceval-handler']
+
+
+def main(args):
+    queue = workqueue.WorkQueue(args.queue_file, args.stage)
+
+    if args.command == 'retry':
+        logger.info("%s failed jobs back into the queue" % queue.retry_failed())
+        return
+
+    writer = csv.writer(sys.stdout)
+    if args.command == 'status':
+        writer.writerow(('state', 'jobs'))
+        writer.writerows(queue.counts().items())
+    else:
+        # Failed jobs with their last error
+        writer.writerow(('key', 'attempts', 'owner', 'error'))
+        writer.writerows(queue.db.execute('SELECT key, attempts, owner, error FROM jobs '
+                                          'WHERE stage = ? AND state = ? ORDER BY key',
+                                          (args.stage, workqueue.FAILED)))
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """Parse arguments from the command line"""
+
+    parser = argparse.ArgumentParser(description=DESC_MSG)
+
+    parser.add_argument('command', choices=['status', 'failed', 'retry'],
+                        help='status: jobs per state, failed: failed jobs and their errors, '
+                             'retry: put the failed jobs back into the queue')
+    parser.add_argument('--queue-file', dest='queue_file', required=True,
+                        help='SQLite work queue (--queue-file of the crawlers)')
+    parser.add_argument('--stage', dest='stage', required=True, choices=STAGES,
+                        help='Stage of the jobs')
+    common.add_logging_arguments(parser, 'work-queue.log')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    try:
+        args = parse_args()
+        keep_fds = common.configure_logging(args.log_file, args.debug_mode_on)
+        main(args)
+    except Exception as e:
+        logger.exception("Exception message:")
+        s = "Error: %s work-queue is exiting now." % str(e)
+        logger.error(s)
+        sys.exit(1)
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2018 Libresoft, GSyC (URJC).
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Miguel Angel Fernandez Sanchez <ma.fernandezsa@alumnos.urjc.es>
+#     Gregorio Robles Martinez <grex@gsyc.urjc.es>
+#
+
+
+"""
+Work queue (SQLite) shared by the processes of a stage of the pipeline.
+
+Every process adds the jobs of its input (jobs already in the queue are
+not added again) and then claims them one by one. A claimed job is
+leased to its worker for a while and the lease is renewed by a heartbeat
+while the job runs, so the jobs of a worker that died are claimed again
+by another one when its lease expires. Failed jobs are retried up to a
+number of attempts, and finished ones are kept as completion records.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from collections import namedtuple
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+STATES = [PENDING, LEASED, DONE, FAILED]
+
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 60
+POLL_SECONDS = 5
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    stage TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    available_at REAL NOT NULL DEFAULT 0,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    finished_at REAL,
+    PRIMARY KEY (stage, key)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (stage, state, priority);
+'''
+
+Job = namedtuple('Job', ['key', 'payload', 'attempts'])
+
+logger = logging.getLogger(__name__)
+
+
+def add_arguments(parser):
+    """Add the work queue options to an argparse parser"""
+    parser.add_argument('--queue-file', dest='queue_file', required=False,
+                        help='SQLite work queue shared by the processes of this stage '
+                             '(on shared storage to spread them across machines)')
+    parser.add_argument('--worker-id', dest='worker_id', required=False,
+                        help='Name of this worker in the queue (host:pid by default)')
+    parser.add_argument('--lease', dest='lease', type=int, default=LEASE_SECONDS,
+                        help='Seconds a job is leased to a worker before others can claim it '
+                             '(renewed while it runs)')
+    parser.add_argument('--max-attempts', dest='max_attempts', type=int, default=MAX_ATTEMPTS,
+                        help='Attempts of a job before it is recorded as failed')
+
+
+def worker_name():
+    """Default id of a worker: host and process id"""
+    return "%s:%s" % (socket.gethostname(), os.getpid())
+
+
+class WorkQueue:
+    """
+    Jobs of a stage in a SQLite queue file. Every thread gets its own
+    connection, so the workers of a process can share the object
+    """
+
+    def __init__(self, path, stage, worker=None, lease=LEASE_SECONDS,
+                 max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+        self.path = path
+        self.stage = stage
+        self.worker = worker or worker_name()
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.local = threading.local()
+        self.db.executescript(SCHEMA)
+
+    @property
+    def db(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            # Autocommit: transactions are opened explicitly with BEGIN IMMEDIATE
+            db = self.local.db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        return db
+
+    def transaction(self):
+        """Write transaction: the queue is locked until it ends"""
+        return Transaction(self.db)
+
+    def add(self, jobs):
+        """
+        Add (key, payload, priority) jobs, skipping those already in the
+        queue whatever their state. Return the number of jobs added
+        """
+        with self.transaction() as db:
+            before = db.total_changes
+            db.executemany('INSERT OR IGNORE INTO jobs (stage, key, payload, priority) '
+                           'VALUES (?, ?, ?, ?)',
+                           ((self.stage, key, json.dumps(payload), priority)
+                            for key, payload, priority in jobs))
+            return db.total_changes - before
+
+    def claim(self):
+        """Lease the next job to this worker. Return None if there is none ready"""
+        now = time.time()
+        with self.transaction() as db:
+            # Jobs of workers that died in their last attempt
+            db.execute('UPDATE jobs SET state = ?, error = ?, finished_at = ? '
+                       'WHERE stage = ? AND state = ? AND lease_until < ? AND attempts >= ?',
+                       (FAILED, 'lease expired', now, self.stage, LEASED, now, self.max_attempts))
+            row = db.execute('SELECT key, payload, attempts FROM jobs '
+                             'WHERE stage = ? AND ((state = ? AND available_at <= ?) '
+                             'OR (state = ? AND lease_until < ?)) '
+                             'ORDER BY priority DESC, key LIMIT 1',
+                             (self.stage, PENDING, now, LEASED, now)).fetchone()
+            if row is None:
+                return None
+            key, payload, attempts = row
+            db.execute('UPDATE jobs SET state = ?, owner = ?, lease_until = ?, attempts = ? '
+                       'WHERE stage = ? AND key = ?',
+                       (LEASED, self.worker, now + self.lease, attempts + 1, self.stage, key))
+        return Job(key, json.loads(payload), attempts + 1)
+
+    def heartbeat(self, job):
+        """Renew the lease of a job. Return False if it was lost to another worker"""
+        with self.transaction() as db:
+            cursor = db.execute('UPDATE jobs SET lease_until = ? '
+                                'WHERE stage = ? AND key = ? AND state = ? AND owner = ?',
+                                (time.time() + self.lease, self.stage, job.key,
+                                 LEASED, self.worker))
+            return cursor.rowcount == 1
+
+    def complete(self, job, result=None):
+        """Record a job as done (unless another worker took it over)"""
+        with self.transaction() as db:
+            db.execute('UPDATE jobs SET state = ?, result = ?, error = NULL, finished_at = ? '
+                       'WHERE stage = ? AND key = ? AND state = ? AND owner = ?',
+                       (DONE, result, time.time(), self.stage, job.key, LEASED, self.worker))
+
+    def fail(self, job, error):
+        """Give a job back to be retried later, or record it as failed after its last attempt"""
+        now = time.time()
+        with self.transaction() as db:
+            if job.attempts >= self.max_attempts:
+                db.execute('UPDATE jobs SET state = ?, error = ?, finished_at = ? '
+                           'WHERE stage = ? AND key = ? AND state = ? AND owner = ?',
+                           (FAILED, error, now, self.stage, job.key, LEASED, self.worker))
+            else:
+                db.execute('UPDATE jobs SET state = ?, error = ?, available_at = ? '
+                           'WHERE stage = ? AND key = ? AND state = ? AND owner = ?',
+                           (PENDING, error, now + self.retry_delay * job.attempts,
+                            self.stage, job.key, LEASED, self.worker))
+
+    def retry_failed(self):
+        """Put the failed jobs back into the queue. Return how many"""
+        with self.transaction() as db:
+            cursor = db.execute('UPDATE jobs SET state = ?, attempts = 0, available_at = 0 '
+                                'WHERE stage = ? AND state = ?', (PENDING, self.stage, FAILED))
+            return cursor.rowcount
+
+    def close(self):
+        """Close the connection of the calling thread"""
+        db = getattr(self.local, 'db', None)
+        if db is not None:
+            db.close()
+            self.local.db = None
+
+    def counts(self):
+        """Number of jobs in every state"""
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self.db.execute('SELECT state, COUNT(*) FROM jobs WHERE stage = ? '
+                                      'GROUP BY state', (self.stage,)))
+        return counts
+
+    def work(self, handler, poll=POLL_SECONDS):
+        """
+        Claim jobs and run handler(job) until the queue is drained. What
+        the handler returns is recorded as the result of the job, an
+        exception makes it fail. While other workers hold leases (or jobs
+        wait to be retried), wait for them: their jobs come back to the
+        queue if they die
+        """
+        while True:
+            job = self.claim()
+            if job is None:
+                counts = self.counts()
+                if not counts[PENDING] and not counts[LEASED]:
+                    return
+                time.sleep(poll)
+                continue
+
+            beat = Heartbeat(self, job)
+            beat.start()
+            try:
+                result = handler(job)
+            except Exception as e:
+                logger.error("Job %s failed (attempt %s): %s" % (job.key, job.attempts, str(e)))
+                self.fail(job, str(e))
+            else:
+                self.complete(job, result)
+            finally:
+                beat.stop()
+
+
+class Transaction:
+    """BEGIN IMMEDIATE ... COMMIT (or ROLLBACK on errors)"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+class Heartbeat(threading.Thread):
+    """Renew the lease of a job every third of the lease while it runs"""
+
+    def __init__(self, queue, job):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.job = job
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.queue.lease / 3):
+                try:
+                    if not self.queue.heartbeat(self.job):
+                        logger.warning("Lease of job %s lost" % self.job.key)
+                        return
+                except sqlite3.Error as e:
+                    logger.warning("Heartbeat of job %s failed: %s" % (self.job.key, str(e)))
+        finally:
+            self.queue.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()